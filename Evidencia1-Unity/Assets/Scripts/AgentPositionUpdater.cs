@@ -1,5 +1,7 @@
 using System.Collections;
 using System.Collections.Generic;
+using System.IO;
+using System.Text;
 using UnityEngine;
 using UnityEngine.Networking;
 
@@ -43,8 +45,71 @@ public class TrafficLightStateList
     public TrafficLightState[] trafficLights;
 }
 
+// Evento del stream /stream del servidor: estado completo o sólo lo que cambió
+[System.Serializable]
+public class StreamFrame
+{
+    public int seq;
+    public bool keyframe;
+    public CarPosition[] cars;
+    public TrafficLightState[] lights;
+}
+
+// Respuesta de /frames: los cuadros que el cliente no ha visto, en orden
+[System.Serializable]
+public class StreamFrameList
+{
+    public StreamFrame[] frames;
+}
+
+// Lee el stream de server-sent events y entrega cada evento completo
+public class FrameStreamHandler : DownloadHandlerScript
+{
+    private readonly AgentPositionUpdater owner;
+    private readonly StringBuilder pending = new StringBuilder();
+
+    public FrameStreamHandler(AgentPositionUpdater owner) : base(new byte[4096])
+    {
+        this.owner = owner;
+    }
+
+    protected override bool ReceiveData(byte[] data, int dataLength)
+    {
+        pending.Append(Encoding.UTF8.GetString(data, 0, dataLength));
+        string text = pending.ToString();
+        int end;
+        while ((end = text.IndexOf("\n\n")) >= 0)
+        {
+            foreach (string line in text.Substring(0, end).Split('\n'))
+            {
+                if (line.StartsWith("data: "))
+                {
+                    owner.ApplyStreamFrame(line.Substring(6));
+                }
+            }
+            text = text.Substring(end + 2);
+        }
+        pending.Clear();
+        pending.Append(text);
+        return true;
+    }
+}
+
+// Registro del formato binario compacto del servidor (ver wire.py)
+public struct FrameRecord
+{
+    public int id;
+    public short x;
+    public short y;
+    public byte state;
+    public bool isCar;
+}
+
 public class AgentPositionUpdater : MonoBehaviour
 {
+    private const string BinaryContentType = "application/x-evidencia-frame";
+    private static readonly string[] StateNames = { "", "green", "yellow", "red" };
+
     // Creamos un diccionario para almacenar los GameObjects de los agentes Car y TrafficLight
     private Dictionary<string, GameObject> carObjects = new Dictionary<string, GameObject>();
     private Dictionary<string, GameObject> trafficLightObjects = new Dictionary<string, GameObject>();
@@ -52,6 +117,26 @@ public class AgentPositionUpdater : MonoBehaviour
     public Material redMaterial; 
     public Material greenMaterial;
 
+    // Pedir posiciones y estados en formato binario en lugar de JSON
+    public bool useBinaryFormat = false;
+
+    // Recibir los cuadros por /stream en lugar de consultar al servidor cada segundo
+    public bool useStreaming = false;
+
+    // Consultar /frames?since=<paso> para aplicar todos los cuadros perdidos
+    // en lugar de sólo el estado más reciente
+    public bool useFrameHistory = false;
+
+    // Último paso aplicado desde el stream o el historial
+    private int lastSeq = -1;
+
+    // Sesión del relay a visualizar; vacío usa la sesión por defecto
+    public string sessionId = "";
+
+    // Último ETag recibido por endpoint; el servidor responde 304 si nada cambió
+    private string carPositionsETag;
+    private string trafficLightStatesETag;
+
     void Start()
     {
         DontDestroyOnLoad(gameObject); // Asegúrate de que este GameObject persista entre escenas
@@ -76,9 +161,80 @@ public class AgentPositionUpdater : MonoBehaviour
                 trafficLightObjects[trafficLightId] = trafficLightObject;
             }
         }
-        StartCoroutine(GetAgentPositions());
         StartCoroutine(SetInitialTrafficLightPositions());
-        StartCoroutine(UpdateTrafficLightStates());
+        if (useStreaming)
+        {
+            StartCoroutine(StreamFrames());
+        }
+        else if (useFrameHistory)
+        {
+            StartCoroutine(CatchUpFrames());
+        }
+        else
+        {
+            StartCoroutine(GetAgentPositions());
+            StartCoroutine(UpdateTrafficLightStates());
+        }
+    }
+
+    IEnumerator StreamFrames()
+    {
+        while (true)
+        {
+            UnityWebRequest www = new UnityWebRequest(ServerUrl("/stream"), "GET");
+            www.downloadHandler = new FrameStreamHandler(this);
+            yield return www.SendWebRequest();
+
+            // La conexión se cerró: reintentar después de un momento
+            Debug.Log(www.error);
+            www.Dispose();
+            yield return new WaitForSeconds(1);
+        }
+    }
+
+    IEnumerator CatchUpFrames()
+    {
+        while (true)
+        {
+            UnityWebRequest www = UnityWebRequest.Get(ServerUrl("/frames?since=" + lastSeq));
+            yield return www.SendWebRequest();
+
+            if (www.result != UnityWebRequest.Result.Success)
+            {
+                Debug.Log(www.error);
+            }
+            else
+            {
+                string jsonString = www.downloadHandler.text;
+                StreamFrameList frameList = JsonUtility.FromJson<StreamFrameList>("{\"frames\":" + jsonString + "}");
+                foreach (StreamFrame frame in frameList.frames)
+                {
+                    ApplyFrame(frame);
+                }
+            }
+            yield return new WaitForSeconds(1); // Tiempo de delay
+        }
+    }
+
+    public void ApplyStreamFrame(string jsonString)
+    {
+        ApplyFrame(JsonUtility.FromJson<StreamFrame>(jsonString));
+    }
+
+    void ApplyFrame(StreamFrame frame)
+    {
+        lastSeq = frame.seq;
+        foreach (CarPosition carPos in frame.cars)
+        {
+            if (carObjects.TryGetValue(carPos.id, out GameObject carObject) && carObject != null && carPos.position != null && carPos.position.Length == 2)
+            {
+                carObject.transform.position = new Vector3(carPos.position[0], 0, carPos.position[1]);
+            }
+        }
+        foreach (TrafficLightState trafficLightState in frame.lights)
+        {
+            ApplyTrafficLightState(trafficLightState.id, trafficLightState.state);
+        }
     }
 
     IEnumerator GetAgentPositions()
@@ -86,13 +242,35 @@ public class AgentPositionUpdater : MonoBehaviour
         while (true)
         {
             // Obtenemos y actualizamos las posiciones de coches
-            UnityWebRequest www = UnityWebRequest.Get("http://127.0.0.1:5000/get_car_positions");
+            UnityWebRequest www = UnityWebRequest.Get(ServerUrl("/get_car_positions"));
+            if (useBinaryFormat)
+            {
+                www.SetRequestHeader("Accept", BinaryContentType);
+            }
+            if (carPositionsETag != null)
+            {
+                www.SetRequestHeader("If-None-Match", carPositionsETag);
+            }
             yield return www.SendWebRequest();
 
             if (www.result != UnityWebRequest.Result.Success)
             {
                 Debug.Log(www.error);
             }
+            else if (www.responseCode == 304)
+            {
+                // Sin cambios desde la última consulta
+            }
+            else if (useBinaryFormat)
+            {
+                foreach (FrameRecord record in ReadFrame(www.downloadHandler.data))
+                {
+                    if (record.isCar && carObjects.TryGetValue("car_" + record.id, out GameObject carObject) && carObject != null)
+                    {
+                        carObject.transform.position = new Vector3(record.x, 0, record.y);
+                    }
+                }
+            }
             else
             {
                 string jsonString = www.downloadHandler.text;
@@ -105,12 +283,16 @@ public class AgentPositionUpdater : MonoBehaviour
                     }
                 }
             }
+            if (www.result == UnityWebRequest.Result.Success)
+            {
+                carPositionsETag = www.GetResponseHeader("ETag");
+            }
             yield return new WaitForSeconds(1); // Tiempo de delay
         }
     }
     IEnumerator SetInitialTrafficLightPositions()
     {
-        UnityWebRequest www = UnityWebRequest.Get("http://127.0.0.1:5000/get_traffic_light_positions");
+        UnityWebRequest www = UnityWebRequest.Get(ServerUrl("/get_traffic_light_positions"));
         yield return www.SendWebRequest();
 
         if (www.result != UnityWebRequest.Result.Success)
@@ -135,37 +317,110 @@ public class AgentPositionUpdater : MonoBehaviour
     {
         while (true)
         {
-            UnityWebRequest www = UnityWebRequest.Get("http://127.0.0.1:5000/get_traffic_light_states");
+            UnityWebRequest www = UnityWebRequest.Get(ServerUrl("/get_traffic_light_states"));
+            if (useBinaryFormat)
+            {
+                www.SetRequestHeader("Accept", BinaryContentType);
+            }
+            if (trafficLightStatesETag != null)
+            {
+                www.SetRequestHeader("If-None-Match", trafficLightStatesETag);
+            }
             yield return www.SendWebRequest();
 
             if (www.result != UnityWebRequest.Result.Success)
             {
                 Debug.Log(www.error);
             }
+            else if (www.responseCode == 304)
+            {
+                // Sin cambios desde la última consulta
+            }
+            else if (useBinaryFormat)
+            {
+                foreach (FrameRecord record in ReadFrame(www.downloadHandler.data))
+                {
+                    if (!record.isCar && record.state < StateNames.Length)
+                    {
+                        ApplyTrafficLightState("traffic_light_" + record.id, StateNames[record.state]);
+                    }
+                }
+            }
             else
             {
                 string jsonString = www.downloadHandler.text;
                 TrafficLightStateList trafficLightStates = JsonUtility.FromJson<TrafficLightStateList>("{\"trafficLights\":" + jsonString + "}");
                 foreach (TrafficLightState trafficLightState in trafficLightStates.trafficLights)
                 {
-                    if (trafficLightObjects.TryGetValue(trafficLightState.id, out GameObject trafficLightObject) && trafficLightObject != null)
-                    {
-                        // Acceder a cada esfera por nombre
-                        Transform redSphere = trafficLightObject.transform.Find("red");
-                        Transform yellowSphere = trafficLightObject.transform.Find("yellow");
-                        Transform greenSphere = trafficLightObject.transform.Find("green");
-
-                        // Activar la emisión en el material correspondiente y desactivar los demás
-                        SetEmission(redSphere, trafficLightState.state == "red");
-                        SetEmission(yellowSphere, trafficLightState.state == "yellow");
-                        SetEmission(greenSphere, trafficLightState.state == "green");
-                    }
+                    ApplyTrafficLightState(trafficLightState.id, trafficLightState.state);
                 }
             }
+            if (www.result == UnityWebRequest.Result.Success)
+            {
+                trafficLightStatesETag = www.GetResponseHeader("ETag");
+            }
             yield return new WaitForSeconds(1); // Tiempo de delay
         }
     }
 
+    string ServerUrl(string endpoint)
+    {
+        string baseUrl = "http://127.0.0.1:5000";
+        if (!string.IsNullOrEmpty(sessionId))
+        {
+            baseUrl += "/sessions/" + UnityWebRequest.EscapeURL(sessionId);
+        }
+        return baseUrl + endpoint;
+    }
+
+    void ApplyTrafficLightState(string id, string state)
+    {
+        if (trafficLightObjects.TryGetValue(id, out GameObject trafficLightObject) && trafficLightObject != null)
+        {
+            // Acceder a cada esfera por nombre
+            Transform redSphere = trafficLightObject.transform.Find("red");
+            Transform yellowSphere = trafficLightObject.transform.Find("yellow");
+            Transform greenSphere = trafficLightObject.transform.Find("green");
+
+            // Activar la emisión en el material correspondiente y desactivar los demás
+            SetEmission(redSphere, state == "red");
+            SetEmission(yellowSphere, state == "yellow");
+            SetEmission(greenSphere, state == "green");
+        }
+    }
+
+    List<FrameRecord> ReadFrame(byte[] data)
+    {
+        // Encabezado: magia "EV", versión, banderas, seq, base_seq, #coches, #semáforos (little-endian)
+        List<FrameRecord> records = new List<FrameRecord>();
+        using (BinaryReader reader = new BinaryReader(new MemoryStream(data)))
+        {
+            byte[] magic = reader.ReadBytes(2);
+            if (magic.Length != 2 || magic[0] != (byte)'E' || magic[1] != (byte)'V')
+            {
+                Debug.Log("Cuadro binario con formato desconocido");
+                return records;
+            }
+            reader.ReadByte(); // versión
+            reader.ReadByte(); // banderas
+            reader.ReadInt32(); // seq
+            reader.ReadInt32(); // base_seq
+            uint carCount = reader.ReadUInt32();
+            uint lightCount = reader.ReadUInt32();
+            for (uint i = 0; i < carCount + lightCount; i++)
+            {
+                FrameRecord record = new FrameRecord();
+                record.id = reader.ReadInt32();
+                record.x = reader.ReadInt16();
+                record.y = reader.ReadInt16();
+                record.state = reader.ReadByte();
+                record.isCar = i < carCount;
+                records.Add(record);
+            }
+        }
+        return records;
+    }
+
     void SetEmission(Transform sphere, bool shouldEmit)
     {
         if (sphere != null)
@@ -0,0 +1,123 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import importlib
+import itertools
+import sys
+import time
+
+import simlog
+
+# Corridas por lotes de City sin visualización ni servidor: barridos de
+# parámetros con réplicas repartidas entre varios procesos. Cada corrida
+# produce una fila con sus parámetros, su semilla y las métricas de
+# City.summary(), de modo que el resultado es una tabla ordenada.
+#
+#   python batch.py --model tarea --replicates 20 \
+#       --param cycle_time=20,30,40 --param emergency_rate=0,0.05,0.1 \
+#       --param num_cars=5,10,17 --output resultados.csv
+
+MODELS = ('tarea', 'main')
+
+
+def parameter_grid(axes):
+    """ {'cycle_time': [20, 30]} -> [{'cycle_time': 20}, {'cycle_time': 30}] """
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))]
+
+
+def run_simulation(model_name, params, seed, replicate=0, width=24, height=24, map_seed=None):
+    """ Corre una simulación completa con la telemetría apagada y devuelve su fila.
+
+    Con map_seed la corrida usa un mapa generado de width x height en lugar
+    del mapa fijo; todas las réplicas comparten ese mapa.
+    """
+    module = importlib.import_module(model_name)
+    start = time.perf_counter()
+    city_map = None
+    if map_seed is not None:
+        from citygen import generate_city
+        city_map = generate_city(width, height, map_seed)
+    city = module.City(width, height, telemetry='off', seed=seed, city_map=city_map, **params)
+    while city.running:
+        city.step()
+    elapsed = time.perf_counter() - start
+    row = {"model": model_name, "replicate": replicate, "seed": seed}
+    if map_seed is not None:
+        row["map_seed"] = map_seed
+    row.update(params)
+    row.update(city.summary())
+    row["wall_time"] = round(elapsed, 4)
+    return row
+
+
+def run_batch(model_name, axes, replicates=1, base_seed=0, max_workers=None, width=24, height=24, log_level='ERROR',
+              map_seed=None):
+    """ Corre cada combinación de parámetros replicates veces en un ProcessPoolExecutor.
+
+    La réplica r de todas las combinaciones usa la semilla base_seed + r,
+    para que las combinaciones se comparen con los mismos números aleatorios.
+    Las filas se devuelven en el orden de la rejilla, no en el de término.
+    Cada proceso configura el registro de la simulación con log_level.
+    """
+    if model_name not in MODELS:
+        raise ValueError(f"Modelo desconocido: {model_name}")
+    jobs = [(params, replicate) for params in parameter_grid(axes) for replicate in range(replicates)]
+    with ProcessPoolExecutor(max_workers, initializer=simlog.configure, initargs=(log_level,)) as pool:
+        futures = [pool.submit(run_simulation, model_name, params, base_seed + replicate, replicate, width, height,
+                               map_seed)
+                   for params, replicate in jobs]
+        return [future.result() for future in futures]
+
+
+def write_csv(rows, output):
+    fieldnames = []
+    for row in rows:
+        fieldnames.extend(key for key in row if key not in fieldnames)
+    writer = csv.DictWriter(output, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def parse_value(text):
+    if text == 'None':
+        return None
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+
+def parse_param(text):
+    """ 'cycle_time=20,30,40' -> ('cycle_time', [20, 30, 40]) """
+    name, _, values = text.partition('=')
+    if not name or not values:
+        raise argparse.ArgumentTypeError(f"Se esperaba nombre=valor1,valor2,...: {text}")
+    return name, [parse_value(value) for value in values.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Barridos de parámetros de City sin visualización")
+    parser.add_argument('--model', choices=MODELS, default='tarea')
+    parser.add_argument('--param', type=parse_param, action='append', default=[],
+                        help="parámetro de City y sus valores, p. ej. cycle_time=20,30,40 (se puede repetir)")
+    parser.add_argument('--replicates', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0, help="semilla de la primera réplica")
+    parser.add_argument('--workers', type=int, default=None, help="procesos; por defecto uno por núcleo")
+    parser.add_argument('--width', type=int, default=24)
+    parser.add_argument('--height', type=int, default=24)
+    parser.add_argument('--map-seed', type=int, default=None,
+                        help="usar un mapa generado de --width x --height con esta semilla en lugar del mapa fijo")
+    parser.add_argument('--output', default=None, help="archivo CSV; por defecto la salida estándar")
+    parser.add_argument('--log-level', choices=simlog.LEVELS, default='ERROR', help="nivel de registro en cada proceso")
+    args = parser.parse_args()
+
+    rows = run_batch(args.model, dict(args.param), args.replicates, args.seed, args.workers, args.width, args.height,
+                     args.log_level, args.map_seed)
+    if args.output:
+        with open(args.output, 'w', newline='') as output:
+            write_csv(rows, output)
+    else:
+        write_csv(rows, sys.stdout)
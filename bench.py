@@ -0,0 +1,388 @@
+import argparse
+import datetime
+import gc
+import importlib
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import simlog
+
+# Banco de rendimiento de City: pasos por segundo, pasos de agente por
+# segundo, memoria por agente y consultas de ruta por segundo, escalando la
+# flota, el tamaño del grid y el número de semáforos, para los dos modelos
+# y cada modo de telemetría. Los casos a escala usan mapas de citygen.
+# Cada corrida se agrega a un historial JSON y se compara con la última
+# corrida equivalente, para que una regresión en el camino caliente se note
+# enseguida.
+#
+#   python bench.py                      suite completa, agrega a bench_history.json
+#   python bench.py --quick              menos pasos y una sola repetición
+#   python bench.py --only tarea/off     sólo los casos cuyo nombre empieza así
+#
+# Los casos con telemetría 'sync' o 'batched' necesitan el relay: con
+# --relay-url se usa uno ya levantado; si no, se levanta uno en un puerto
+# libre mientras dura la suite.
+
+log = logging.getLogger("city.bench")
+
+MODELS = ('tarea', 'main')
+TELEMETRY_MODES = ('off', 'sync', 'batched')
+HISTORY_PATH = "bench_history.json"
+
+# Escalas de la suite por defecto
+FLEET_SIZES = (4, 8)  # en el mapa fijo; sin num_cars, un coche por estacionamiento (17)
+DEFAULT_SIZE = 24
+GENERATED_SIZE = 96  # mapa generado para escalar flota y semáforos
+GENERATED_FLEET_SIZES = (25, 50, 100)
+GENERATED_GRID_SIZES = (48, 96, 200)
+GENERATED_LIGHT_RATES = (0.1, 0.5, 1.0)
+GENERATED_CARS = 50
+ENGINE_CARS = 100  # flota para comparar los motores y los modos de destino en el mapa generado
+DESTINATION_MODES = ('euclidean', 'nearest')  # 'random' es el caso de GENERATED_FLEET_SIZES con ENGINE_CARS
+
+ROUTE_QUERIES = 2000  # pares origen-destino por medición de rutas
+ROUTE_GOALS = 20  # destinos distintos entre esos pares, como los estacionamientos
+
+
+def case_name(case):
+    """ Nombre estable de un caso, la llave para comparar corridas del historial. """
+    name = f"{case['model']}/{case['telemetry']}/{case['width']}x{case['height']}"
+    if case['generator'] is not None:
+        name += "/generated"
+        for key, value in sorted(case['generator'].items()):
+            name += f"/{key}={value}"
+    for key, value in sorted(case['params'].items()):
+        name += f"/{key}={value}"
+    return name
+
+
+def make_case(model, telemetry='off', size=DEFAULT_SIZE, generator=None, **params):
+    """ Un caso: modelo, telemetría, tamaño, parámetros de City y, si se quiere
+    un mapa generado, los de citygen.generate_city. """
+    case = {"model": model, "telemetry": telemetry, "width": size, "height": size, "generator": generator,
+            "params": params}
+    case["name"] = case_name(case)
+    return case
+
+
+def default_suite():
+    """ Casos de la suite por modelo: el mapa fijo con cada modo de telemetría y
+    flotas chicas, mapas generados escalando flota, grid y semáforos, los
+    dos motores de coches con la misma activación y los modos de destino. """
+    generated = {"seed": 0}
+    cases = []
+    for model in MODELS:
+        cases += [make_case(model, telemetry=mode) for mode in TELEMETRY_MODES]
+        cases += [make_case(model, num_cars=num_cars) for num_cars in FLEET_SIZES]
+        cases += [make_case(model, size=GENERATED_SIZE, generator=generated, num_cars=num_cars)
+                  for num_cars in GENERATED_FLEET_SIZES]
+        cases += [make_case(model, size=size, generator=generated, num_cars=GENERATED_CARS)
+                  for size in GENERATED_GRID_SIZES if size != GENERATED_SIZE]
+        cases += [make_case(model, size=GENERATED_SIZE, generator=dict(generated, light_rate=light_rate),
+                            num_cars=GENERATED_CARS) for light_rate in GENERATED_LIGHT_RATES]
+        cases += [make_case(model, size=GENERATED_SIZE, generator=generated, num_cars=ENGINE_CARS, engine=engine,
+                            activation='ordered') for engine in ('agents', 'vectorized')]
+        cases += [make_case(model, size=GENERATED_SIZE, generator=generated, num_cars=ENGINE_CARS, destination_mode=mode)
+                  for mode in DESTINATION_MODES]
+    return cases
+
+
+def build_city(case, steps, seed, relay_url=None, session_id=None):
+    from telemetry import TelemetryPublisher
+
+    module = importlib.import_module(case['model'])
+    city_map = None
+    if case['generator'] is not None:
+        from citygen import generate_city
+        city_map = generate_city(case['width'], case['height'], **case['generator'])
+    if case['telemetry'] == 'off':
+        publisher = TelemetryPublisher('off')
+    else:
+        publisher = TelemetryPublisher(case['telemetry'], base_url=relay_url, session_id=session_id)
+    city = module.City(case['width'], case['height'], telemetry=publisher, seed=seed, max_steps=steps,
+                       city_map=city_map, **case['params'])
+    return city, publisher
+
+
+def time_run(case, steps, seed, relay_url=None, session_id=None):
+    """ Construye y corre un caso; devuelve (segundos de construcción, segundos de pasos, pasos de agente). """
+    start = time.perf_counter()
+    city, publisher = build_city(case, steps, seed, relay_url, session_id)
+    built = time.perf_counter()
+    schedule = city.schedule
+    fleet_cars = len(city.fleet) - 1 if city.fleet is not None else 0  # la flota es un agente con muchos coches
+    agent_steps = 0
+    while city.running:
+        agent_steps += schedule.get_agent_count() + fleet_cars
+        city.step()
+    publisher.close()
+    return built - start, time.perf_counter() - built, agent_steps
+
+
+def measure_memory(case, steps, seed):
+    """ Bytes reservados por el modelo, por agente programado, y el pico durante los pasos.
+
+    También deja cuántos coches y semáforos tuvo el caso, que en los mapas
+    generados dependen del mapa.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        city, publisher = build_city(case, steps, seed)
+        model_bytes = tracemalloc.get_traced_memory()[0]
+        agents = city.schedule.get_agent_count() + (len(city.fleet) - 1 if city.fleet is not None else 0)
+        cars, lights = len(city.cars), len(city.traffic_lights)
+        tracemalloc.reset_peak()
+        while city.running:
+            city.step()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        publisher.close()
+    finally:
+        tracemalloc.stop()
+    return {
+        "agents": agents,
+        "cars": cars,
+        "lights": lights,
+        "model_bytes": model_bytes,
+        "bytes_per_agent": model_bytes / agents if agents else None,
+        "step_peak_bytes": peak_bytes,
+    }
+
+
+def measure_routes(case, seed, queries=ROUTE_QUERIES, goals=ROUTE_GOALS):
+    """ Consultas por segundo a una RouteTable nueva (frías) y ya memorizada (calientes). """
+    from routing import RouteTable
+
+    city, publisher = build_city(case, 1, seed)
+    graph = city.road_graph
+    roads = [graph.position(node) for node in range(graph.num_nodes) if graph.indptr[node + 1] > graph.indptr[node]]
+    rng = random.Random(seed)
+    destinations = rng.sample(roads, goals)
+    pairs = [(rng.choice(roads), rng.choice(destinations)) for _ in range(queries)]
+
+    table = RouteTable(graph)
+    start = time.perf_counter()
+    for origin, goal in pairs:
+        table.route(origin, goal)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    for origin, goal in pairs:
+        table.route(origin, goal)
+    warm = time.perf_counter() - start
+    publisher.close()
+    return {
+        "route_queries_per_second_cold": queries / cold,
+        "route_queries_per_second_warm": queries / warm,
+        "route_trees_built": table.stats.trees_built,
+    }
+
+
+def run_case(case, steps, repeats, seed=0, relay_url=None):
+    """ Mide un caso: el mejor de repeats para el rendimiento, una pasada para memoria y rutas. """
+    best = None
+    for repeat in range(repeats):
+        session_id = None
+        if case['telemetry'] != 'off':
+            session_id = f"bench-{os.getpid()}-{repeat}"
+        try:
+            timing = time_run(case, steps, seed, relay_url, session_id)
+        finally:
+            if session_id is not None:
+                delete_session(relay_url, session_id)
+        if best is None or timing[1] < best[1]:
+            best = timing
+    setup_seconds, step_seconds, agent_steps = best
+    result = {
+        "name": case['name'],
+        "model": case['model'],
+        "telemetry": case['telemetry'],
+        "width": case['width'],
+        "height": case['height'],
+        "generator": case['generator'],
+        "params": case['params'],
+        "steps": steps,
+        "setup_seconds": setup_seconds,
+        "step_seconds": step_seconds,
+        "steps_per_second": steps / step_seconds,
+        "agent_steps_per_second": agent_steps / step_seconds,
+    }
+    # La memoria y las rutas no dependen de la telemetría
+    if case['telemetry'] == 'off':
+        result.update(measure_memory(case, steps, seed))
+        result.update(measure_routes(case, seed))
+    return result
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_relay(port, timeout=15.0):
+    """ Levanta flaskserver en otro proceso, sin el recargador de depuración. """
+    import requests
+
+    code = "import sys, flaskserver; flaskserver.app.run(port=int(sys.argv[1]), threaded=True)"
+    process = subprocess.Popen([sys.executable, "-c", code, str(port)], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"{url}/sessions", timeout=1.0)
+            return process, url
+        except requests.exceptions.ConnectionError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("No se pudo levantar el relay para los casos con telemetría")
+
+
+def delete_session(relay_url, session_id):
+    import requests
+
+    try:
+        requests.delete(f"{relay_url}/sessions/{session_id}", timeout=2.0)
+    except requests.exceptions.RequestException:
+        pass
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_suite(cases, steps=300, repeats=3, seed=0, relay_url=None):
+    """ Corre los casos y devuelve la entrada del historial. """
+    relay = None
+    if relay_url is None and any(case['telemetry'] != 'off' for case in cases):
+        relay, relay_url = start_relay(free_port())
+    try:
+        results = []
+        for case in cases:
+            log.info("Midiendo %s", case['name'])
+            results.append(run_case(case, steps, repeats, seed, relay_url))
+    finally:
+        if relay is not None:
+            relay.terminate()
+            relay.wait()
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "steps": steps,
+        "repeats": repeats,
+        "seed": seed,
+        "results": results,
+    }
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as source:
+        return json.load(source)
+
+
+def save_history(history, path):
+    with open(path, 'w') as output:
+        json.dump(history, output, indent=1)
+
+
+# Una corrida sólo se compara con otra que midió lo mismo
+RUN_CONFIG_KEYS = ("steps", "repeats", "seed")
+CASE_CONFIG_KEYS = ("model", "telemetry", "width", "height", "generator", "params")
+
+
+def scenarios(entry):
+    """ Nombres de los casos de una corrida; cambia con --only. """
+    return sorted(result["name"] for result in entry["results"])
+
+
+def baseline(history, current):
+    """ Última corrida del historial con los mismos pasos, repeticiones, semilla y casos que current, o None. """
+    cases = scenarios(current)
+    for entry in reversed(history):
+        if all(entry.get(key) == current[key] for key in RUN_CONFIG_KEYS) and scenarios(entry) == cases:
+            return entry
+    return None
+
+
+def compare(history, current, threshold=0.10):
+    """ Casos cuyo rendimiento cayó más de threshold respecto a la última corrida equivalente.
+
+    Se busca hacia atrás en el historial la última corrida con la misma
+    configuración y el mismo conjunto de casos (ver baseline) y, dentro de
+    ella, cada caso se compara con el del mismo nombre sólo si también
+    coincide su configuración. Devuelve (nombre, métrica, antes, ahora).
+    """
+    previous = baseline(history, current)
+    if previous is None:
+        return []
+    before = {result["name"]: result for result in previous["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = before.get(result["name"])
+        if old is None or any(old.get(key) != result.get(key) for key in CASE_CONFIG_KEYS):
+            continue
+        for metric in ("steps_per_second", "route_queries_per_second_warm"):
+            if metric in result and metric in old and result[metric] < old[metric] * (1 - threshold):
+                regressions.append((result["name"], metric, old[metric], result[metric]))
+    return regressions
+
+
+def format_results(entry):
+    lines = [f"{'caso':<60} {'pasos/s':>10} {'agente-pasos/s':>15} {'B/agente':>10} {'rutas/s':>10}"]
+    for result in entry["results"]:
+        memory = f"{result['bytes_per_agent']:.0f}" if result.get("bytes_per_agent") is not None else "-"
+        routes = f"{result['route_queries_per_second_warm']:.0f}" if "route_queries_per_second_warm" in result else "-"
+        lines.append(f"{result['name']:<60} {result['steps_per_second']:10.0f} "
+                     f"{result['agent_steps_per_second']:15.0f} {memory:>10} {routes:>10}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Banco de rendimiento de City")
+    parser.add_argument('--steps', type=int, default=300, help="pasos por corrida")
+    parser.add_argument('--repeats', type=int, default=3, help="repeticiones por caso; se toma la más rápida")
+    parser.add_argument('--quick', action='store_true', help="100 pasos y una repetición")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', action='append', default=[], metavar='PREFIJO',
+                        help="correr sólo los casos cuyo nombre empieza así (se puede repetir)")
+    parser.add_argument('--relay-url', default=None, help="relay ya levantado para los casos con telemetría")
+    parser.add_argument('--history', default=HISTORY_PATH, help="archivo JSON del historial")
+    parser.add_argument('--no-save', action='store_true', help="no agregar la corrida al historial")
+    parser.add_argument('--threshold', type=float, default=0.10, help="caída relativa que cuenta como regresión")
+    args = parser.parse_args()
+
+    simlog.configure('WARNING', {'bench': 'INFO'})
+    steps, repeats = (100, 1) if args.quick else (args.steps, args.repeats)
+    cases = [case for case in default_suite() if not args.only or any(case['name'].startswith(p) for p in args.only)]
+
+    entry = run_suite(cases, steps, repeats, args.seed, args.relay_url)
+    print(format_results(entry))
+
+    history = load_history(args.history)
+    regressions = compare(history, entry, args.threshold)
+    if history and baseline(history, entry) is None:
+        log.info("No hay en el historial una corrida con los mismos pasos, repeticiones, semilla y casos; no se compara")
+    for name, metric, old, new in regressions:
+        log.warning("Regresión en %s: %s bajó de %.0f a %.0f", name, metric, old, new)
+    if not args.no_save:
+        history.append(entry)
+        save_history(history, args.history)
+    sys.exit(1 if regressions else 0)
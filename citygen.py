@@ -0,0 +1,211 @@
+import numpy as np
+
+from routing import RoadGraph
+
+# Generador de ciudades sintéticas del tamaño que se quiera, con la misma
+# semántica que el mapa escrito a mano: calles de dos carriles en un solo
+# sentido, cambio de carril entre celdas vecinas, un anillo perimetral en
+# el sentido de las manecillas del reloj, estacionamientos conectados en
+# ambos sentidos con una celda de calle y semáforos en las celdas de
+# llegada a los cruces, orientados hacia el tráfico que llega.
+#
+#   city_map = generate_city(200, 200, seed=7)
+#   city = tarea.City(200, 200, city_map=city_map)
+#
+# Todo se calcula con arreglos de numpy sobre la rejilla completa: no se
+# crea un objeto de Python por celda, y el grafo sale ya compilado.
+
+# Los mismos códigos que City.cell_type
+CELL_TYPES = {'road': 0, 'building': 1, 'parking': 2, 'roundabout': 3}
+
+# Orientación de un semáforo según el sentido de su calle: mira hacia donde viene el tráfico
+LIGHT_ORIENTATIONS = {(1, 0): 'oeste', (-1, 0): 'este', (0, 1): 'norte', (0, -1): 'sur'}
+
+
+class CityMap:
+    """ Mapa de una ciudad listo para City: grafo compilado y capas estáticas.
+
+    cell_type tiene los códigos de CELL_TYPES por celda; parkings es la
+    lista de posiciones de estacionamiento, lights la de (posición,
+    orientación) de los semáforos y roundabouts la de celdas de glorieta.
+    """
+
+    def __init__(self, width, height, graph, cell_type, parkings, lights, roundabouts=()):
+        self.width = width
+        self.height = height
+        self.graph = graph
+        self.cell_type = cell_type
+        self.parkings = parkings
+        self.lights = lights
+        self.roundabouts = roundabouts
+
+
+class PositionGrid:
+    """ Reemplazo del MultiGrid de Mesa para mapas generados.
+
+    City sólo escribe en el grid (la ocupación de celdas va en arreglos de
+    numpy), y un MultiGrid de 1000x1000 reserva una lista por celda al
+    crearse. Éste guarda sólo las celdas que tienen agentes, con la misma
+    interfaz que City usa: place_agent, move_agent, remove_agent y
+    get_cell_list_contents. No sirve para la visualización de Mesa.
+    """
+
+    def __init__(self, width, height, torus=False):
+        self.width = width
+        self.height = height
+        self.torus = torus
+        self.cells = {}  # (x, y) -> agentes en la celda
+
+    def place_agent(self, agent, pos):
+        self.cells.setdefault(pos, []).append(agent)
+        agent.pos = pos
+
+    def remove_agent(self, agent):
+        agents = self.cells[agent.pos]
+        agents.remove(agent)
+        if not agents:
+            del self.cells[agent.pos]
+        agent.pos = None
+
+    def move_agent(self, agent, pos):
+        self.remove_agent(agent)
+        self.place_agent(agent, pos)
+
+    def get_cell_list_contents(self, cell_list):
+        if isinstance(cell_list, tuple):
+            cell_list = [cell_list]
+        return [agent for pos in cell_list for agent in self.cells.get(pos, ())]
+
+
+def road_lines(size, rng, min_block, max_block):
+    """ Primera fila (o columna) de cada calle de dos carriles a lo largo de un eje.
+
+    Siempre hay una calle en cada borde; entre calles queda una manzana de
+    min_block a max_block celdas, salvo la última, que puede llegar a
+    2 * min_block + 1 si lo que sobra no alcanza para otra calle.
+    """
+    last = size - 2
+    lines = [0]
+    remaining = last - 2  # celdas libres entre la última calle y la del borde
+    while remaining >= 2 * min_block + 2:
+        block = int(rng.integers(min_block, min(max_block, remaining - 2 - min_block) + 1))
+        lines.append(lines[-1] + 2 + block)
+        remaining -= block + 2
+    lines.append(last)
+    return np.array(lines)
+
+
+def line_directions(count, first, last):
+    """ Sentido de cada calle: las interiores alternan, las de los bordes cierran el anillo. """
+    directions = np.where(np.arange(count) % 2 == 0, first, last)
+    directions[0], directions[-1] = first, last
+    return directions
+
+
+def generate_city(width, height, seed=None, min_block=3, max_block=6, parking_rate=0.5, light_rate=0.25,
+                  roundabout_rate=0.05):
+    """ Genera un CityMap de width x height a partir de seed.
+
+    Cada manzana tiene un estacionamiento con probabilidad parking_rate,
+    cada cruce tiene semáforos en sus dos llegadas con probabilidad
+    light_rate, y las manzanas rodeadas por calles que giran en un mismo
+    sentido se vuelven glorietas con probabilidad roundabout_rate.
+    """
+    if min(width, height) < 4 + min_block:
+        raise ValueError(f"El mapa debe medir al menos {4 + min_block} celdas por lado")
+    if not 1 <= min_block <= max_block:
+        raise ValueError("Se necesita 1 <= min_block <= max_block")
+    rng = np.random.default_rng(seed)
+
+    # Calles horizontales (filas ys, ys + 1) y verticales (columnas xs, xs + 1);
+    # el anillo va al este arriba, al sur a la derecha, al oeste abajo y al norte a la izquierda
+    ys = road_lines(height, rng, min_block, max_block)
+    xs = road_lines(width, rng, min_block, max_block)
+    row_dx = line_directions(len(ys), 1, -1)
+    column_dy = line_directions(len(xs), -1, 1)
+
+    # Por fila/columna: sentido de su calle (0 si no es calle) y el carril vecino
+    dx_of_row = np.zeros(height, dtype=np.intc)
+    dx_of_row[ys], dx_of_row[ys + 1] = row_dx, row_dx
+    dy_of_column = np.zeros(width, dtype=np.intc)
+    dy_of_column[xs], dy_of_column[xs + 1] = column_dy, column_dy
+    other_lane_row = np.arange(height)
+    other_lane_row[ys], other_lane_row[ys + 1] = ys + 1, ys
+    other_lane_column = np.arange(width)
+    other_lane_column[xs], other_lane_column[xs + 1] = xs + 1, xs
+
+    x, y = np.meshgrid(np.arange(width), np.arange(height), indexing='ij')
+    horizontal = (dx_of_row != 0)[y]
+    vertical = (dy_of_column != 0)[x]
+    dx = dx_of_row[y]
+    dy = dy_of_column[x]
+
+    def nodes(cx, cy):
+        return cx * height + cy
+
+    sources, targets = [], []
+
+    def connect(mask, tx, ty):
+        inside = mask & (tx >= 0) & (tx < width) & (ty >= 0) & (ty < height)
+        sources.append(nodes(x[inside], y[inside]))
+        targets.append(nodes(tx[inside], ty[inside]))
+
+    # Avanzar en el sentido de la calle; en los cruces, en los dos sentidos
+    connect(horizontal, x + dx, y)
+    connect(vertical, x, y + dy)
+    # Cambio de carril, fuera de los cruces
+    connect(horizontal & ~vertical, x, other_lane_row[y])
+    connect(vertical & ~horizontal, other_lane_column[x], y)
+
+    cell_type = np.where(horizontal | vertical, CELL_TYPES['road'], CELL_TYPES['building']).astype(np.int8)
+
+    # Manzanas: entre dos calles consecutivas de cada eje
+    block_x0, block_y0 = np.meshgrid(xs[:-1] + 2, ys[:-1] + 2, indexing='ij')
+    block_x1, block_y1 = np.meshgrid(xs[1:], ys[1:], indexing='ij')  # exclusivos
+    block_x0, block_y0, block_x1, block_y1 = (a.ravel() for a in (block_x0, block_y0, block_x1, block_y1))
+    i, j = np.meshgrid(np.arange(len(xs) - 1), np.arange(len(ys) - 1), indexing='ij')
+    i, j = i.ravel(), j.ravel()
+
+    # Glorietas: manzanas cuyas cuatro calles giran alrededor en un mismo sentido
+    top, bottom = row_dx[j], row_dx[j + 1]
+    left, right = column_dy[i], column_dy[i + 1]
+    circulates = (top == -bottom) & (right == top) & (left == -top)
+    roundabout = circulates & (rng.random(len(i)) < roundabout_rate)
+    roundabouts = []
+    for bx0, by0, bx1, by1 in zip(block_x0[roundabout], block_y0[roundabout], block_x1[roundabout], block_y1[roundabout]):
+        cell_type[bx0:bx1, by0:by1] = CELL_TYPES['roundabout']
+        roundabouts += [(int(cx), int(cy)) for cx in range(bx0, bx1) for cy in range(by0, by1)]
+
+    # Estacionamientos: una celda del borde de la manzana, junto a una calle
+    has_parking = ~roundabout & (rng.random(len(i)) < parking_rate)
+    side = rng.integers(0, 4, len(i))  # 0 arriba, 1 abajo, 2 izquierda, 3 derecha
+    along_x = block_x0 + (rng.random(len(i)) * (block_x1 - block_x0)).astype(np.intc)
+    along_y = block_y0 + (rng.random(len(i)) * (block_y1 - block_y0)).astype(np.intc)
+    parking_x = np.select([side == 2, side == 3], [block_x0, block_x1 - 1], along_x)[has_parking]
+    parking_y = np.select([side == 0, side == 1], [block_y0, block_y1 - 1], along_y)[has_parking]
+    side = side[has_parking]
+    access_x = parking_x + np.select([side == 2, side == 3], [-1, 1], 0)
+    access_y = parking_y + np.select([side == 0, side == 1], [-1, 1], 0)
+    cell_type[parking_x, parking_y] = CELL_TYPES['parking']
+    sources += [nodes(parking_x, parking_y), nodes(access_x, access_y)]
+    targets += [nodes(access_x, access_y), nodes(parking_x, parking_y)]
+    parkings = list(zip(parking_x.tolist(), parking_y.tolist()))
+
+    # Semáforos: en las dos celdas de llegada de cada calle a un cruce elegido
+    lights = []
+    crossing_x, crossing_y = np.meshgrid(np.arange(len(xs)), np.arange(len(ys)), indexing='ij')
+    lit = rng.random(crossing_x.shape) < light_rate
+    for ci, cj in zip(crossing_x[lit].tolist(), crossing_y[lit].tolist()):
+        column, row = int(xs[ci]), int(ys[cj])
+        lane_dx, lane_dy = int(row_dx[cj]), int(column_dy[ci])
+        # Llegada por la calle horizontal: la columna anterior al cruce en su sentido
+        arrival_x = column - 1 if lane_dx == 1 else column + 2
+        if 0 <= arrival_x < width:
+            lights += [((arrival_x, lane_y), LIGHT_ORIENTATIONS[(lane_dx, 0)]) for lane_y in (row, row + 1)]
+        # Llegada por la calle vertical
+        arrival_y = row - 1 if lane_dy == 1 else row + 2
+        if 0 <= arrival_y < height:
+            lights += [((lane_x, arrival_y), LIGHT_ORIENTATIONS[(0, lane_dy)]) for lane_x in (column, column + 1)]
+
+    graph = RoadGraph.from_edges(width, height, np.concatenate(sources), np.concatenate(targets))
+    return CityMap(width, height, graph, cell_type, parkings, lights, roundabouts)
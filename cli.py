@@ -0,0 +1,122 @@
+import argparse
+import importlib
+
+# Puntos de entrada separados para la simulación:
+#
+#   python cli.py run --model tarea          corre la simulación sin visualización
+#   python cli.py serve --production         levanta el relay para Unity
+#   python cli.py serve --production --workers 4
+#                                            escritor en 5001 y cuatro lectores en 5000
+#   python cli.py visualize --model main     abre la visualización de Mesa
+#
+# Cada comando importa sólo lo que necesita: 'run' no carga Flask ni la
+# visualización de Mesa, y 'serve' no carga Mesa.
+
+MODELS = ('tarea', 'main')
+
+
+def run(model_name, telemetry='off', session_id=None, seed=None, max_steps=None, profiler=None, map_size=None,
+        map_seed=None, num_cars=None, engine='agents', activation=None, destination_mode='random', reservation_ttl=None):
+    from telemetry import TelemetryPublisher
+
+    module = importlib.import_module(model_name)
+    publisher = TelemetryPublisher(telemetry, session_id=session_id)
+    params = {} if max_steps is None else {"max_steps": max_steps}
+    size, city_map = 24, None
+    if map_size is not None:
+        from citygen import generate_city
+        size, city_map = map_size, generate_city(map_size, map_size, map_seed)
+    city = module.City(size, size, telemetry=publisher, seed=seed, profiler=profiler, city_map=city_map,
+                       num_cars=num_cars, engine=engine, activation=activation, destination_mode=destination_mode,
+                       reservation_ttl=reservation_ttl, **params)
+    while city.running:
+        city.step()
+    publisher.close()
+    return city.summary()
+
+
+def serve(host='127.0.0.1', port=5000, production=False, threads=8, workers=1, write_port=5001):
+    import flaskserver
+
+    if production and workers > 1:
+        flaskserver.serve_cluster(host, port, workers, threads, write_port)
+    elif production:
+        flaskserver.serve_production(host, port, threads)
+    else:
+        flaskserver.app.run(debug=True, host=host, port=port)
+
+
+def visualize(model_name, port=8521):
+    importlib.import_module(model_name).visualize(port)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulación de tráfico: correr, servir o visualizar")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="correr la simulación sin visualización")
+    run_parser.add_argument('--model', choices=MODELS, default='tarea')
+    run_parser.add_argument('--telemetry', choices=('off', 'sync', 'batched'), default='off',
+                            help="enviar el estado al relay mientras corre")
+    run_parser.add_argument('--session', default=None, help="sesión del relay a la que se publica")
+    run_parser.add_argument('--seed', type=int, default=None)
+    run_parser.add_argument('--max-steps', type=int, default=None)
+    run_parser.add_argument('--num-cars', type=int, default=None, help="coches al inicio; por defecto uno por estacionamiento")
+    run_parser.add_argument('--map-size', type=int, default=None,
+                            help="usar un mapa generado de este lado en lugar del mapa fijo de 24x24")
+    run_parser.add_argument('--map-seed', type=int, default=None, help="semilla del mapa generado")
+    run_parser.add_argument('--engine', choices=('agents', 'vectorized'), default='agents',
+                            help="un agente por coche o toda la flota en arreglos de numpy")
+    run_parser.add_argument('--activation', choices=('random', 'ordered'), default=None,
+                            help="orden de activación; por defecto 'random' con agentes y 'ordered' con la flota")
+    run_parser.add_argument('--destination-mode', choices=('random', 'euclidean', 'nearest'), default='random',
+                            help="destino de cada coche: un estacionamiento libre al azar, el más cercano en línea recta "
+                                 "o el más cercano por las calles")
+    run_parser.add_argument('--reservation-ttl', type=int, default=None,
+                            help="pasos tras los que vence la reserva de un coche que no ha llegado")
+    run_parser.add_argument('--log-level', default='INFO', help="nivel de registro por defecto (DEBUG, INFO, WARNING, ...)")
+    run_parser.add_argument('--log', action='append', default=[], metavar='SUBSISTEMA=NIVEL',
+                            help="nivel de un subsistema: model, cars, lights, emergency, telemetry o profiler (se puede repetir)")
+    run_parser.add_argument('--events', default=None, help="guardar los registros como JSONL en este archivo")
+    run_parser.add_argument('--profile', action='store_true', help="medir cada fase del paso y mostrar un resumen al final")
+    run_parser.add_argument('--profile-csv', default=None, help="con --profile, una fila por paso en este CSV")
+    run_parser.add_argument('--profile-prometheus', default=None,
+                            help="con --profile, escribir los totales en formato de texto de Prometheus")
+
+    serve_parser = commands.add_parser('serve', help="levantar el relay entre la simulación y Unity")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=5000)
+    serve_parser.add_argument('--production', action='store_true', help="usar waitress en lugar del servidor de desarrollo")
+    serve_parser.add_argument('--threads', type=int, default=8,
+                              help="con --production, hilos para peticiones normales por proceso; cada cliente de "
+                                   "/stream usa uno propio aparte (hasta flaskserver.MAX_STREAM_CLIENTS)")
+    serve_parser.add_argument('--workers', type=int, default=1,
+                              help="con --production y más de 1, procesos lectores que sirven los GET de estado "
+                                   "en --port desde memoria compartida; la simulación publica en --write-port")
+    serve_parser.add_argument('--write-port', type=int, default=5001, help="puerto del proceso escritor con --workers > 1")
+
+    visualize_parser = commands.add_parser('visualize', help="abrir la visualización de Mesa")
+    visualize_parser.add_argument('--model', choices=MODELS, default='tarea')
+    visualize_parser.add_argument('--port', type=int, default=8521)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        import simlog
+
+        simlog.configure(args.log_level, simlog.parse_levels(args.log), events=args.events)
+        profiler = None
+        if args.profile:
+            from profiler import StepProfiler
+            profiler = StepProfiler(args.profile_csv, args.profile_prometheus)
+        try:
+            summary = run(args.model, args.telemetry, args.session, args.seed, args.max_steps, profiler, args.map_size,
+                          args.map_seed, args.num_cars, args.engine, args.activation, args.destination_mode,
+                          args.reservation_ttl)
+        finally:
+            simlog.shutdown()
+        for key, value in summary.items():
+            print(f"{key}: {value}")
+    elif args.command == 'serve':
+        serve(args.host, args.port, args.production, args.threads, args.workers, args.write_port)
+    else:
+        visualize(args.model, args.port)
@@ -1,48 +1,574 @@
-from flask import Flask, request, jsonify
+import argparse
+from collections import deque, namedtuple
+import json
+import multiprocessing
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, request, jsonify, redirect
+
+import snapshots
+import wire
 
 app = Flask(__name__)
 
-# Almacenamos los datos de posición de los agentes
-agent_positions = {}
-traffic_light_states = {}
+# Cada simulación publica en su propia sesión: /sessions/<id>/update_frame,
+# /sessions/<id>/get_car_positions, etc. Las rutas sin prefijo usan la
+# sesión por defecto, que nunca expira.
+DEFAULT_SESSION = "default"
+SESSION_TTL_SECONDS = 300  # sesiones sin actividad durante este tiempo se descartan
+MAX_SESSIONS = 64
+MAX_AGENTS_PER_SESSION = 5000  # coches más semáforos
+MAX_SESSION_ID_LENGTH = 64
+
+# Historial de cuadros por sesión para /frames?since=<paso>
+HISTORY_MAX_FRAMES = 1000
+HISTORY_MAX_BYTES = 4 * 1024 * 1024
+
+SUBSCRIBER_QUEUE_SIZE = 64
+KEEP_ALIVE_SECONDS = 15
+# Cada cliente de /stream ocupa un hilo del servidor mientras está conectado;
+# entre todas las sesiones no se aceptan más de estos
+MAX_STREAM_CLIENTS = 32
+
+# Copia inmutable del estado que leen los GET y el stream. Cada escritura
+# publica una nueva y la reemplaza de una sola vez, así que los lectores no
+# toman el candado y nunca ven una actualización a medias.
+Snapshot = namedtuple('Snapshot', ['version', 'seq', 'cars', 'lights'])
+
+
+class RelayError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def frame_json(seq, cars, lights, keyframe=False):
+    # Listas de objetos, igual que los GET, para que Unity pueda procesarlas con JsonUtility
+    frame = {
+        "seq": seq,
+        "keyframe": keyframe,
+        "cars": [{"id": key, "position": value} for key, value in cars.items()],
+        "lights": [{"id": key, "state": value["state"]} for key, value in lights.items()],
+    }
+    return json.dumps(frame)
+
+def stream_event(text):
+    return f"data: {text}\n\n"
+
+
+class RelaySession:
+    """ Estado de una simulación en el relay.
+
+    Los POST modifican agent_positions y traffic_light_states siempre con
+    lock tomado y al terminar publican un Snapshot nuevo. Los GET y el
+    stream sólo leen el último Snapshot publicado.
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        # Almacenamos los datos de posición de los agentes
+        self.agent_positions = {}
+        self.traffic_light_states = {}
+        self.seq = None  # último cuadro aplicado de la secuencia de deltas
+        self.lock = threading.Lock()
+        self.snapshot = Snapshot(0, None, {}, {})
+
+        # Respuestas de los GET ya serializadas por versión del estado
+        self.response_cache = {}  # (endpoint, formato) -> (versión, cuerpo, mimetype)
+        # Distingue los ETag entre reinicios del servidor y sesiones recreadas
+        self.token = uuid.uuid4().hex[:8]
+
+        # Últimos cuadros aplicados, ya serializados: (base_seq, seq, keyframe, json)
+        self.history = deque()
+        self.history_bytes = 0
+
+        # Suscriptores del stream de eventos: una cola acotada por cliente
+        self.subscribers = []
+        self.subscribers_lock = threading.Lock()
+
+        self.last_used = time.monotonic()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def check_capacity(self, cars, lights, replace=False):
+        """ Rechaza la actualización si la sesión superaría MAX_AGENTS_PER_SESSION. """
+        if replace:
+            total = len(cars) + len(lights)
+        else:
+            total = (len(self.agent_positions) + len(self.traffic_light_states)
+                     + sum(1 for key in cars if key not in self.agent_positions)
+                     + sum(1 for key in lights if key not in self.traffic_light_states))
+        if total > MAX_AGENTS_PER_SESSION:
+            raise RelayError(f"La sesión {self.session_id} superaría {MAX_AGENTS_PER_SESSION} agentes", 413)
+
+    def state_changed(self, cars, lights, keyframe=False, base_seq=None):
+        """ Publica el estado nuevo; con base_seq el cambio también se guarda en el historial. """
+        # Se llama con lock tomado, después de aplicar la actualización
+        self.snapshot = Snapshot(self.snapshot.version + 1, self.seq, dict(self.agent_positions),
+                                 {key: dict(value) for key, value in self.traffic_light_states.items()})
+        if shared_snapshots is not None:
+            shared_snapshots.publish(self.session_id, self.token, self.snapshot)
+        text = None
+        if base_seq is not None:
+            text = frame_json(self.seq, cars, lights, keyframe)
+            self.record_frame(base_seq, keyframe, text)
+        self.broadcast(cars, lights, keyframe, text)
+
+    def record_frame(self, base_seq, keyframe, text):
+        history = self.history
+        history.append((base_seq, self.seq, keyframe, text))
+        self.history_bytes += len(text)
+        while len(history) > HISTORY_MAX_FRAMES or (self.history_bytes > HISTORY_MAX_BYTES and len(history) > 1):
+            self.history_bytes -= len(history.popleft()[3])
+
+    def frames_since(self, since):
+        """ Cuadros posteriores al paso since, en orden.
+
+        Si el historial ya no alcanza a cubrir desde since (el cliente se
+        atrasó más de lo que se guarda) se devuelve un solo cuadro completo
+        con el estado actual.
+        """
+        with self.lock:
+            frames = [entry for entry in self.history if entry[1] > since]
+            if not frames or frames[0][2] or frames[0][0] <= since + 1:
+                return [entry[3] for entry in frames]
+            snapshot = self.snapshot
+        return [frame_json(snapshot.seq, snapshot.cars, snapshot.lights, keyframe=True)]
+
+    def snapshot_event(self):
+        snapshot = self.snapshot
+        return stream_event(frame_json(snapshot.seq, snapshot.cars, snapshot.lights, keyframe=True))
+
+    def broadcast(self, cars, lights, keyframe=False, text=None):
+        # Se codifica una sola vez y se entrega a cada suscriptor
+        with self.subscribers_lock:
+            if not self.subscribers:
+                return
+            event = stream_event(text or frame_json(self.seq, cars, lights, keyframe))
+            for subscriber in self.subscribers:
+                try:
+                    subscriber.put_nowait(event)
+                except queue.Full:
+                    # Cliente lento: descartar lo pendiente y mandarle el estado completo
+                    while not subscriber.empty():
+                        subscriber.get_nowait()
+                    subscriber.put_nowait(self.snapshot_event())
+
+    def close(self):
+        # Termina los streams abiertos de una sesión descartada
+        if shared_snapshots is not None:
+            shared_snapshots.remove(self.session_id)
+        with self.subscribers_lock:
+            for subscriber in self.subscribers:
+                while not subscriber.empty():
+                    subscriber.get_nowait()
+                subscriber.put_nowait(None)
+
+
+class ReplicaSession:
+    """ Sesión vista desde un proceso lector de serve_cluster.
+
+    El estado vive en el proceso escritor, que lo publica en memoria
+    compartida (snapshots.py); aquí sólo se lee el último Snapshot, con el
+    mismo token de ETag, y se cachean las respuestas como en RelaySession.
+    """
+
+    def __init__(self, session_id, reader):
+        self.session_id = session_id
+        self.reader = reader
+        self.response_cache = {}
+        self.token = None
+        self.snapshot = None
+
+    def refresh(self):
+        """ Lee el último Snapshot; False si la sesión ya se cerró. """
+        content = self.reader.read()
+        if content is None:
+            return False
+        if self.snapshot is None or self.snapshot.version != content["version"]:
+            self.token = content["token"]
+            self.snapshot = Snapshot(content["version"], content["seq"], content["cars"], content["lights"])
+        return True
+
+
+sessions = {DEFAULT_SESSION: RelaySession(DEFAULT_SESSION)}
+sessions_lock = threading.Lock()
+stream_slots = threading.BoundedSemaphore(MAX_STREAM_CLIENTS)
 
-@app.route('/update_car_positions', methods=['POST'])
-def update_car_positions():
-    data = request.json
-    agent_positions.update(data)
+# Con serve_cluster: en el proceso escritor, dónde se publican los Snapshot; en
+# los lectores, el prefijo de los segmentos y el puerto del escritor
+shared_snapshots = None
+replica = None  # (prefijo, puerto del escritor)
+replica_sessions = {}
+# Vistas que un proceso lector sirve por sí mismo; el resto se redirige al escritor
+REPLICA_ENDPOINTS = {'get_car_positions', 'get_traffic_light_states', 'get_traffic_light_positions'}
+
+def evict_idle_sessions(now):
+    # Se llama con sessions_lock tomado
+    for session_id, state in list(sessions.items()):
+        if session_id != DEFAULT_SESSION and now - state.last_used > SESSION_TTL_SECONDS:
+            del sessions[session_id]
+            state.close()
+
+def get_replica_session(session_id):
+    with sessions_lock:
+        state = replica_sessions.get(session_id)
+        if state is None:
+            try:
+                reader = snapshots.SnapshotReader(replica[0], session_id)
+            except FileNotFoundError:
+                raise RelayError(f"No existe la sesión {session_id}", 404)
+            state = replica_sessions[session_id] = ReplicaSession(session_id, reader)
+    if not state.refresh():
+        with sessions_lock:
+            if replica_sessions.get(session_id) is state:
+                del replica_sessions[session_id]
+        state.reader.close()
+        raise RelayError(f"No existe la sesión {session_id}", 404)
+    return state
+
+def get_session(session_id, create=False):
+    if replica is not None:
+        return get_replica_session(session_id)
+    with sessions_lock:
+        evict_idle_sessions(time.monotonic())
+        state = sessions.get(session_id)
+        if state is None:
+            if not create:
+                raise RelayError(f"No existe la sesión {session_id}", 404)
+            if len(session_id) > MAX_SESSION_ID_LENGTH:
+                raise RelayError("Identificador de sesión demasiado largo", 400)
+            if len(sessions) >= MAX_SESSIONS:
+                raise RelayError(f"Ya hay {MAX_SESSIONS} sesiones activas", 503)
+            state = sessions[session_id] = RelaySession(session_id)
+            if shared_snapshots is not None:
+                shared_snapshots.publish(session_id, state.token, state.snapshot)
+        state.touch()
+        return state
+
+def relay_route(rule, **options):
+    """ Registra la ruta sin prefijo (sesión por defecto) y su versión /sessions/<id>. """
+    def decorator(view):
+        app.add_url_rule(rule, view_func=view, defaults={"session_id": DEFAULT_SESSION}, **options)
+        app.add_url_rule('/sessions/<session_id>' + rule, view_func=view, **options)
+        return view
+    return decorator
+
+def cached_response(state, name, build, supports_binary=True):
+    # Sin supports_binary el endpoint sólo responde JSON, sin importar Accept
+    binary = supports_binary and wants_binary()
+    snapshot = state.snapshot
+    etag = f"{state.token}-{snapshot.version}-{'bin' if binary else 'json'}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        entry = state.response_cache.get((name, binary))
+        if entry is None or entry[0] != snapshot.version:
+            body, mimetype = build(snapshot, binary)
+            entry = (snapshot.version, body, mimetype)
+            state.response_cache[(name, binary)] = entry
+        response = Response(entry[1], mimetype=entry[2])
+    response.set_etag(etag)
+    if supports_binary:
+        response.vary.add("Accept")
+    return response
+
+def read_frame():
+    # El formato binario se negocia por Content-Type; JSON sigue siendo el predeterminado
+    if request.mimetype == wire.CONTENT_TYPE:
+        return wire.decode_frame(request.get_data())
+    return validate_frame(request.get_json(silent=True))
+
+def validate_frame(frame):
+    """ Revisa un cuadro JSON antes de aplicarlo; ValueError (400) si le falta algo. """
+    if not isinstance(frame, dict):
+        raise ValueError("El cuadro debe ser un objeto JSON")
+    frame.setdefault("base_seq", frame.get("seq"))  # igual que wire.encode_frame
+    for key, kind in (("seq", int), ("base_seq", int), ("keyframe", bool), ("cars", dict), ("lights", dict)):
+        value = frame.get(key)
+        if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+            raise ValueError(f"Cuadro con '{key}' ausente o de tipo incorrecto")
+    for key, position in frame["cars"].items():
+        if not isinstance(position, list) or len(position) != 2:
+            raise ValueError(f"Posición inválida para el coche {key}")
+    for key, light in frame["lights"].items():
+        if not isinstance(light, dict):
+            raise ValueError(f"Semáforo {key} inválido")
+    return frame
+
+def wants_binary():
+    return request.accept_mimetypes[wire.CONTENT_TYPE] > request.accept_mimetypes['application/json']
+
+@app.before_request
+def redirect_writes_to_writer():
+    # En un proceso lector, lo que no es un GET de estado lo atiende el escritor
+    if replica is None or request.endpoint in REPLICA_ENDPOINTS:
+        return None
+    host = request.host.rsplit(':', 1)[0] if not request.host.endswith(']') else request.host
+    query = request.query_string.decode()
+    return redirect(f"{request.scheme}://{host}:{replica[1]}{request.path}" + (f"?{query}" if query else ""), 307)
+
+@app.errorhandler(ValueError)
+def invalid_frame(error):
+    return jsonify({"status": "error", "message": str(error)}), 400
+
+@app.errorhandler(RelayError)
+def relay_error(error):
+    return jsonify({"status": "error", "message": str(error)}), error.status
+
+@relay_route('/update_car_positions', methods=['POST'])
+def update_car_positions(session_id):
+    if request.mimetype == wire.CONTENT_TYPE:
+        data = read_frame()["cars"]
+    else:
+        data = request.json
+    state = get_session(session_id, create=True)
+    with state.lock:
+        state.check_capacity(data, {})
+        state.agent_positions.update(data)
+        state.state_changed(data, {})
     return jsonify({"status": "success"})
 
-@app.route('/get_car_positions', methods=['GET'])
-def get_car_positions():
-    # Convertirmos el diccionario en una lista de objetos para que Unity pueda procesarlo
-    positions_list = [{"id": key, "position": value} for key, value in agent_positions.items()]
-    return jsonify(positions_list)
+@relay_route('/get_car_positions', methods=['GET'])
+def get_car_positions(session_id):
+    def build(snapshot, binary):
+        if binary:
+            return wire.encode_frame({"seq": snapshot.seq, "keyframe": True, "cars": snapshot.cars}), wire.CONTENT_TYPE
+        # Convertirmos el diccionario en una lista de objetos para que Unity pueda procesarlo
+        positions_list = [{"id": key, "position": value} for key, value in snapshot.cars.items()]
+        return app.json.dumps(positions_list), 'application/json'
+    return cached_response(get_session(session_id), 'car_positions', build)
 
-@app.route('/get_traffic_light_states', methods=['GET'])
-def get_traffic_light_states():
-    states_list = [{"id": key, "state": value["state"]} for key, value in traffic_light_states.items()]
-    return jsonify(states_list)
+@relay_route('/get_traffic_light_states', methods=['GET'])
+def get_traffic_light_states(session_id):
+    def build(snapshot, binary):
+        if binary:
+            return wire.encode_frame({"seq": snapshot.seq, "keyframe": True, "lights": snapshot.lights}), wire.CONTENT_TYPE
+        states_list = [{"id": key, "state": value["state"]} for key, value in snapshot.lights.items()]
+        return app.json.dumps(states_list), 'application/json'
+    return cached_response(get_session(session_id), 'traffic_light_states', build)
 
-@app.route('/get_traffic_light_positions', methods=['GET'])
-def get_traffic_light_positions():
-    positions_list = [{"id": key, "position": value["position"]} for key, value in traffic_light_states.items()]
-    return jsonify(positions_list)
+@relay_route('/get_traffic_light_positions', methods=['GET'])
+def get_traffic_light_positions(session_id):
+    def build(snapshot, binary):
+        positions_list = [{"id": key, "position": value["position"]} for key, value in snapshot.lights.items()]
+        return app.json.dumps(positions_list), 'application/json'
+    return cached_response(get_session(session_id), 'traffic_light_positions', build, supports_binary=False)
 
-@app.route('/update_traffic_light_states', methods=['POST'])
-def update_traffic_light_states():
+@relay_route('/update_traffic_light_states', methods=['POST'])
+def update_traffic_light_states(session_id):
     states = request.json
-    for key, data in states.items():
-        if key in traffic_light_states:
-            traffic_light_states[key]["state"] = data["state"]
+    state = get_session(session_id, create=True)
+    with state.lock:
+        lights = state.traffic_light_states
+        for key, data in states.items():
+            if key in lights:
+                lights[key]["state"] = data["state"]
+        state.state_changed({}, {key: lights[key] for key in states if key in lights})
     return jsonify({"status": "states updated"})
 
-@app.route('/set_traffic_light_positions', methods=['POST'])
-def set_traffic_light_positions():
+@relay_route('/update_frame', methods=['POST'])
+def update_frame(session_id):
+    frame = read_frame()
+    state = get_session(session_id, create=True)
+    with state.lock:
+        # Un delta sólo se aplica si continúa la secuencia; si no, pedimos un cuadro completo
+        if not frame["keyframe"] and (state.seq is None or frame["base_seq"] != state.seq + 1):
+            return jsonify({"status": "resync", "seq": state.seq}), 409
+
+        state.check_capacity(frame["cars"], frame["lights"], replace=frame["keyframe"])
+        cars, lights = state.agent_positions, state.traffic_light_states
+        if frame["keyframe"]:
+            cars.clear()
+            lights.clear()
+        cars.update(frame["cars"])
+        for key, data in frame["lights"].items():
+            lights.setdefault(key, {"position": None, "state": "red"}).update(data)
+        state.seq = frame["seq"]
+        if frame["keyframe"]:
+            state.state_changed(cars, lights, keyframe=True, base_seq=frame["base_seq"])
+        else:
+            state.state_changed(frame["cars"], {key: lights[key] for key in frame["lights"]}, base_seq=frame["base_seq"])
+    return jsonify({"status": "frame applied", "seq": frame["seq"]})
+
+@relay_route('/set_traffic_light_positions', methods=['POST'])
+def set_traffic_light_positions(session_id):
     positions = request.json
-    for key, position in positions.items():
-        traffic_light_states[key] = {"position": position, "state": "red"}  # Estado inicial
+    state = get_session(session_id, create=True)
+    with state.lock:
+        state.check_capacity({}, positions)
+        lights = state.traffic_light_states
+        for key, position in positions.items():
+            lights[key] = {"position": position, "state": "red"}  # Estado inicial
+        state.state_changed({}, {key: lights[key] for key in positions})
     return jsonify({"status": "positions set"})
 
+@relay_route('/stream', methods=['GET'])
+def stream(session_id):
+    # Server-sent events: primero el estado completo y luego cada cuadro nuevo
+    state = get_session(session_id)
+    if not stream_slots.acquire(blocking=False):
+        raise RelayError(f"Ya hay {MAX_STREAM_CLIENTS} clientes de stream conectados", 503)
+    subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+    with state.subscribers_lock:
+        subscriber.put_nowait(state.snapshot_event())
+        state.subscribers.append(subscriber)
+
+    def events():
+        while True:
+            try:
+                event = subscriber.get(timeout=KEEP_ALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:  # la sesión expiró o se borró
+                return
+            yield event
+
+    def unsubscribe():
+        with state.subscribers_lock:
+            state.subscribers.remove(subscriber)
+        stream_slots.release()
+
+    response = Response(events(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+    # El suscriptor y su lugar se liberan al cerrar la respuesta, aunque el generador nunca haya empezado
+    response.call_on_close(unsubscribe)
+    return response
+
+@relay_route('/frames', methods=['GET'])
+def frames(session_id):
+    # Todos los cuadros que el cliente no ha visto, en una sola respuesta
+    since = request.args.get('since', -1, type=int)
+    frames_list = get_session(session_id).frames_since(since)
+    return Response("[" + ",".join(frames_list) + "]", mimetype='application/json')
+
+@app.route('/sessions', methods=['GET'])
+def list_sessions():
+    now = time.monotonic()
+    with sessions_lock:
+        evict_idle_sessions(now)
+        listing = [{"id": state.session_id, "seq": state.snapshot.seq,
+                    "cars": len(state.snapshot.cars), "lights": len(state.snapshot.lights),
+                    "idle_seconds": round(now - state.last_used, 1)}
+                   for state in sessions.values()]
+    return jsonify(listing)
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if session_id == DEFAULT_SESSION:
+        raise RelayError("La sesión por defecto no se puede borrar", 400)
+    with sessions_lock:
+        state = sessions.pop(session_id, None)
+    if state is None:
+        raise RelayError(f"No existe la sesión {session_id}", 404)
+    state.close()
+    return jsonify({"status": "session deleted"})
+
+
+def serve_production(host='127.0.0.1', port=5000, threads=8):
+    """ Sirve el relay con waitress: un proceso y un grupo de hilos.
+
+    El estado vive en la memoria del proceso, así que los trabajadores son
+    hilos y no procesos; la simulación escribe con el candado y los lectores
+    sólo copian los bytes ya serializados de la versión vigente. Todo corre
+    en un solo proceso; para repartir los lectores entre núcleos está
+    serve_cluster.
+
+    threads son los hilos para las peticiones normales. Cada cliente de
+    /stream retiene un hilo mientras está conectado, así que se agregan
+    MAX_STREAM_CLIENTS hilos más para ellos y los streams que pasen de ese
+    límite se rechazan con 503 en lugar de dejar sin hilos a los GET y POST.
+    """
+    serve = import_waitress()
+    serve(app, host=host, port=port, threads=threads + MAX_STREAM_CLIENTS)
+
+
+def serve_cluster(host='127.0.0.1', port=5000, workers=4, threads=8, write_port=5001):
+    """ Sirve el relay con un proceso escritor y workers procesos lectores.
+
+    El escritor es serve_production en write_port: recibe los POST de la
+    simulación, lleva el historial y atiende /stream y /frames, y publica
+    el Snapshot de cada sesión en memoria compartida (snapshots.py). Los
+    lectores comparten el socket de port, que el sistema reparte entre
+    ellos, y sirven los GET de estado desde esa memoria sin tomar el
+    candado del escritor; cualquier otra petición la redirigen al escritor
+    con 307. La simulación debe publicar directo en write_port. Los GET en
+    los lectores no cuentan como actividad de la sesión para
+    SESSION_TTL_SECONDS: la mantiene viva la simulación que escribe.
+    """
+    import_waitress()
+    prefix = f"evrelay-{uuid.uuid4().hex[:8]}-"
+    context = multiprocessing.get_context('fork')  # los lectores heredan el socket
+    listener = socket.create_server((host, port))
+    processes = [context.Process(target=run_writer, args=(host, write_port, threads, prefix), name="relay-writer")]
+    processes += [context.Process(target=run_reader, args=(listener, threads, prefix, write_port), name=f"relay-reader-{i}")
+                  for i in range(workers)]
+    for process in processes:
+        process.start()
+    listener.close()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+
+def import_waitress():
+    try:
+        from waitress import serve
+    except ImportError:
+        raise SystemExit("El modo de producción necesita waitress (pip install waitress)")
+    return serve
+
+
+def run_writer(host, port, threads, prefix):
+    global shared_snapshots
+    # Ctrl-C lo atiende serve_cluster, que termina a todos; con terminate() se
+    # sale por el finally para borrar los segmentos
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    shared_snapshots = snapshots.SharedSnapshots(prefix)
+    with sessions_lock:
+        for state in sessions.values():
+            shared_snapshots.publish(state.session_id, state.token, state.snapshot)
+    try:
+        serve_production(host, port, threads)
+    finally:
+        shared_snapshots.close()
+
+
+def run_reader(listener, threads, prefix, write_port):
+    global replica
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    replica = (prefix, write_port)
+    import_waitress()(app, sockets=[listener], threads=threads)
+
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    parser = argparse.ArgumentParser(description="Relay entre la simulación y Unity")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--production', action='store_true', help="usar waitress en lugar del servidor de desarrollo")
+    parser.add_argument('--threads', type=int, default=8, help="hilos para peticiones normales por proceso en modo de "
+                             "producción; el escritor suma uno por cliente de /stream (hasta MAX_STREAM_CLIENTS)")
+    parser.add_argument('--workers', type=int, default=1, help="con --production y más de 1, procesos lectores que "
+                             "sirven los GET de estado en --port; la simulación publica en --write-port")
+    parser.add_argument('--write-port', type=int, default=5001, help="puerto del proceso escritor con --workers > 1")
+    args = parser.parse_args()
+    if args.production and args.workers > 1:
+        serve_cluster(args.host, args.port, args.workers, args.threads, args.write_port)
+    elif args.production:
+        serve_production(args.host, args.port, args.threads)
+    else:
+        app.run(debug=True, host=args.host, port=args.port)
@@ -0,0 +1,267 @@
+import logging
+
+from mesa import Agent
+import numpy as np
+
+car_log = logging.getLogger("city.cars")
+
+# Motores para los coches de City: un agente Car por coche o una sola Fleet
+ENGINES = ('agents', 'vectorized')
+# Orden de activación del scheduler: barajado en cada paso o en el orden en que se agregaron
+ACTIVATIONS = ('random', 'ordered')
+
+
+def resolve_activation(engine, activation, congestion_routing):
+    """ Valida el motor y devuelve la activación; por defecto, la que corresponde al motor. """
+    if engine not in ENGINES:
+        raise ValueError(f"Motor desconocido: {engine}")
+    if activation is None:
+        activation = 'ordered' if engine == 'vectorized' else 'random'
+    if activation not in ACTIVATIONS:
+        raise ValueError(f"Activación desconocida: {activation}")
+    if engine == 'vectorized' and activation != 'ordered':
+        raise ValueError("El motor vectorizado reproduce la activación 'ordered'")
+    if engine == 'vectorized' and congestion_routing:
+        raise ValueError("El motor vectorizado no replanifica por congestión")
+    return activation
+
+
+class Fleet(Agent):
+    """ Todos los coches de City en arreglos de numpy, movidos en bloque.
+
+    Reemplaza a un agente Car por coche: la flota es un solo agente del
+    scheduler que en su step() resuelve el movimiento de todos los coches
+    de una vez. Por coche guarda su id, su celda, sus estacionamientos de
+    salida y de destino, el tramo de su ruta en path_nodes con un cursor,
+    si ya llegó, los pasos que dio y el paso en que llegó.
+
+    El resultado es el mismo que el de los agentes Car activados uno por
+    uno en orden de id, que es el orden de la activación 'ordered' de City:
+    un coche avanza si su siguiente celda no tiene semáforo en rojo y está
+    libre en su turno, es decir, vacía al empezar el paso o desocupada por
+    un coche de id menor que sí avanzó; si varios coches quieren la misma
+    celda libre, entra el de id menor.
+
+    path_nodes es un búfer que crece al doble cuando se llena; las rutas
+    nuevas se escriben en su parte libre. Antes de crecer se compacta:
+    sólo se conserva lo que a cada coche le falta recorrer.
+
+    Los coches de la flota no se colocan en el MultiGrid de Mesa, así que
+    no aparecen en la visualización, y no replanifican por congestión.
+    """
+
+    def __init__(self, unique_id, model, red_state):
+        super().__init__(unique_id, model)
+        graph = model.road_graph
+        self.height = graph.height
+        self.red_state = red_state  # código de rojo en model.signal_state
+        self.route_nodes = {}  # (celda origen, celda destino) -> arreglo de nodos de la ruta
+        parkings = model.parking_agents
+        self.parking_index = model.parking_allocator.index  # mismo orden que model.parking_agents
+        self.parking_nodes = np.array([p.pos[0] * self.height + p.pos[1] for p in parkings], dtype=np.int64)
+
+        self.ids = np.empty(0, dtype=np.int64)
+        self.position = np.empty(0, dtype=np.int64)  # nodo de la celda actual
+        self.start = np.empty(0, dtype=np.int64)  # índice en model.parking_agents
+        self.destination = np.empty(0, dtype=np.int64)  # índice en model.parking_agents, -1 si no tiene
+        self.path_nodes = np.empty(0, dtype=np.int64)  # rutas de todos los coches, una tras otra
+        self.path_used = 0  # path_nodes[:path_used] está en uso; el resto es espacio libre
+        self.path_start = np.empty(0, dtype=np.int64)
+        self.path_length = np.empty(0, dtype=np.int64)
+        self.cursor = np.empty(0, dtype=np.int64)  # siguiente celda: path_nodes[path_start + cursor]
+        self.arrived = np.empty(0, dtype=bool)
+        self.steps_taken = np.empty(0, dtype=np.int64)
+        self.arrival_step = np.empty(0, dtype=np.int64)  # -1 mientras no llega
+
+        # Coche en cada celda (-1 si no hay) y vista plana de model.car_occupancy
+        self.occupant = np.full(graph.num_nodes, -1, dtype=np.int64)
+        self.occupancy = model.car_occupancy.reshape(-1)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def route(self, start, goal):
+        """ Nodos de la ruta de start a goal, desde la tabla de rutas compartida. """
+        route = self.model.route_table.route(start, goal)
+        if not route:
+            car_log.warning("No path found from %s to %s", start, goal)
+        nodes = self.route_nodes.get((start, goal))
+        if nodes is None:
+            nodes = np.asarray(route.node_ids(), dtype=np.int64)
+            self.route_nodes[(start, goal)] = nodes
+        return nodes
+
+    def add_cars(self, cars):
+        """ Agrega coches (id, estacionamiento de salida, estacionamiento de destino), en orden de id. """
+        if not cars:
+            return
+        parking_index = self.parking_index
+        if self.model.lazy_routes:
+            # Sin ruta: replan_without_path la calcula en el primer paso, como Car.step
+            routes = [np.empty(0, dtype=np.int64)] * len(cars)
+        else:
+            routes = [self.route(start.pos, destination.pos) for _, start, destination in cars]
+        lengths = np.array([len(route) for route in routes], dtype=np.int64)
+        count = len(cars)
+        starts = np.array([start.pos[0] * self.height + start.pos[1] for _, start, _ in cars], dtype=np.int64)
+
+        self.path_start = np.concatenate([self.path_start, self.store_routes(routes, lengths)])
+        self.path_length = np.concatenate([self.path_length, lengths])
+        self.ids = np.concatenate([self.ids, np.array([car_id for car_id, _, _ in cars], dtype=np.int64)])
+        self.position = np.concatenate([self.position, starts])
+        self.start = np.concatenate([self.start, np.array(
+            [parking_index[start.unique_id] for _, start, _ in cars], dtype=np.int64)])
+        self.destination = np.concatenate([self.destination, np.array(
+            [parking_index[destination.unique_id] for _, _, destination in cars], dtype=np.int64)])
+        self.cursor = np.concatenate([self.cursor, np.zeros(count, dtype=np.int64)])
+        self.arrived = np.concatenate([self.arrived, np.zeros(count, dtype=bool)])
+        self.steps_taken = np.concatenate([self.steps_taken, np.zeros(count, dtype=np.int64)])
+        self.arrival_step = np.concatenate([self.arrival_step, np.full(count, -1, dtype=np.int64)])
+
+        first = len(self.ids) - count
+        self.occupant[starts] = np.arange(first, len(self.ids))
+        np.add.at(self.occupancy, starts, 1)
+
+    def store_routes(self, routes, lengths):
+        """ Copia las rutas a la parte libre de path_nodes y devuelve dónde empieza cada una. """
+        total = int(lengths.sum())
+        if self.path_used + total > len(self.path_nodes):
+            self.compact_paths()
+            # Crecer al doble deja libre al menos la mitad del búfer, así que
+            # entre dos compactaciones caben tantos nodos como los que se copian
+            needed = self.path_used + total
+            if needed > len(self.path_nodes) // 2:
+                buffer = np.empty(max(2 * needed, 2 * len(self.path_nodes)), dtype=np.int64)
+                buffer[:self.path_used] = self.path_nodes[:self.path_used]
+                self.path_nodes = buffer
+        starts = self.path_used + np.cumsum(lengths) - lengths
+        for start, route in zip(starts.tolist(), routes):
+            self.path_nodes[start:start + len(route)] = route
+        self.path_used += total
+        return starts
+
+    def compact_paths(self):
+        """ Descarta de path_nodes los tramos ya recorridos y las rutas abandonadas. """
+        remaining = np.maximum(self.path_length - self.cursor, 0)
+        remaining[self.arrived | (self.destination < 0)] = 0
+        total = int(remaining.sum())
+        starts = np.cumsum(remaining) - remaining
+        source = np.repeat(self.path_start + self.cursor - starts, remaining) + np.arange(total)
+        self.path_nodes[:total] = self.path_nodes[source]
+        self.path_start = starts
+        self.path_length = remaining
+        self.cursor = np.zeros(len(self.ids), dtype=np.int64)
+        self.path_used = total
+
+    def set_route(self, index, nodes):
+        self.path_start[index] = self.store_routes([nodes], np.array([len(nodes)], dtype=np.int64))[0]
+        self.path_length[index] = len(nodes)
+        self.cursor[index] = 0
+
+    def replan_without_path(self, active):
+        """ Coches activos sin ruta: lo mismo que Car.step cuando se queda sin camino.
+
+        Devuelve la máscara de los que ya no avanzan en este paso porque
+        tuvieron que buscar otro destino.
+        """
+        waiting = np.zeros(len(self.ids), dtype=bool)
+        parkings = self.model.parking_agents
+        for index in np.flatnonzero(active & (self.cursor >= self.path_length)).tolist():
+            position = divmod(int(self.position[index]), self.height)
+            destination = parkings[self.destination[index]]
+            nodes = self.route(position, destination.pos)
+            if len(nodes):
+                self.set_route(index, nodes)
+                continue
+            car_log.warning("Car %s at %s cannot find a path. Looking for a new destination.",
+                            self.ids[index], position)
+            waiting[index] = True
+            unreachable = parkings[self.destination[index]]
+            destination = self.model.find_unique_parking(parkings[self.start[index]], position, int(self.ids[index]))
+            self.model.parking_allocator.release(unreachable)
+            if destination is None:
+                self.destination[index] = -1
+            else:
+                self.destination[index] = self.parking_index[destination.unique_id]
+                self.set_route(index, self.route(position, destination.pos))
+        return waiting
+
+    def reassign(self, car_id):
+        """ Lo mismo que Car.reassign: otro destino, y la ruta se recalcula en el siguiente paso. """
+        index = int(np.searchsorted(self.ids, car_id))
+        position = divmod(int(self.position[index]), self.height)
+        destination = self.model.find_unique_parking(self.model.parking_agents[self.start[index]], position, car_id)
+        self.destination[index] = -1 if destination is None else self.parking_index[destination.unique_id]
+        self.path_length[index] = self.cursor[index]
+
+    def step(self):
+        active = ~self.arrived & (self.destination >= 0)
+        waiting = self.replan_without_path(active)
+        moving = np.flatnonzero(active & ~waiting & (self.cursor < self.path_length))
+        target = self.path_nodes[self.path_start[moving] + self.cursor[moving]]
+
+        # Los semáforos en rojo detienen a quien quiere entrar a su celda
+        green = self.model.signal_state.reshape(-1)[target] != self.red_state
+        moving, target = moving[green], target[green]
+
+        # Sólo puede entrar quien llega después del coche que ocupa la celda (o a una celda
+        # vacía), y de esos, el de id menor; los índices van en orden de id
+        eligible = moving > self.occupant[target]
+        moving, target = moving[eligible], target[eligible]
+        target, first = np.unique(target, return_index=True)
+        moving = moving[first]
+
+        # Quien entra avanza si la celda estaba vacía o si su ocupante también avanza;
+        # las cadenas de ocupantes se resuelven saltando de puntero en puntero
+        state = np.full(len(self.ids), -1, dtype=np.int8)  # 1 avanza, -1 se queda, 0 pendiente
+        blocker = np.full(len(self.ids), -1, dtype=np.int64)
+        blocker[moving] = self.occupant[target]
+        state[moving] = np.where(blocker[moving] < 0, 1, 0)
+        pending = moving[blocker[moving] >= 0]
+        while len(pending):
+            ahead = blocker[pending]
+            decided = state[ahead]
+            done = decided != 0
+            state[pending[done]] = decided[done]
+            pending = pending[~done]
+            blocker[pending] = blocker[blocker[pending]]
+        advances = state[moving] == 1
+        movers, cells = moving[advances], target[advances]
+
+        previous = self.position[movers]
+        self.occupant[previous] = -1
+        self.occupancy[previous] -= 1
+        self.occupant[cells] = movers
+        self.occupancy[cells] += 1
+        self.position[movers] = cells
+        self.cursor[movers] += 1
+        self.steps_taken[movers] += 1
+        self.model.dirty_cars.update(self.ids[movers].tolist())
+
+        # Llegadas: la celda es la del estacionamiento de destino
+        parkings = self.model.parking_agents
+        arrivals = movers[cells == self.parking_nodes[self.destination[movers]]]
+        self.arrived[arrivals] = True
+        self.arrival_step[arrivals] = self.model.step_count + 1
+        allocator = self.model.parking_allocator
+        for index in arrivals.tolist():
+            allocator.claim(parkings[self.destination[index]])
+        if car_log.isEnabledFor(logging.INFO):
+            for index in arrivals.tolist():
+                car_log.info("Car %s has arrived at destination %s", self.ids[index],
+                             divmod(int(self.position[index]), self.height))
+
+    def positions(self, car_ids=None):
+        """ {'car_<id>': [x, y]} de todos los coches o sólo de car_ids; se ignoran los ids que no son de la flota. """
+        indices = slice(None)
+        if car_ids is not None:
+            car_ids = np.fromiter(car_ids, dtype=np.int64)
+            indices = np.minimum(np.searchsorted(self.ids, car_ids), max(len(self.ids) - 1, 0))
+            indices = indices[self.ids[indices] == car_ids] if len(self.ids) else indices[:0]
+        x, y = np.divmod(self.position[indices], self.height)
+        return {f"car_{car_id}": [cx, cy] for car_id, cx, cy in zip(self.ids[indices].tolist(), x.tolist(), y.tolist())}
+
+    def totals(self):
+        """ (coches, llegados, pasos de los llegados, suma de sus pasos de llegada), como City.summary. """
+        arrived = self.arrived
+        return len(self.ids), int(arrived.sum()), int(self.steps_taken[arrived].sum()), int(self.arrival_step[arrived].sum())
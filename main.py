@@ -1,30 +1,59 @@
+import logging
+
 # Importing necessary libraries from Mesa
-import mesa
-import requests
 from mesa import Agent, Model
 from mesa.space import MultiGrid
-from mesa.time import RandomActivation
-import random
-from mesa.visualization.modules import CanvasGrid, ChartModule
-from mesa.visualization.ModularVisualization import ModularServer
-import heapq
+from mesa.time import BaseScheduler, RandomActivation
+import numpy as np
+from citygen import PositionGrid
+from fleet import Fleet, resolve_activation
+from parking import DESTINATION_MODES, ParkingAllocator
+from routing import DStarLite, Route, RouteTable, compile_connections
+from telemetry import TelemetryPublisher, merge_frames
+
+# Registro por subsistema; los niveles se configuran con simlog.configure()
+model_log = logging.getLogger("city.model")
+car_log = logging.getLogger("city.cars")
+
+# Códigos de estado de los semáforos en el arreglo de señales de City
+SIGNAL_STATES = {'green': 1, 'yellow': 2, 'red': 3}
+
+# Códigos de los elementos estáticos del mapa en el arreglo de tipos de celda de City
+CELL_TYPES = {'road': 0, 'building': 1, 'parking': 2, 'roundabout': 3}
 
 # Defining the agents
-class Building(Agent):
+class CityAgent(Agent):
+    """ Agente de Mesa con __slots__ para sus atributos.
+
+    Agent no declara __slots__, así que cada instancia sigue teniendo un
+    __dict__; los slots sólo sacan de él los atributos declarados aquí y en
+    las subclases. El ahorro de memoria por agente es pequeño.
+    """
+    __slots__ = ('unique_id', 'model', 'pos')
+
+class Building(CityAgent):
+  __slots__ = ()
+
   def __init__(self, unique_id, model):
       super().__init__(unique_id, model)
 
-class Parking(Agent):
+class Parking(CityAgent):
+  __slots__ = ('occupied',)
+
   def __init__(self, unique_id, model):
       super().__init__(unique_id, model)
       self.occupied = False
 
-class Roundabout(Agent):
+class Roundabout(CityAgent):
+  __slots__ = ()
+
   def __init__(self, unique_id, model):
       super().__init__(unique_id, model)
 
-class TrafficLightAgent(Agent):
+class TrafficLightAgent(CityAgent):
  """ An agent representing a traffic light. """
+ __slots__ = ('state',)
+
  def __init__(self, unique_id, model, position, initial_state='green'):
      super().__init__(unique_id, model)
      self.pos = position
@@ -33,124 +62,130 @@ class TrafficLightAgent(Agent):
  def change_state(self):
      # Alternar entre rojo y verde
      self.state = 'green' if self.state == 'red' else 'red'
+     self.model.dirty_lights.add(self.unique_id)
+     self.model.signal_state[self.pos] = SIGNAL_STATES[self.state]
 
 
  def step(self):
      """ Acciones a realizar en cada paso de la simulación. """
      # Cambiar el estado del semáforo cada n pasos
-     if self.model.schedule.steps % 5 == 0:  # Ajusta este valor si es necesario
+     if self.model.schedule.steps % self.model.light_interval == 0:  # Ajusta light_interval en City si es necesario
          self.change_state()
 
-class Car(Agent):
+class Car(CityAgent):
+    __slots__ = ('start_parking', 'destination_parking', 'path', 'steps_taken', 'has_arrived', 'arrival_step', 'planner',
+                 'congestion')
+
     def __init__(self, unique_id, model, start_parking):
         super().__init__(unique_id, model)
         self.pos = start_parking.pos
         self.start_parking = start_parking
         self.destination_parking = self.find_unique_parking()
-        self.path = []
+        self.path = ()  # Route sobre los nodos compartidos de la tabla de rutas
+        self.steps_taken = 0
         self.has_arrived = False
+        self.arrival_step = None  # paso de la simulación en que llegó
+        self.planner = None  # D* Lite, sólo si se activa el ruteo por congestión
+        self.congestion = None  # nodo bloqueado -> paso en que expira; se crea con el planificador
         
-        if self.destination_parking:
+        if self.destination_parking and not model.lazy_routes:
             self.path = self.calculate_path(self.pos, self.destination_parking.pos)
         
-        print(f"Car {self.unique_id} initialized at {self.pos}. Destination: {self.destination_parking.pos if self.destination_parking else 'None'}")
+        car_log.debug("Car %s initialized at %s. Destination: %s", self.unique_id, self.pos, self.destination_parking.pos if self.destination_parking else None)
 
     def calculate_path(self, start, goal):
-        print(f"Calculating path from {start} to {goal}")
-        frontier = []
-        heapq.heappush(frontier, (0, start))
-        came_from = {}
-        cost_so_far = {}
-        came_from[start] = None
-        cost_so_far[start] = 0
-
-        while frontier:
-            current = heapq.heappop(frontier)[1]
+        car_log.debug("Calculating path from %s to %s", start, goal)
+        # Consultar la tabla de rutas compartida en lugar de buscar de nuevo
+        path = self.model.route_table.route(start, goal)
 
-            if current == goal:
-                break
+        if not path:
+            car_log.warning("No path found from %s to %s", start, goal)
 
-            for next in self.model.allowed_connections.get(current, []):
-                new_cost = cost_so_far[current] + 1
-                if next not in cost_so_far or new_cost < cost_so_far[next]:
-                    cost_so_far[next] = new_cost
-                    priority = new_cost + self.heuristic(goal, next)
-                    heapq.heappush(frontier, (priority, next))
-                    came_from[next] = current
+        return path
 
-        path = []
-        current = goal
-        while current is not None:
-            path.append(current)
-            current = came_from.get(current)
-        path.reverse()
 
-        if len(path) == 1:  # Solo contiene la posición inicial
-            print(f"No path found from {start} to {goal}")
-            return []
+    def reroute(self, blocked_cell):
+        # Replanificar de forma incremental alrededor de la celda bloqueada
+        graph = self.model.road_graph
+        goal = graph.node(self.destination_parking.pos)
+        if self.planner is None or self.planner.goal != goal:
+            self.planner = DStarLite(graph, graph.node(self.pos), goal, self.model.route_table.stats)
+            self.congestion = {}
+        self.planner.move_to(graph.node(self.pos))
 
-        return path[1:]  # Excluir la celda inicial, ya que el coche ya está allí
+        # Olvidar las celdas cuya congestión ya expiró
+        for node, expires in list(self.congestion.items()):
+            if expires <= self.model.step_count:
+                self.planner.set_cost(node, 0)
+                del self.congestion[node]
 
-
-    def heuristic(self, a, b):
-        return abs(a[0] - b[0]) + abs(a[1] - b[1])
+        blocked = graph.node(blocked_cell)
+        self.planner.set_cost(blocked, self.model.congestion_penalty)
+        self.congestion[blocked] = self.model.step_count + self.model.congestion_memory
+        self.path = Route(self.planner.path(), graph.height)
 
 
     def find_unique_parking(self):
-        # Filtrar solo los estacionamientos que no están ocupados
-        available_parkings = [p for p in self.model.parking_agents if not p.occupied and p not in self.model.assigned_parkings and p != self.start_parking]
-        if available_parkings:
-            chosen_parking = self.random.choice(available_parkings)
-            self.model.assigned_parkings.add(chosen_parking)
-            return chosen_parking
-        else:
-            return None
+        return self.model.find_unique_parking(self.start_parking, self.pos, self.unique_id)
+
+    def reassign(self):
+        # La reserva venció antes de llegar: otro destino, y la ruta se recalcula en el siguiente paso
+        self.destination_parking = self.find_unique_parking()
+        self.path = ()
+        self.planner = None
 
     def move(self):
         if self.path:
             next_step = self.path[0]
             
             # Comprobar si hay un coche en el siguiente paso
-            next_cell_contents = self.model.grid.get_cell_list_contents(next_step)
-            car_in_next_step = any(isinstance(obj, Car) for obj in next_cell_contents)
+            car_in_next_step = self.model.car_occupancy[next_step] > 0
 
             # Si hay un coche en el siguiente paso, no moverse y esperar
             if car_in_next_step:
-                print(f"Car {self.unique_id} waiting for the path to clear at {next_step}")
+                car_log.debug("Car %s waiting for the path to clear at %s", self.unique_id, next_step)
+                if self.model.congestion_routing:
+                    self.reroute(next_step)
                 return
 
             # Esperar si hay un semáforo en rojo en el siguiente paso
             if self.model.is_red_light(next_step):
-                print(f"Car {self.unique_id} waiting at red light at {next_step}")
+                car_log.debug("Car %s waiting at red light at %s", self.unique_id, next_step)
+                if self.model.congestion_routing:
+                    self.reroute(next_step)
                 return  # No mover el coche, continuar en el siguiente turno
 
             # Mover el coche a la siguiente celda
-            self.model.grid.move_agent(self, next_step)
-            self.path.pop(0)
+            self.model.move_vehicle(self, next_step)
+            self.path.advance()
+            self.steps_taken += 1
 
             # Comprobar si el coche ha llegado a su destino
             if self.pos == self.destination_parking.pos:
                 self.has_arrived = True
-                self.destination_parking.occupied = True
-                print(f"Car {self.unique_id} has arrived at destination {self.pos}")
+                self.arrival_step = self.model.step_count + 1
+                self.model.parking_allocator.claim(self.destination_parking)
+                car_log.info("Car %s has arrived at destination %s", self.unique_id, self.pos)
         else:
-            print(f"Car {self.unique_id} at {self.pos} has no path to follow")
+            car_log.debug("Car %s at %s has no path to follow", self.unique_id, self.pos)
             
     def step(self):
             # Si el coche ya ha llegado a su destino o no tiene un destino, no necesita moverse
             if self.has_arrived or not self.destination_parking:
-                print(f"Car {self.unique_id} at {self.pos} has already arrived or has no destination.")
+                car_log.debug("Car %s at %s has already arrived or has no destination.", self.unique_id, self.pos)
                 return
 
             # Si el coche tiene un destino pero aún no ha calculado una ruta, intenta calcularla
             if not self.path:
-                print(f"Car {self.unique_id} at {self.pos} recalculating path to {self.destination_parking.pos}.")
+                car_log.debug("Car %s at %s recalculating path to %s.", self.unique_id, self.pos, self.destination_parking.pos)
                 self.path = self.calculate_path(self.pos, self.destination_parking.pos)
 
                 # Si aún no hay un camino disponible, intenta encontrar un nuevo destino
                 if not self.path:
-                    print(f"Car {self.unique_id} at {self.pos} cannot find a path. Looking for a new destination.")
+                    car_log.warning("Car %s at %s cannot find a path. Looking for a new destination.", self.unique_id, self.pos)
+                    unreachable = self.destination_parking
                     self.destination_parking = self.find_unique_parking()
+                    self.model.parking_allocator.release(unreachable)
                     if self.destination_parking:
                         self.path = self.calculate_path(self.pos, self.destination_parking.pos)
                     return
@@ -158,462 +193,584 @@ class Car(Agent):
             # Intenta mover el coche siguiendo su camino (la lógica de semáforos está en 'move')
             self.move()
 
+# Conexiones permitidas entre celdas, compartidas por todas las instancias de City
+ALLOWED_CONNECTIONS = {
+    # Borde de mapa
+    (0, 1): [(0, 0), (1, 1)],
+    (0, 0): [(1, 0), (0, 1)],
+    (1, 1): [(2, 1), (1, 0), (0, 1)],
+    (2, 1): [(2, 0), (3, 1)],
+    (1, 0): [(2, 0), (1, 1)],
+    (2, 0): [(2, 1), (3, 0)],
+    (3, 0): [(3, 1), (4, 0)],
+    (3, 1): [(3, 0), (4, 1)],
+    (4, 0): [(4, 1), (5, 0)],
+    (4, 1): [(5, 1), (4, 0)],
+    (5, 0): [(6, 0), (5, 1)],
+    (5, 1): [(6, 1), (5, 0)],
+    (6, 0): [(6, 1), (7, 0)],
+    (6, 1): [(7, 1), (6, 0)],
+    (7, 0): [(7, 1), (8, 0)],
+    (7, 1): [(8, 1), (7, 0)],
+    (8, 0): [(8, 1), (9, 0)],
+    (8, 1): [(8, 0), (9, 1)],
+    (9, 0): [(9, 1), (10, 0)],
+    (9, 1): [(9, 0), (10, 1)],
+    (10, 0): [(10, 1), (11, 0)],
+    (10, 1): [(10, 0), (11, 1)],
+    (11, 0): [(11, 1), (12, 0)],
+    (11, 1): [(11, 0), (12, 1)],
+    (12, 0): [(13, 0), (12, 1)],
+    (12, 1): [(12, 0), (13, 1)],
+    (13, 0): [(13, 1), (14, 0)],
+    (13, 1): [(13, 0), (14, 1)],
+    (14, 0): [(14, 1), (15, 0)],
+    (14, 1): [(14, 0), (15, 1), (14, 2)],
+    (15, 0): [(15, 1), (16, 0)],
+    (15, 1): [(15, 0), (16, 1), (15, 2)],
+    (16, 0): [(16, 1), (17, 0)],
+    (16, 1): [(16, 0), (17, 1)],
+    (17, 0): [(17, 1), (18, 0)],
+    (17, 1): [(17, 0), (18, 1)],
+    (18, 0): [(18, 1), (19, 0)],
+    (18, 1): [(18, 0), (19, 1)],
+    (19, 0): [(19, 1), (20, 0)],
+    (19, 1): [(19, 0), (20, 1)],
+    (20, 0): [(20, 1), (21, 0)],
+    (20, 1): [(20, 0), (21, 1)],
+    (21, 0): [(21, 1), (22, 0)],
+    (21, 1): [(21, 0), (22, 1)],
+    (22, 0): [(22, 1), (23, 0)],
+    (22, 1): [(22, 0), (23, 1), (22, 2)],
+    (23, 0): [(22, 0), (23, 1)],
+    (23, 1): [(22, 1), (23, 2)],
+    (22, 2): [(23, 2), (22, 3)],
+    (23, 2): [(22, 2), (23, 3)],
+    (23, 3): [(22, 3), (23, 4)],
+    (22, 3): [(23, 3), (22, 4)],
+    (22, 4): [(23, 4), (22, 5)],
+    (23, 4): [(22, 4), (23, 5)],
+    (22, 5): [(23, 5), (22, 6)],
+    (23, 5): [(22, 5), (23, 6)],
+    (22, 6): [(23, 6), (22, 7)],
+    (23, 6): [(22, 6), (23, 7)],
+    (22, 7): [(23, 7), (22, 8)],
+    (23, 7): [(22, 7), (23, 8)],
+    (22, 8): [(23, 8), (22, 9)],
+    (23, 8): [(22, 8), (23, 9)],
+    (22, 9): [(23, 9), (22, 10)],
+    (23, 9): [(22, 9), (23, 10)],
+    (22, 10): [(23, 10), (22, 11), (21, 10)],
+    (23, 10): [(22, 10), (23, 11)],
+    (22, 11): [(23, 11), (22, 12), (21, 11)],
+    (23, 11): [(22, 11), (23, 12)],
+    (22, 12): [(23, 12), (22, 13)],
+    (23, 12): [(22, 12), (23, 13)],
+    (22, 13): [(23, 13), (22, 14)],
+    (23, 13): [(22, 13), (23, 14)],
+    (22, 14): [(23, 14), (22, 15), (21, 14)],
+    (23, 14): [(22, 14), (23, 15)],
+    (22, 15): [(23, 15), (22, 16)],
+    (23, 15): [(22, 15), (23, 16)],
+    (22, 16): [(23, 16), (22, 17)],
+    (23, 16): [(22, 16), (23, 17)],
+    (22, 17): [(23, 17), (22, 18)],
+    (23, 17): [(22, 17), (23, 18)],
+    (22, 18): [(23, 18), (22, 19)],
+    (23, 18): [(22, 18), (23, 19)],
+    (22, 19): [(23, 19), (22, 20)],
+    (23, 19): [(22, 19), (23, 20)],
+    (22, 20): [(23, 20), (22, 21)],
+    (23, 20): [(22, 20), (23, 21)],
+    (22, 21): [(23, 21), (22, 22)],
+    (23, 21): [(22, 21), (23, 22)],
+    (22, 22): [(23, 22), (22, 23), (21, 22)],
+    (23, 22): [(22, 22), (23, 23)],
+    (22, 23): [(21, 23), (22, 22)],
+    (23, 23): [(22, 23), (23, 22)],
+    (21, 23): [(21, 22), (20, 23)],
+    (21, 22): [(21, 23), (20, 22)],
+    (20, 23): [(20, 22), (19, 23)],
+    (20, 22): [(20, 23), (19, 22)],
+    (19, 23): [(19, 22), (18, 23)],
+    (19, 22): [(19, 23), (18, 22), (19, 21)],
+    (18, 23): [(18, 22), (17, 23)],
+    (18, 22): [(18, 23), (17, 22), (18, 21)],
+    (17, 23): [(17, 22), (16, 23)],
+    (17, 22): [(17, 23), (16, 22)],
+    (16, 23): [(16, 22), (15, 23)],
+    (16, 22): [(16, 23), (15, 22)],
+    (15, 23): [(15, 22), (14, 23)],
+    (15, 22): [(15, 23), (14, 22)],
+    (14, 23): [(14, 22), (13, 23)],
+    (14, 22): [(14, 23), (13, 22)],
+    (13, 23): [(13, 22), (12, 23)],
+    (13, 22): [(13, 23), (12, 22), (13, 21)],
+    (12, 23): [(12, 22), (11, 23)],
+    (12, 22): [(12, 23), (11, 22), (12, 21)],
+    (11, 23): [(11, 22), (10, 23)],
+    (11, 22): [(11, 23), (10, 22)],
+    (10, 23): [(10, 22), (9, 23)],
+    (10, 22): [(10, 23), (9, 22)],
+    (9, 23): [(9, 22), (8, 23)],
+    (9, 22): [(9, 23), (8, 22), (9, 21)],
+    (8, 23): [(8, 22), (7, 23)],
+    (8, 22): [(8, 23), (7, 22)],
+    (7, 23): [(7, 22), (6, 23)],
+    (7, 22): [(7, 23), (6, 22)],
+    (6, 23): [(6, 22), (5, 23)],
+    (6, 22): [(6, 23), (5, 22)],
+    (5, 23): [(5, 22), (4, 23)],
+    (5, 22): [(5, 23), (4, 22)],
+    (4, 23): [(4, 22), (3, 23)],
+    (4, 22): [(4, 23), (3, 22)],
+    (3, 23): [(3, 22), (2, 23)],
+    (3, 22): [(3, 23), (2, 22)],
+    (2, 23): [(2, 22), (1, 23)],
+    (2, 22): [(2, 23), (1, 22)],
+    (1, 23): [(1, 22), (0, 23)],
+    (1, 22): [(0, 22), (1, 22), (1, 23)],
+    (0, 23): [(0, 22), (1, 23)],
+    (0, 22): [(1, 22), (0, 21)],
+    (0, 21): [(1, 21), (0, 20)],
+    (1, 21): [(0, 21), (1, 20)],
+    (0, 20): [(1, 20), (0, 19)],
+    (1, 20): [(0, 20), (1, 19), (2, 20)],
+    (0, 19): [(1, 19), (0, 18)],
+    (1, 19): [(0, 19), (1, 18)],
+    (0, 18): [(1, 18), (0, 17)],
+    (1, 18): [(0, 18), (1, 17)],
+    (0, 17): [(1, 17), (0, 16)],
+    (1, 17): [(0, 17), (1, 16)],
+    (0, 16): [(1, 16), (0, 15)],
+    (1, 16): [(0, 16), (1, 15)],
+    (0, 15): [(1, 15), (0, 14)],
+    (1, 15): [(0, 15), (1, 14)],
+    (0, 14): [(1, 14), (0, 13)],
+    (1, 14): [(0, 14), (1, 13)],
+    (0, 13): [(1, 13), (0, 12)],
+    (1, 13): [(0, 13), (1, 12)],
+    (0, 12): [(1, 12), (0, 11)],
+    (1, 12): [(0, 12), (1, 11)],
+    (0, 11): [(1, 11), (0, 10)],
+    (1, 11): [(0, 11), (1, 10)],
+    (0, 10): [(1, 10), (0, 9)],
+    (1, 10): [(0, 10), (1, 9)],
+    (0, 9): [(1, 9), (0, 8)],
+    (1, 9): [(0, 9), (1, 8), (2, 9)],
+    (0, 8): [(1, 8), (0, 7)],
+    (1, 8): [(0, 8), (1, 7), (2, 8)],
+    (0, 7): [(1, 7), (0, 6)],
+    (1, 7): [(0, 7), (1, 6)],
+    (0, 6): [(1, 6), (0, 5)],
+    (1, 6): [(0, 6), (1, 5), (2, 6)],
+    (0, 5): [(1, 5), (0, 4)],
+    (1, 5): [(0, 5), (1, 4)],
+    (0, 4): [(1, 4), (0, 3)],
+    (1, 4): [(0, 4), (1, 3)],
+    (0, 3): [(1, 3), (0, 2)],
+    (1, 3): [(0, 3), (1, 2)],
+    (0, 2): [(1, 2), (0, 1)],
+    (1, 2): [(0, 2), (1, 1)],
+
+    # Dentro del mapa
+    (6, 7): [(7, 7), (6, 6)],
+    (7, 7): [(6, 7), (7, 6)],
+    (6, 6): [(7, 6), (6, 5)],
+    (7, 6): [(6, 6), (7, 5)],
+    (6, 5): [(7, 5), (6, 4)],
+    (7, 5): [(6, 5), (7, 4)],
+    (6, 4): [(7, 4), (6, 3)],
+    (7, 4): [(6, 4), (7, 3)],
+    (6, 3): [(7, 3), (6, 2), (5, 3)],
+    (7, 3): [(6, 3), (7, 2), (8, 3)],
+    (6, 2): [(7, 2), (6, 1)],
+    (7, 2): [(6, 2), (7, 1)],
+    (2, 9): [(3, 9), (2, 8)],
+    (2, 8): [(2, 9), (3, 8)],
+    (3, 9): [(3, 8), (4, 9)],
+    (3, 8): [(3, 9), (4, 8)],
+    (4, 9): [(4, 8), (5, 9)],
+    (4, 8): [(4, 9), (5, 8)],
+    (5, 9): [(5, 8), (6, 9)],
+    (5, 8): [(5, 9), (6, 8)],
+    (6, 9): [(6, 8), (7, 9)],
+    (6, 8): [(6, 9), (7, 8), (6, 7)],
+    (7, 9): [(7, 8), (8, 9)],
+    (7, 8): [(7, 9), (8, 8), (7, 7)],
+    (8, 9): [(8, 8), (9, 9)],
+    (8, 8): [(8, 9), (9, 8)],
+    (9, 9): [(9, 8), (10, 9)],
+    (9, 8): [(9, 9), (10, 8)],
+    (10, 9): [(10, 8), (11, 9)],
+    (10, 8): [(10, 9), (11, 8)],
+    (11, 9): [(11, 8), (12, 9)],
+    (11, 8): [(11, 9), (12, 8)],
+    (12, 9): [(12, 8)],
+    (12, 8): [(13, 8), (12, 7)],
+    (13, 8): [(14, 8), (13, 7)],
+    (14, 8): [(15, 8)],
+    (15, 8): [(15, 9), (16, 8)],
+    (15, 9): [(15, 10), (16, 9)],
+    (15, 10): [(15, 11)],
+    (15, 11): [(14, 11), (15, 12)],
+    (14, 11): [(13, 11), (14, 12)],
+    (13, 11): [(12, 11)],
+    (12, 11): [(11, 11), (12, 10)],
+    (12, 10): [(11, 10), (12, 9)],
+    (12, 7): [(13, 7), (12, 6)],
+    (13, 7): [(12, 7), (13, 6)],
+    (12, 6): [(13, 6), (12, 5)],
+    (13, 6): [(12, 6), (13, 5)],
+    (12, 5): [(13, 5), (12, 4)],
+    (13, 5): [(12, 5), (13, 4)],
+    (12, 4): [(13, 4), (12, 3)],
+    (13, 4): [(12, 4), (13, 3)],
+    (12, 3): [(13, 3), (12, 2)],
+    (13, 3): [(12, 3), (13, 2)],
+    (12, 2): [(13, 2), (12, 1)],
+    (13, 2): [(12, 2), (13, 1)],
+    (14, 2): [(15, 2), (14, 3)],
+    (15, 2): [(14, 2), (15, 3)],
+    (14, 3): [(15, 3), (14, 4)],
+    (15, 3): [(14, 3), (15, 4)],
+    (14, 4): [(15, 4), (14, 5)],
+    (15, 4): [(14, 4), (15, 5), (16, 4)],
+    (14, 5): [(15, 5), (14, 6)],
+    (15, 5): [(14, 5), (15, 6), (16, 5)],
+    (14, 6): [(15, 6), (14, 7)],
+    (15, 6): [(14, 6), (15, 7)],
+    (14, 7): [(14, 8), (15, 7)],
+    (15, 7): [(14, 7), (15, 8)],
+    (16, 5): [(17, 5), (16, 4)],
+    (16, 4): [(16, 5), (17, 4)],
+    (17, 5): [(17, 6), (18, 5), (17, 4)],
+    (17, 4): [(17, 5), (18, 4)],
+    (18, 5): [(19, 5), (18, 4)],
+    (18, 4): [(18, 5), (19, 4)],
+    (19, 5): [(19, 6), (20, 5), (19, 4)],
+    (19, 4): [(19, 5), (20, 4), (19, 3)],
+    (20, 5): [(21, 5), (20, 4)],
+    (20, 4): [(20, 5), (21, 4)],
+    (21, 5): [(22, 5), (21, 4)],
+    (21, 4): [(21, 5), (22, 4)],
+    (16, 9): [(16, 8), (17, 9)],
+    (16, 8): [(16, 9), (17, 8)],
+    (17, 9): [(17, 8), (18, 9)],
+    (17, 8): [(17, 9), (18, 8)],
+    (18, 9): [(18, 8), (19, 9)],
+    (18, 8): [(18, 9), (19, 8)],
+    (19, 9): [(19, 8), (20, 9)],
+    (19, 8): [(19, 9), (20, 8)],
+    (20, 9): [(20, 8), (21, 9)],
+    (20, 8): [(20, 9), (21, 8)],
+    (21, 9): [(22, 9), (21, 8)],
+    (21, 8): [(21, 9), (22, 8)],
+    (21, 10): [(21, 11), (20, 10)],
+    (21, 11): [(21, 10), (20, 11)],
+    (20, 10): [(20, 11), (19, 10)],
+    (20, 11): [(20, 10), (19, 11)],
+    (19, 10): [(19, 11), (18, 10)],
+    (19, 11): [(19, 10), (18, 11), (19, 12)],
+    (18, 10): [(18, 11), (17, 10)],
+    (18, 11): [(18, 10), (17, 11), (18, 12)],
+    (17, 10): [(17, 11), (16, 10)],
+    (17, 11): [(17, 10), (16, 11)],
+    (16, 10): [(16, 11), (15, 10)],
+    (16, 11): [(16, 10), (15, 11)],
+    (19, 12): [(18, 12), (19, 13)],
+    (18, 12): [(19, 12), (18, 13)],
+    (19, 13): [(18, 13), (19, 14)],
+    (18, 13): [(19, 13), (18, 14)],
+    (19, 14): [(19, 15), (18, 14)],
+    (18, 14): [(19, 14), (18, 15)],
+    (19, 15): [(18, 15), (19, 15)],
+    (18, 15): [(19, 15), (18, 16)],
+    (18, 21): [(19, 21), (18, 20)],
+    (19, 21): [(18, 21), (19, 20)],
+    (18, 20): [(19, 20), (18, 19), (17, 20)],
+    (19, 20): [(18, 20), (19, 19)],
+    (18, 19): [(19, 19), (18, 18)],
+    (19, 19): [(18, 19), (19, 18), (20, 19)],
+    (18, 18): [(19, 18), (18, 17)],
+    (19, 18): [(18, 18), (19, 17)],
+    (18, 17): [(18, 16), (19, 17)],
+    (19, 17): [(19, 16), (20, 17)],
+    (18, 16): [(18, 17), (19, 16)],
+    (19, 16): [(19, 17), (20, 16)],
+    (20, 17): [(20, 16), (21, 17)],
+    (20, 16): [(20, 17), (21, 16)],
+    (21, 17): [(21, 16), (22, 17)],
+    (21, 16): [(21, 17), (22, 16)],
+    (15, 12): [(14, 12), (15, 13)],
+    (14, 12): [(15, 12), (14, 13)],
+    (15, 13): [(14, 13), (15, 14), (16, 13)],
+    (14, 13): [(15, 13), (14, 14)],
+    (15, 14): [(14, 14), (15, 15)],
+    (14, 14): [(15, 14), (14, 15)],
+    (15, 15): [(14, 15), (15, 16)],
+    (14, 15): [(15, 15), (14, 16)],
+    (15, 16): [(14, 16), (15, 17), (16, 16)],
+    (14, 16): [(15, 16), (14, 17)],
+    (15, 17): [(14, 17), (15, 18), (16, 17)],
+    (14, 17): [(15, 17), (14, 18)],
+    (15, 18): [(14, 18), (15, 19)],
+    (14, 18): [(15, 18), (14, 19)],
+    (15, 19): [(14, 19), (15, 20)],
+    (14, 19): [(15, 19), (14, 20)],
+    (15, 20): [(14, 20), (15, 21)],
+    (14, 20): [(15, 20), (14, 21)],
+    (15, 21): [(14, 21), (15, 22)],
+    (14, 21): [(15, 21), (14, 22)],
+    (16, 17): [(17, 17), (16, 16)],
+    (16, 16): [(16, 17), (17, 16)],
+    (17, 17): [(17, 16), (18, 17)],
+    (17, 16): [(17, 17), (18, 16)],
+    (12, 21): [(13, 21), (12, 20)],
+    (13, 21): [(12, 21), (13, 20)],
+    (12, 20): [(13, 20), (12, 19)],
+    (13, 20): [(12, 20), (13, 19)],
+    (12, 19): [(13, 19), (12, 18), (11, 19)],
+    (13, 19): [(12, 19), (13, 18)],
+    (12, 18): [(13, 18), (12, 17)],
+    (13, 18): [(12, 18), (13, 17)],
+    (12, 17): [(13, 17), (12, 16), (11, 17)],
+    (13, 17): [(12, 17), (13, 16)],
+    (12, 16): [(13, 16), (12, 15), (11, 16)],
+    (13, 16): [(13, 15), (12, 16)],
+    (12, 15): [(13, 15), (12, 14)],
+    (13, 15): [(12, 15), (13, 14)],
+    (12, 14): [(13, 14), (12, 13)],
+    (13, 14): [(12, 14), (13, 13)],
+    (12, 13): [(11, 13), (12, 12), (13, 13)],
+    (13, 13): [(12, 13), (13, 12)],
+    (12, 12): [(13, 12), (12, 11)],
+    (13, 12): [(12, 12), (13, 11)],
+    (11, 11): [(11, 10), (10, 11)],
+    (11, 10): [(11, 11), (10, 10)],
+    (10, 11): [(10, 10), (9, 11)],
+    (10, 10): [(10, 11), (9, 10)],
+    (9, 11): [(9, 10), (8, 11)],
+    (9, 10): [(9, 11), (8, 10)],
+    (8, 11): [(8, 10), (7, 11)],
+    (8, 10): [(8, 11), (7, 10)],
+    (7, 11): [(7, 10), (6, 11)],
+    (7, 10): [(7, 11), (6, 10)],
+    (6, 11): [(6, 12), (5, 11), (6, 10)],
+    (6, 10): [(6, 11), (5, 10)],
+    (5, 11): [(5, 12), (4, 11), (5, 10)],
+    (5, 10): [(5, 11), (4, 10)],
+    (4, 11): [(4, 10), (3, 11)],
+    (4, 10): [(4, 11), (3, 10)],
+    (3, 11): [(3, 10), (2, 11)],
+    (3, 10): [(3, 11), (2, 10)],
+    (2, 11): [(2, 10), (1, 11)],
+    (2, 10): [(2, 11), (1, 10)],
+    (6, 12): [(5, 12), (6, 13)],
+    (5, 12): [(6, 12), (5, 13)],
+    (6, 13): [(5, 13), (6, 14)],
+    (5, 13): [(6, 13), (5, 14), (4, 13)],
+    (6, 14): [(5, 14), (6, 15)],
+    (5, 14): [(6, 14), (5, 15)],
+    (6, 15): [(5, 15), (6, 16)],
+    (5, 15): [(6, 15), (5, 16)],
+    (6, 16): [(5, 16), (6, 17)],
+    (5, 16): [(5, 17), (4, 16)],
+    (6, 17): [(5, 17), (6, 16), (6, 18)],
+    (5, 17): [(5, 16), (4, 17)],
+    (4, 17): [(4, 16), (3, 17)],
+    (4, 16): [(4, 17), (3, 16)],
+    (3, 17): [(3, 16), (2, 17)],
+    (3, 16): [(3, 17), (2, 16)],
+    (2, 17): [(2, 16), (1, 17)],
+    (2, 16): [(2, 17), (1, 16)],
+    (11, 17): [(11, 16), (10, 17)],
+    (11, 16): [(11, 17), (10, 16)],
+    (10, 17): [(10, 16), (9, 17)],
+    (10, 16): [(10, 17), (9, 16)],
+    (9, 17): [(9, 16), (8, 17)],
+    (9, 16): [(9, 17), (8, 16)],
+    (8, 17): [(8, 16), (7, 17)],
+    (8, 16): [(8, 17), (7, 16), (8, 15)],
+    (7, 17): [(6, 17), (7, 16)],
+    (7, 16): [(7, 17), (6, 16)],
+
+    # Al final, revisar TODOS los estacionamientos y sus adyacentes
+    (2, 6): [(1, 6)],
+    (5, 3): [(6, 3)],
+    (8, 3): [(7, 3)],
+    (17, 6): [(17, 5)],
+    (19, 6): [(19, 5)],
+    (19, 3): [(19, 4)],
+    (21, 14): [(22, 14)],
+    (20, 19): [(19, 19)],
+    (17, 20): [(18, 20)],
+    (16, 13): [(15, 13)],
+    (11, 19): [(12, 19)],
+    (11, 13): [(12, 13)],
+    (8, 15): [(8, 16)],
+    (4, 13): [(5, 13)],
+    (9, 21): [(9, 22)],
+    (2, 20): [(1, 20)],
+    (6, 18): [(6, 17)]
+}
+
+# Validar que todas las conexiones son tuplas
+for key, connections in ALLOWED_CONNECTIONS.items():
+    for connection in connections:
+        if not isinstance(connection, tuple):
+            model_log.error("Error en la conexión: %s a %s, que no es una tupla.", key, connection)
+
 # Defining the model
 class City(Model):
-    def __init__(self, width, height):
-        self.grid = MultiGrid(width, height, False)
-        self.schedule = RandomActivation(self)
+    def __init__(self, width, height, congestion_routing=False, congestion_penalty=5, congestion_memory=10,
+                 telemetry='batched', delta_frames=True, keyframe_interval=50, light_interval=5, num_cars=None,
+                 max_steps=100, seed=None, profiler=None, city_map=None,
+                 engine='agents', activation=None, destination_mode='random', reservation_ttl=None):
+        # seed lo usa Model.__new__ para inicializar self.random
+        if city_map is not None and (city_map.width, city_map.height) != (width, height):
+            raise ValueError(f"El mapa es de {city_map.width}x{city_map.height}, no de {width}x{height}")
+        if destination_mode not in DESTINATION_MODES:
+            raise ValueError(f"Modo de destino desconocido: {destination_mode}")
+        # Un mapa generado no se visualiza: sin MultiGrid, que reserva una lista por celda
+        self.grid = MultiGrid(width, height, False) if city_map is None else PositionGrid(width, height)
+        # En un mapa generado la ruta de cada coche se calcula en su primer paso y
+        # no al crearlo, para que City no calcule miles de rutas antes de empezar
+        self.lazy_routes = city_map is not None
+
+        # Motor de los coches: un agente Car por coche o una Fleet en arreglos. La activación
+        # 'ordered' activa a los agentes en el orden en que se agregaron, que es la que
+        # reproduce el motor vectorizado; 'random' los baraja en cada paso
+        self.engine = engine
+        self.activation = resolve_activation(engine, activation, congestion_routing)
+        self.schedule = RandomActivation(self) if self.activation == 'random' else BaseScheduler(self)
+        self.fleet = None
         self.parking_agents = []
         self.current_id = 0
         self.running = True
         self.step_count = 0
-        self.assigned_parkings = set()
-
-        # Inicializar las conexiones permitidas
-        self.allowed_connections = {
-           # Borde de mapa
-           (0, 1): [(0, 0), (1, 1)],
-           (0, 0): [(1, 0), (0, 1)],
-           (1, 1): [(2, 1), (1, 0), (0, 1)],
-           (2, 1): [(2, 0), (3, 1)],
-           (1, 0): [(2, 0), (1, 1)],
-           (2, 0): [(2, 1), (3, 0)],
-           (3, 0): [(3, 1), (4, 0)],
-           (3, 1): [(3, 0), (4, 1)],
-           (4, 0): [(4, 1), (5, 0)],
-           (4, 1): [(5, 1), (4, 0)],
-           (5, 0): [(6, 0), (5, 1)],
-           (5, 1): [(6, 1), (5, 0)],
-           (6, 0): [(6, 1), (7, 0)],
-           (6, 1): [(7, 1), (6, 0)],
-           (7, 0): [(7, 1), (8, 0)],
-           (7, 1): [(8, 1), (7, 0)],
-           (8, 0): [(8, 1), (9, 0)],  
-           (8, 1): [(8, 0), (9, 1)],
-           (9, 0): [(9, 1), (10, 0)],
-           (9, 1): [(9, 0), (10, 1)],
-           (10, 0): [(10, 1), (11, 0)],
-           (10, 1): [(10, 0), (11, 1)],
-           (11, 0): [(11, 1), (12, 0)],
-           (11, 1): [(11, 0), (12, 1)],
-           (12, 0): [(13, 0), (12, 1)],
-           (12, 1): [(12, 0), (13, 1)],
-           (13, 0): [(13, 1), (14, 0)],
-           (13, 1): [(13, 0), (14, 1)],
-           (14, 0): [(14, 1), (15, 0)],
-           (14, 1): [(14, 0), (15, 1), (14, 2)],
-           (15, 0): [(15, 1), (16, 0)],
-           (15, 1): [(15, 0), (16, 1), (15, 2)],
-           (16, 0): [(16, 1), (17, 0)],
-           (16, 1): [(16, 0), (17, 1)],
-           (17, 0): [(17, 1), (18, 0)],
-           (17, 1): [(17, 0), (18, 1)],
-           (18, 0): [(18, 1), (19, 0)],
-           (18, 1): [(18, 0), (19, 1)],
-           (19, 0): [(19, 1), (20, 0)],
-           (19, 1): [(19, 0), (20, 1)],
-           (20, 0): [(20, 1), (21, 0)],
-           (20, 1): [(20, 0), (21, 1)],
-           (21, 0): [(21, 1), (22, 0)],
-           (21, 1): [(21, 0), (22, 1)],
-           (22, 0): [(22, 1), (23, 0)],
-           (22, 1): [(22, 0), (23, 1), (22, 2)],
-           (23, 0): [(22, 0), (23, 1)],
-           (23, 1): [(22, 1), (23, 2)],
-           (22, 2): [(23, 2), (22, 3)],
-           (23, 2): [(22, 2), (23, 3)],
-           (23, 3): [(22, 3), (23, 4)],
-           (22, 3): [(23, 3), (22, 4)],
-           (22, 4): [(23, 4), (22, 5)],
-           (23, 4): [(22, 4), (23, 5)],
-           (22, 5): [(23, 5), (22, 6)],
-           (23, 5): [(22, 5), (23, 6)],
-           (22, 6): [(23, 6), (22, 7)],
-           (23, 6): [(22, 6), (23, 7)],
-           (22, 7): [(23, 7), (22, 8)],
-           (23, 7): [(22, 7), (23, 8)],
-           (22, 8): [(23, 8), (22, 9)],
-           (23, 8): [(22, 8), (23, 9)],
-           (22, 9): [(23, 9), (22, 10)],
-           (23, 9): [(22, 9), (23, 10)],
-           (22, 10): [(23, 10), (22, 11), (21, 10)],
-           (23, 10): [(22, 10), (23, 11)],
-           (22, 11): [(23, 11), (22, 12), (21, 11)],
-           (23, 11): [(22, 11), (23, 12)],
-           (22, 12): [(23, 12), (22, 13)],
-           (23, 12): [(22, 12), (23, 13)],
-           (22, 13): [(23, 13), (22, 14)],
-           (23, 13): [(22, 13), (23, 14)],
-           (22, 14): [(23, 14), (22, 15), (21, 14)],
-           (23, 14): [(22, 14), (23, 15)],
-           (22, 15): [(23, 15), (22, 16)],
-           (23, 15): [(22, 15), (23, 16)],
-           (22, 16): [(23, 16), (22, 17)],
-           (23, 16): [(22, 16), (23, 17)],
-           (22, 17): [(23, 17), (22, 18)],
-           (23, 17): [(22, 17), (23, 18)],
-           (22, 18): [(23, 18), (22, 19)],
-           (23, 18): [(22, 18), (23, 19)],
-           (22, 19): [(23, 19), (22, 20)],
-           (23, 19): [(22, 19), (23, 20)],
-           (22, 20): [(23, 20), (22, 21)],
-           (23, 20): [(22, 20), (23, 21)],
-           (22, 21): [(23, 21), (22, 22)],
-           (23, 21): [(22, 21), (23, 22)],
-           (22, 22): [(23, 22), (22, 23), (21, 22)],
-           (23, 22): [(22, 22), (23, 23)],
-           (22, 23): [(21, 23), (22, 22)],
-           (23, 23): [(22, 23), (23, 22)],
-           (21, 23): [(21, 22), (20, 23)],
-           (21, 22): [(21, 23), (20, 22)],
-           (20, 23): [(20, 22), (19, 23)],
-           (20, 22): [(20, 23), (19, 22)],
-           (19, 23): [(19, 22), (18, 23)],
-           (19, 22): [(19, 23), (18, 22), (19, 21)],
-           (18, 23): [(18, 22), (17, 23)],
-           (18, 22): [(18, 23), (17, 22), (18, 21)],
-           (17, 23): [(17, 22), (16, 23)],
-           (17, 22): [(17, 23), (16, 22)],
-           (16, 23): [(16, 22), (15, 23)],
-           (16, 22): [(16, 23), (15, 22)],
-           (15, 23): [(15, 22), (14, 23)],
-           (15, 22): [(15, 23), (14, 22)],
-           (14, 23): [(14, 22), (13, 23)],
-           (14, 22): [(14, 23), (13, 22)],
-           (13, 23): [(13, 22), (12, 23)],
-           (13, 22): [(13, 23), (12, 22), (13, 21)],
-           (12, 23): [(12, 22), (11, 23)],
-           (12, 22): [(12, 23), (11, 22), (12, 21)],
-           (11, 23): [(11, 22), (10, 23)],
-           (11, 22): [(11, 23), (10, 22)],
-           (10, 23): [(10, 22), (9, 23)],
-           (10, 22): [(10, 23), (9, 22)],
-           (9, 23): [(9, 22), (8, 23)],
-           (9, 22): [(9, 23), (8, 22), (9, 21)],
-           (8, 23): [(8, 22), (7, 23)],
-           (8, 22): [(8, 23), (7, 22)],
-           (7, 23): [(7, 22), (6, 23)],
-           (7, 22): [(7, 23), (6, 22)],
-           (6, 23): [(6, 22), (5, 23)],
-           (6, 22): [(6, 23), (5, 22)],
-           (5, 23): [(5, 22), (4, 23)],
-           (5, 22): [(5, 23), (4, 22)],
-           (4, 23): [(4, 22), (3, 23)],
-           (4, 22): [(4, 23), (3, 22)],
-           (3, 23): [(3, 22), (2, 23)],
-           (3, 22): [(3, 23), (2, 22)],
-           (2, 23): [(2, 22), (1, 23)],
-           (2, 22): [(2, 23), (1, 22)],
-           (1, 23): [(1, 22), (0, 23)],
-           (1, 22): [(0, 22), (1, 22), (1, 23)],
-           (0, 23): [(0, 22), (1, 23)],
-           (0, 22): [(1, 22), (0, 21)],
-           (0, 21): [(1, 21), (0, 20)],
-           (1, 21): [(0, 21), (1, 20)],
-           (0, 20): [(1, 20), (0, 19)],
-           (1, 20): [(0, 20), (1, 19), (2, 20)],
-           (0, 19): [(1, 19), (0, 18)],
-           (1, 19): [(0, 19), (1, 18)],
-           (0, 18): [(1, 18), (0, 17)],
-           (1, 18): [(0, 18), (1, 17)],
-           (0, 17): [(1, 17), (0, 16)],
-           (1, 17): [(0, 17), (1, 16)],
-           (0, 16): [(1, 16), (0, 15)],
-           (1, 16): [(0, 16), (1, 15)],
-           (0, 15): [(1, 15), (0, 14)],
-           (1, 15): [(0, 15), (1, 14)],
-           (0, 14): [(1, 14), (0, 13)],
-           (1, 14): [(0, 14), (1, 13)],
-           (0, 13): [(1, 13), (0, 12)],
-           (1, 13): [(0, 13), (1, 12)],
-           (0, 12): [(1, 12), (0, 11)],
-           (1, 12): [(0, 12), (1, 11)],
-           (0, 11): [(1, 11), (0, 10)],
-           (1, 11): [(0, 11), (1, 10)],
-           (0, 10): [(1, 10), (0, 9)],
-           (1, 10): [(0, 10), (1, 9)],
-           (0, 9): [(1, 9), (0, 8)],
-           (1, 9): [(0, 9), (1, 8), (2, 9)],
-           (0, 8): [(1, 8), (0, 7)],
-           (1, 8): [(0, 8), (1, 7), (2, 8)],
-           (0, 7): [(1, 7), (0, 6)],
-           (1, 7): [(0, 7), (1, 6)],
-           (0, 6): [(1, 6), (0, 5)],
-           (1, 6): [(0, 6), (1, 5), (2, 6)],
-           (0, 5): [(1, 5), (0, 4)],
-           (1, 5): [(0, 5), (1, 4)],
-           (0, 4): [(1, 4), (0, 3)],
-           (1, 4): [(0, 4), (1, 3)],
-           (0, 3): [(1, 3), (0, 2)],
-           (1, 3): [(0, 3), (1, 2)],
-           (0, 2): [(1, 2), (0, 1)],
-           (1, 2): [(0, 2), (1, 1)],
-
-
-           # Dentro del mapa
-           (6, 7): [(7, 7), (6, 6)],
-           (7, 7): [(6, 7), (7, 6)],
-           (6, 6): [(7, 6), (6, 5)],
-           (7, 6): [(6, 6), (7, 5)],
-           (6, 5): [(7, 5), (6, 4)],
-           (7, 5): [(6, 5), (7, 4)],
-           (6, 4): [(7, 4), (6, 3)],
-           (7, 4): [(6, 4), (7, 3)],
-           (6, 3): [(7, 3), (6, 2), (5, 3)],
-           (7, 3): [(6, 3), (7, 2), (8, 3)],
-           (6, 2): [(7, 2), (6, 1)],
-           (7, 2): [(6, 2), (7, 1)],
-           (2, 9): [(3, 9), (2, 8)],
-           (2, 8): [(2, 9), (3, 8)],
-           (3, 9): [(3, 8), (4, 9)],
-           (3, 8): [(3, 9), (4, 8)],
-           (4, 9): [(4, 8), (5, 9)],
-           (4, 8): [(4, 9), (5, 8)],
-           (5, 9): [(5, 8), (6, 9)],
-           (5, 8): [(5, 9), (6, 8)],
-           (6, 9): [(6, 8), (7, 9)],
-           (6, 8): [(6, 9), (7, 8), (6, 7)],
-           (7, 9): [(7, 8), (8, 9)],
-           (7, 8): [(7, 9), (8, 8), (7, 7)],
-           (8, 9): [(8, 8), (9, 9)],
-           (8, 8): [(8, 9), (9, 8)],
-           (9, 9): [(9, 8), (10, 9)],
-           (9, 8): [(9, 9), (10, 8)],
-           (10, 9): [(10, 8), (11, 9)],
-           (10, 8): [(10, 9), (11, 8)],
-           (11, 9): [(11, 8), (12, 9)],
-           (11, 8): [(11, 9), (12, 8)],
-           (12, 9): [(12, 8)],
-           (12, 8): [(13, 8), (12, 7)],
-           (13, 8): [(14, 8), (13, 7)],
-           (14, 8): [(15, 8)],
-           (15, 8): [(15, 9), (16, 8)],
-           (15, 9): [(15, 10), (16, 9)],
-           (15, 10): [(15, 11)],
-           (15, 11): [(14, 11), (15, 12)],
-           (14, 11): [(13, 11), (14, 12)],
-           (13, 11): [(12, 11)],
-           (12, 11): [(11, 11), (12, 10)],
-           (12, 10): [(11, 10), (12, 9)],
-           (12, 7): [(13, 7), (12, 6)],
-           (13, 7): [(12, 7), (13, 6)],
-           (12, 6): [(13, 6), (12, 5)],
-           (13, 6): [(12, 6), (13, 5)],
-           (12, 5): [(13, 5), (12, 4)],
-           (13, 5): [(12, 5), (13, 4)],
-           (12, 4): [(13, 4), (12, 3)],
-           (13, 4): [(12, 4), (13, 3)],
-           (12, 3): [(13, 3), (12, 2)],
-           (13, 3): [(12, 3), (13, 2)],
-           (12, 2): [(13, 2), (12, 1)],
-           (13, 2): [(12, 2), (13, 1)],
-           (14, 2): [(15, 2), (14, 3)],
-           (15, 2): [(14, 2), (15, 3)],
-           (14, 3): [(15, 3), (14, 4)],
-           (15, 3): [(14, 3), (15, 4)],
-           (14, 4): [(15, 4), (14, 5)],
-           (15, 4): [(14, 4), (15, 5), (16, 4)],
-           (14, 5): [(15, 5), (14, 6)],
-           (15, 5): [(14, 5), (15, 6), (16, 5)],
-           (14, 6): [(15, 6), (14, 7)],
-           (15, 6): [(14, 6), (15, 7)],
-           (14, 7): [(14, 8), (15, 7)],
-           (15, 7): [(14, 7), (15, 8)],
-           (16, 5): [(17, 5), (16, 4)],
-           (16, 4): [(16, 5), (17, 4)],
-           (17, 5): [(17, 6), (18, 5), (17, 4)],
-           (17, 4): [(17, 5), (18, 4)],
-           (18, 5): [(19, 5), (18, 4)],
-           (18, 4): [(18, 5), (19, 4)],
-           (19, 5): [(19, 6), (20, 5), (19, 4)],
-           (19, 4): [(19, 5), (20, 4), (19, 3)],
-           (20, 5): [(21, 5), (20, 4)],
-           (20, 4): [(20, 5), (21, 4)],
-           (21, 5): [(22, 5), (21, 4)],
-           (21, 4): [(21, 5), (22, 4)],
-           (16, 9): [(16, 8), (17, 9)],
-           (16, 8): [(16, 9), (17, 8)],
-           (17, 9): [(17, 8), (18, 9)],
-           (17, 8): [(17, 9), (18, 8)],
-           (18, 9): [(18, 8), (19, 9)],
-           (18, 8): [(18, 9), (19, 8)],
-           (19, 9): [(19, 8), (20, 9)],
-           (19, 8): [(19, 9), (20, 8)],
-           (20, 9): [(20, 8), (21, 9)],
-           (20, 8): [(20, 9), (21, 8)],
-           (21, 9): [(22, 9), (21, 8)],
-           (21, 8): [(21, 9), (22, 8)],
-           (21, 10): [(21, 11), (20, 10)],
-           (21, 11): [(21, 10), (20, 11)],
-           (20, 10): [(20, 11), (19, 10)],
-           (20, 11): [(20, 10), (19, 11)],
-           (19, 10): [(19, 11), (18, 10)],
-           (19, 11): [(19, 10), (18, 11), (19, 12)],
-           (18, 10): [(18, 11), (17, 10)],
-           (18, 11): [(18, 10), (17, 11), (18, 12)],
-           (17, 10): [(17, 11), (16, 10)],
-           (17, 11): [(17, 10), (16, 11)],
-           (16, 10): [(16, 11), (15, 10)],
-           (16, 11): [(16, 10), (15, 11)],
-           (19, 12): [(18, 12), (19, 13)],
-           (18, 12): [(19, 12), (18, 13)],
-           (19, 13): [(18, 13), (19, 14)],
-           (18, 13): [(19, 13), (18, 14)],
-           (19, 14): [(19, 15), (18, 14)],
-           (18, 14): [(19, 14), (18, 15)],
-           (19, 15): [(18, 15), (19, 15)],
-           (18, 15): [(19, 15), (18, 16)],
-           (18, 21): [(19, 21), (18, 20)],
-           (19, 21): [(18, 21), (19, 20)],
-           (18, 20): [(19, 20), (18, 19), (17, 20)],
-           (19, 20): [(18, 20), (19, 19)],
-           (18, 19): [(19, 19), (18, 18)],
-           (19, 19): [(18, 19), (19, 18), (20, 19)],
-           (18, 18): [(19, 18), (18, 17)],
-           (19, 18): [(18, 18), (19, 17)],
-           (18, 17): [(18, 16), (19, 17)],
-           (19, 17): [(19, 16), (20, 17)],
-           (18, 16): [(18, 17), (19, 16)],
-           (19, 16): [(19, 17), (20, 16)],
-           (20, 17): [(20, 16), (21, 17)],
-           (20, 16): [(20, 17), (21, 16)],
-           (21, 17): [(21, 16), (22, 17)],
-           (21, 16): [(21, 17), (22, 16)],
-           (15, 12): [(14, 12), (15, 13)],
-           (14, 12): [(15, 12), (14, 13)],
-           (15, 13): [(14, 13), (15, 14), (16, 13)],
-           (14, 13): [(15, 13), (14, 14)],
-           (15, 14): [(14, 14), (15, 15)],
-           (14, 14): [(15, 14), (14, 15)],
-           (15, 15): [(14, 15), (15, 16)],
-           (14, 15): [(15, 15), (14, 16)],
-           (15, 16): [(14, 16), (15, 17), (16, 16)],
-           (14, 16): [(15, 16), (14, 17)],
-           (15, 17): [(14, 17), (15, 18), (16, 17)],
-           (14, 17): [(15, 17), (14, 18)],
-           (15, 18): [(14, 18), (15, 19)],
-           (14, 18): [(15, 18), (14, 19)],
-           (15, 19): [(14, 19), (15, 20)],
-           (14, 19): [(15, 19), (14, 20)],
-           (15, 20): [(14, 20), (15, 21)],
-           (14, 20): [(15, 20), (14, 21)],
-           (15, 21): [(14, 21), (15, 22)],
-           (14, 21): [(15, 21), (14, 22)],
-           (16, 17): [(17, 17), (16, 16)],
-           (16, 16): [(16, 17), (17, 16)],
-           (17, 17): [(17, 16), (18, 17)],
-           (17, 16): [(17, 17), (18, 16)],
-           (12, 21): [(13, 21), (12, 20)],
-           (13, 21): [(12, 21), (13, 20)],
-           (12, 20): [(13, 20), (12, 19)],
-           (13, 20): [(12, 20), (13, 19)],
-           (12, 19): [(13, 19), (12, 18), (11, 19)],
-           (13, 19): [(12, 19), (13, 18)],
-           (12, 18): [(13, 18), (12, 17)],
-           (13, 18): [(12, 18), (13, 17)],
-           (12, 17): [(13, 17), (12, 16), (11, 17)],
-           (13, 17): [(12, 17), (13, 16)],
-           (12, 16): [(13, 16), (12, 15), (11, 16)],
-           (13, 16): [(13, 15), (12, 16)],
-           (12, 15): [(13, 15), (12, 14)],
-           (13, 15): [(12, 15), (13, 14)],
-           (12, 14): [(13, 14), (12, 13)],
-           (13, 14): [(12, 14), (13, 13)],
-           (12, 13): [(11, 13), (12, 12), (13, 13)],
-           (13, 13): [(12, 13), (13, 12)],
-           (12, 12): [(13, 12), (12, 11)],
-           (13, 12): [(12, 12), (13, 11)],
-           (11, 11): [(11, 10), (10, 11)],
-           (11, 10): [(11, 11), (10, 10)],
-           (10, 11): [(10, 10), (9, 11)],
-           (10, 10): [(10, 11), (9, 10)],
-           (9, 11): [(9, 10), (8, 11)],
-           (9, 10): [(9, 11), (8, 10)],
-           (8, 11): [(8, 10), (7, 11)],
-           (8, 10): [(8, 11), (7, 10)],
-           (7, 11): [(7, 10), (6, 11)],
-           (7, 10): [(7, 11), (6, 10)],
-           (6, 11): [(6, 12), (5, 11), (6, 10)],
-           (6, 10): [(6, 11), (5, 10)],
-           (5, 11): [(5, 12), (4, 11), (5, 10)],
-           (5, 10): [(5, 11), (4, 10)],
-           (4, 11): [(4, 10), (3, 11)],
-           (4, 10): [(4, 11), (3, 10)],
-           (3, 11): [(3, 10), (2, 11)],
-           (3, 10): [(3, 11), (2, 10)],
-           (2, 11): [(2, 10), (1, 11)],
-           (2, 10): [(2, 11), (1, 10)],
-           (6, 12): [(5, 12), (6, 13)],
-           (5, 12): [(6, 12), (5, 13)],
-           (6, 13): [(5, 13), (6, 14)],
-           (5, 13): [(6, 13), (5, 14), (4, 13)],
-           (6, 14): [(5, 14), (6, 15)],
-           (5, 14): [(6, 14), (5, 15)],
-           (6, 15): [(5, 15), (6, 16)],
-           (5, 15): [(6, 15), (5, 16)],
-           (6, 16): [(5, 16), (6, 17)],
-           (5, 16): [(5, 17), (4, 16)],
-           (6, 17): [(5, 17), (6, 16), (6, 18)],
-           (5, 17): [(5, 16), (4, 17)],
-           (4, 17): [(4, 16), (3, 17)],
-           (4, 16): [(4, 17), (3, 16)],
-           (3, 17): [(3, 16), (2, 17)],
-           (3, 16): [(3, 17), (2, 16)],
-           (2, 17): [(2, 16), (1, 17)],
-           (2, 16): [(2, 17), (1, 16)],
-           (11, 17): [(11, 16), (10, 17)],
-           (11, 16): [(11, 17), (10, 16)],
-           (10, 17): [(10, 16), (9, 17)],
-           (10, 16): [(10, 17), (9, 16)],
-           (9, 17): [(9, 16), (8, 17)],
-           (9, 16): [(9, 17), (8, 16)],
-           (8, 17): [(8, 16), (7, 17)],
-           (8, 16): [(8, 17), (7, 16), (8, 15)],
-           (7, 17): [(6, 17), (7, 16)],
-           (7, 16): [(7, 17), (6, 16)],
-
-
-           # Al final, revisar TODOS los estacionamientos y sus adyacentes
-           (2, 6): [(1, 6)],
-           (5, 3): [(6, 3)],
-           (8, 3): [(7, 3)],
-           (17, 6): [(17, 5)],
-           (19, 6): [(19, 5)],
-           (19, 3): [(19, 4)],
-           (21, 14): [(22, 14)],
-           (20, 19): [(19, 19)],
-           (17, 20): [(18, 20)],
-           (16, 13): [(15, 13)],
-           (11, 19): [(12, 19)],
-           (11, 13): [(12, 13)],
-           (8, 15): [(8, 16)],
-           (4, 13): [(5, 13)],
-           (9, 21): [(9, 22)],
-           (2, 20): [(1, 20)],
-           (6, 18): [(6, 17)]
-       }
-
-        # Validar que todas las conexiones son tuplas
-        for key, connections in self.allowed_connections.items():
-                for connection in connections:
-                    if not isinstance(connection, tuple):
-                        print(f"Error en la conexión: {key} a {connection}, que no es una tupla.")
+        self.max_steps = max_steps
+        self.light_interval = light_interval  # pasos entre cada cambio de los semáforos
+        # Destinos: un estacionamiento libre al azar, el más cercano en línea recta o el más
+        # cercano por las calles; la reserva de un coche
+        # vence después de reservation_ttl pasos sin llegar (None: no vence)
+        self.destination_mode = destination_mode
+        self.reservation_ttl = reservation_ttl
+        self.parking_allocator = None
+
+        # Perfilador de pasos (profiler.StepProfiler), opcional
+        self.profiler = profiler
+
+        # Publicador de telemetría hacia el servidor Flask: 'off', 'sync', 'batched' o un TelemetryPublisher.
+        # Por defecto 'batched' con backpressure 'drop': la simulación no espera al servidor. El
+        # publicador que se crea aquí se cierra al terminar la corrida (y su hilo termina solo si el
+        # modelo se descarta antes); el que se recibe lo cierra quien lo creó
+        self.owns_telemetry = not isinstance(telemetry, TelemetryPublisher)
+        self.telemetry = TelemetryPublisher(telemetry) if self.owns_telemetry else telemetry
+
+        # Cuadros delta: sólo se envía lo que cambió, con un cuadro completo cada keyframe_interval pasos
+        self.delta_frames = delta_frames
+        self.keyframe_interval = keyframe_interval
+        self.frames_sent = 0
+        self.dirty_cars = set()
+        self.dirty_lights = set()
 
+        # Registros por tipo, en orden de inserción, para los reportes de cada paso
+        self.cars = {}
+        self.traffic_lights = {}
+
+        # Arreglos densos por celda: coches en cada celda y estado del semáforo
+        self.car_occupancy = np.zeros((width, height), dtype=np.int16)
+        self.signal_state = np.zeros((width, height), dtype=np.int8)
+
+        # Capa estática del mapa: los edificios, estacionamientos y glorietas
+        # se colocan en el grid para la visualización pero no en el scheduler
+        self.cell_type = np.zeros((width, height), dtype=np.int8)
+
+        # Ruteo por congestión: los coches bloqueados replanifican con D* Lite
+        self.congestion_routing = congestion_routing
+        self.congestion_penalty = congestion_penalty  # costo extra por entrar a una celda bloqueada
+        self.congestion_memory = congestion_memory  # pasos que se recuerda una celda bloqueada
+
+        # Conexiones permitidas y su grafo compilado, compartido por todo el proceso;
+        # un mapa generado (citygen.CityMap) ya trae el grafo compilado y no tiene conexiones
+        if city_map is None:
+            self.allowed_connections = ALLOWED_CONNECTIONS
+            self.road_graph = compile_connections(ALLOWED_CONNECTIONS, width, height)
+        else:
+            self.allowed_connections = None
+            self.road_graph = city_map.graph
 
         # Crear semáforos verdes en el camino
         traffic_lights_positions = [(11, 0), (11, 1), (16, 4), (16, 5), (21, 8), (21, 9), (2, 10), (2, 11), (7, 16), (7, 17), (16, 22), (16, 23)]
+        if city_map is not None:
+            # En un mapa generado empiezan en verde las llegadas por calles horizontales
+            traffic_lights_positions = [pos for pos, orientation in city_map.lights if orientation in ('este', 'oeste')]
         for pos in traffic_lights_positions:
             traffic_light = TrafficLightAgent(self.next_id(), self, pos, 'green')
             self.grid.place_agent(traffic_light, pos)
+            self.signal_state[pos] = SIGNAL_STATES[traffic_light.state]
+            self.traffic_lights[traffic_light.unique_id] = traffic_light
             self.schedule.add(traffic_light)
         
         # Crear semáforos rojos en el camino
         traffic_lights_positions = [(12, 2), (13, 2), (14, 3), (15, 3), (22, 7), (23, 7), (0, 12), (1, 12), (5, 15), (6, 15), (14, 21), (15, 21)]
+        if city_map is not None:
+            traffic_lights_positions = [pos for pos, orientation in city_map.lights if orientation in ('norte', 'sur')]
         for pos in traffic_lights_positions:
             traffic_light = TrafficLightAgent(self.next_id(), self, pos, 'red')
             self.grid.place_agent(traffic_light, pos)
+            self.signal_state[pos] = SIGNAL_STATES[traffic_light.state]
+            self.traffic_lights[traffic_light.unique_id] = traffic_light
             self.schedule.add(traffic_light)
         
+        # Capas estáticas: el mapa fijo de 24x24 o uno generado
+        if city_map is None:
+            self.place_fixed_map()
+        else:
+            self.place_map(city_map)
+
+        self.parking_allocator = ParkingAllocator(self.parking_agents, self.random)
+
+        # Tabla de rutas compartida entre todos los estacionamientos; en un mapa
+        # generado los árboles se calculan al primer uso y no todos al inicio
+        endpoints = [parking.pos for parking in self.parking_agents] if city_map is None else ()
+        self.route_table = RouteTable(self.road_graph, endpoints)
+
+
+    # Generar un coche en cada estacionamiento al inicio de la simulación,
+    # o sólo en num_cars estacionamientos elegidos al azar
+        start_parkings = self.parking_agents
+        if num_cars is not None:
+            start_parkings = self.random.sample(self.parking_agents, min(num_cars, len(self.parking_agents)))
+        if self.engine == 'vectorized':
+            # Mismos ids y destinos que con los agentes Car, pero en una sola Fleet
+            self.fleet = Fleet("ID_Fleet", self, SIGNAL_STATES['red'])
+            cars = []
+            for parking_agent in start_parkings:
+                car_id = self.next_id()
+                destination_parking = self.find_unique_parking(parking_agent, holder=car_id)
+                if destination_parking:
+                    cars.append((car_id, parking_agent, destination_parking))
+            self.fleet.add_cars(cars)
+            self.schedule.add(self.fleet)
+        else:
+            for parking_agent in start_parkings:
+                car = Car(self.next_id(), self, parking_agent)
+                if car.destination_parking:
+                    self.place_vehicle(car, parking_agent.pos)
+                    self.schedule.add(car)
+                
+        if self.delta_frames:
+            self.send_frame_to_server()
+        else:
+            self.send_car_positions_to_server()
+            self.send_initial_traffic_light_positions()
+            self.send_traffic_light_states_to_server()
+
+
+    def place_fixed_map(self):
+        # Mapa fijo de 24x24, el mismo que la escena de Unity
         self.place_buildings(range(2, 9), [21])
         self.place_buildings(range(10, 12), [21])
         self.place_buildings(range(3, 12), [20])
@@ -646,45 +803,74 @@ class City(Model):
         self.place_buildings(range(18, 19), [6])
         self.place_buildings(range(20, 22), [6])
 
-
         self.place_parkings([(2, 6), (5, 3), (8, 3), (17, 6), (19, 6), (19, 3), (16, 13), (21, 14), (20, 19), (17, 20), (4, 13), (11, 13), (8, 15), (6,18), (2, 20), (9, 21), (11, 19)])
         
         self.place_roundabouts([(13, 9), (13, 10), (14, 9), (14, 10)])
 
-
-    # Generar un coche en cada estacionamiento al inicio de la simulación
-        for parking_agent in self.parking_agents:
-            car = Car(self.next_id(), self, parking_agent)
-            if car.destination_parking:
-                self.grid.place_agent(car, parking_agent.pos)
-                self.schedule.add(car)
-                
-        self.send_car_positions_to_server()
-        self.send_initial_traffic_light_positions()
-        self.send_traffic_light_states_to_server()
-
+    def place_map(self, city_map):
+        # Los edificios y glorietas de un mapa generado sólo quedan en cell_type,
+        # sin un agente por celda; los estacionamientos sí son agentes
+        self.cell_type[:] = city_map.cell_type
+        self.place_parkings(city_map.parkings)
 
     def place_buildings(self, x_range, y_positions):
         for x in x_range:
             for y in y_positions:
                 building = Building(self.next_id(), self)
                 self.grid.place_agent(building, (x, y))
-                self.schedule.add(building)
+                self.cell_type[x, y] = CELL_TYPES['building']
 
 
     def place_parkings(self, positions):
         for x, y in positions:
             parking = Parking(self.next_id(), self)
             self.grid.place_agent(parking, (x, y))
-            self.schedule.add(parking)
+            self.cell_type[x, y] = CELL_TYPES['parking']
             self.parking_agents.append(parking)
     
     def place_roundabouts(self, positions):
         for x, y in positions:
             roundabout = Roundabout(self.next_id(), self)
             self.grid.place_agent(roundabout, (x, y))
-            self.schedule.add(roundabout)
+            self.cell_type[x, y] = CELL_TYPES['roundabout']
+
+
+    def place_vehicle(self, agent, pos):
+        self.grid.place_agent(agent, pos)
+        self.car_occupancy[pos] += 1
+        self.cars[agent.unique_id] = agent
+
+    def move_vehicle(self, agent, pos):
+        self.car_occupancy[agent.pos] -= 1
+        self.grid.move_agent(agent, pos)
+        self.car_occupancy[pos] += 1
+        self.dirty_cars.add(agent.unique_id)
+
+    def find_unique_parking(self, start_parking, origin=None, holder=None):
+        # Reservar un estacionamiento libre distinto del de salida: al azar o el más cercano a origin
+        expires = None if self.reservation_ttl is None else self.step_count + self.reservation_ttl
+        origin = start_parking.pos if origin is None else origin
+        if self.destination_mode == 'euclidean':
+            return self.parking_allocator.reserve_nearest(origin, holder, start_parking, expires)
+        if self.destination_mode == 'nearest':
+            return self.parking_allocator.reserve_reachable(self.route_table, start_parking, origin, holder, expires)
+        return self.parking_allocator.reserve_random(holder, start_parking, expires)
+
+    def expire_reservations(self):
+        # Los coches cuya reserva venció sin llegar buscan otro destino
+        for parking, car_id in self.parking_allocator.expire(self.step_count):
+            car_log.info("Reservation of car %s at %s expired", car_id, parking.pos)
+            if self.fleet is not None:
+                self.fleet.reassign(car_id)
+            else:
+                self.cars[car_id].reassign()
 
+    def car_positions(self, car_ids=None):
+        # {'car_<id>': [x, y]} de todos los coches, o sólo de car_ids
+        if self.fleet is not None:
+            return self.fleet.positions(car_ids)
+        cars = self.cars.values() if car_ids is None else [self.cars[car_id] for car_id in car_ids if car_id in self.cars]
+        return {f"car_{car_agent.unique_id}": [car_agent.pos[0], car_agent.pos[1]] for car_agent in cars}
 
     def next_id(self):
         self.current_id += 1
@@ -692,47 +878,111 @@ class City(Model):
     
     def is_red_light(self, pos):
         if isinstance(pos, tuple) and len(pos) == 2:
-            cell_contents = self.grid.get_cell_list_contents([pos])
-            traffic_lights = [agent for agent in cell_contents if isinstance(agent, TrafficLightAgent)]
-            return any(light.state == 'red' for light in traffic_lights)
+            return self.signal_state[pos] == SIGNAL_STATES['red']
         else:
             # Manejar el caso en que pos no es una tupla de coordenadas válidas
             return False
+
+
+    def summary(self):
+        """ Métricas de la corrida, una fila por simulación en las corridas por lotes. """
+        if self.fleet is not None:
+            cars, arrived, total_steps, total_travel = self.fleet.totals()
+        else:
+            arrived_cars = [car for car in self.cars.values() if car.has_arrived]
+            cars, arrived = len(self.cars), len(arrived_cars)
+            total_steps = sum(car.steps_taken for car in arrived_cars)
+            total_travel = sum(car.arrival_step for car in arrived_cars)
+        return {
+            "steps": self.step_count,
+            "cars": cars,
+            "arrived": arrived,
+            "total_steps_taken": total_steps,
+            "mean_steps_taken": total_steps / arrived if arrived else None,
+            "mean_travel_time": total_travel / arrived if arrived else None,
+        }
                
     def send_car_positions_to_server(self):
-            positions_data = {f"car_{car_agent.unique_id}": [car_agent.pos[0], car_agent.pos[1]] for car_agent in self.schedule.agents if isinstance(car_agent, Car)}
-            requests.post("http://127.0.0.1:5000/update_car_positions", json=positions_data)
+            positions_data = self.car_positions()
+            self.telemetry.publish("/update_car_positions", positions_data)
     
     def send_traffic_light_states_to_server(self):
         traffic_light_data = {
             f"traffic_light_{light_agent.unique_id}": {"position": [light_agent.pos[0], light_agent.pos[1]], "state": light_agent.state}
-            for light_agent in self.schedule.agents if isinstance(light_agent, TrafficLightAgent)
+            for light_agent in self.traffic_lights.values()
         }
-        requests.post("http://127.0.0.1:5000/update_traffic_light_states", json=traffic_light_data)
+        self.telemetry.publish("/update_traffic_light_states", traffic_light_data)
 
     def send_initial_traffic_light_positions(self):
         positions_data = {
             f"traffic_light_{light_agent.unique_id}": [light_agent.pos[0], light_agent.pos[1]]
-            for light_agent in self.schedule.agents if isinstance(light_agent, TrafficLightAgent)
+            for light_agent in self.traffic_lights.values()
         }
-        requests.post("http://127.0.0.1:5000/set_traffic_light_positions", json=positions_data)
+        self.telemetry.publish("/set_traffic_light_positions", positions_data)
+
+    def send_frame_to_server(self):
+        # Enviar sólo los coches que se movieron y los semáforos que cambiaron,
+        # con un cuadro completo periódico para que el servidor se resincronice
+        keyframe = self.frames_sent == 0 or self.step_count % self.keyframe_interval == 0 or self.telemetry.resync_requested
+        if keyframe:
+            self.telemetry.resync_requested = False
+            cars = self.car_positions()
+            lights = self.traffic_lights.values()
+        else:
+            cars = self.car_positions(self.dirty_cars)
+            lights = [self.traffic_lights[light_id] for light_id in self.dirty_lights]
+        frame = {
+            "seq": self.step_count,
+            "base_seq": self.step_count,
+            "keyframe": keyframe,
+            "cars": cars,
+            "lights": {
+                f"traffic_light_{light_agent.unique_id}": {"position": [light_agent.pos[0], light_agent.pos[1]], "state": light_agent.state} if keyframe else {"state": light_agent.state}
+                for light_agent in lights
+            },
+        }
+        self.dirty_cars.clear()
+        self.dirty_lights.clear()
+        self.frames_sent += 1
+        self.telemetry.publish("/update_frame", frame, merge=merge_frames)
 
     def step(self):
-        self.schedule.step()
+        profiler = self.profiler
+        if profiler is None:
+            self.schedule.step()
+        else:
+            profiler.begin_step()
+            profiler.run_schedule(self.schedule)
         self.step_count += 1  # Incrementar el contador de pasos en cada llamada a step
+        if self.reservation_ttl is not None:
+            self.expire_reservations()
+        if profiler is not None:
+            profiler.mark('spawn')  # en main.py no aparecen vehículos: sólo las reasignaciones por reservas vencidas
 
-        # Condición de finalización: terminar después de 100 pasos
-        if self.step_count >= 100:
+        # Condición de finalización: terminar después de max_steps pasos (100 por defecto)
+        if self.step_count >= self.max_steps:
             self.running = False
        
-        self.send_car_positions_to_server()  # Añadir esta línea al final de step
-        self.send_traffic_light_states_to_server()
+        if self.delta_frames:
+            self.send_frame_to_server()
+        else:
+            self.send_car_positions_to_server()  # Añadir esta línea al final de step
+            self.send_traffic_light_states_to_server()
+        self.telemetry.tick()
+
+        # Al terminar, asegurar que el último estado llegue al servidor y liberar el publicador propio
+        if not self.running:
+            if self.owns_telemetry:
+                self.telemetry.close()
+            else:
+                self.telemetry.flush()
 
+        if profiler is not None:
+            profiler.mark('telemetry')
+            profiler.end_step()
+            if not self.running:
+                profiler.finish(self.route_table.stats, self.telemetry)
 
-# Incializamos el servidor y el modelo
-city_model = City(24, 24)
-while city_model.running:
-  city_model.step()
 
 def agent_portrayal(agent):
    if isinstance(agent, Car):
@@ -748,13 +998,30 @@ def agent_portrayal(agent):
    return portrayal
 
 
-grid = CanvasGrid(agent_portrayal, 24, 24, 500, 500)
+def visualize(port=8521):
+    # La visualización de Mesa se importa sólo cuando se usa
+    from mesa.visualization.modules import CanvasGrid
+    from mesa.visualization.ModularVisualization import ModularServer
+
+    grid = CanvasGrid(agent_portrayal, 24, 24, 500, 500)
+
+    server = ModularServer(City,
+                         [grid], 
+                         "City Simulation",
+                         {"width": 24, "height": 24})  
+
+
+    server.port = port  # Puerto por defecto: 8521
+    server.launch()
+
 
-server = ModularServer(City,
-                     [grid], 
-                     "City Simulation",
-                     {"width": 24, "height": 24})  
+if __name__ == '__main__':
+    import simlog
+    simlog.configure()
 
+    # Incializamos el servidor y el modelo
+    city_model = City(24, 24)
+    while city_model.running:
+      city_model.step()
 
-server.port = 8521  # Puerto por defecto
-server.launch()
\ No newline at end of file
+    visualize()
\ No newline at end of file
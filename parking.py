@@ -0,0 +1,219 @@
+import heapq
+from math import hypot
+
+# Modos de elegir el estacionamiento de destino: uno libre al azar, el libre
+# más cercano en línea recta al coche o el libre más cercano por las calles
+DESTINATION_MODES = ('random', 'euclidean', 'nearest')
+
+
+class ParkingAllocator:
+    """ Reservas de estacionamientos de City, sin recorrer la lista completa.
+
+    Los estacionamientos libres se guardan en una lista con la posición de
+    cada uno en ella, así que reservar uno al azar y liberarlo cuestan O(1):
+    al sacar uno, el último ocupa su lugar. Para buscar el libre más cercano
+    a una celda, los estacionamientos se agrupan en cubetas de
+    bucket_size x bucket_size celdas y se revisan anillos de cubetas
+    alrededor de la celda hasta que ninguna más lejana puede mejorar.
+
+    Una reserva puede vencer: expire(now) libera las que vencieron sin que
+    el coche llegara y devuelve a sus dueños para que busquen otro destino.
+    claim() marca un estacionamiento como ocupado cuando el coche llega.
+
+    Una reserva puede llevar el estacionamiento de salida de su dueño
+    (origin); reserve_reachable() lo usa para no mandar a un coche hacia la
+    salida de otro que viene hacia la suya. Se olvida en cuanto la reserva
+    se libera, vence o el coche llega.
+    """
+
+    def __init__(self, parkings, rng, bucket_size=8):
+        self.parkings = list(parkings)
+        self.rng = rng
+        self.index = {parking.unique_id: i for i, parking in enumerate(self.parkings)}
+        self.positions = {parking.pos: i for i, parking in enumerate(self.parkings)}
+        self.free = list(range(len(self.parkings)))  # índices libres, en cualquier orden
+        self.slot = list(range(len(self.parkings)))  # posición de cada índice en free, -1 si no está libre
+        self.holders = {}  # índice reservado -> (dueño, paso en que vence o None)
+        self.expiry = []  # heap de (paso en que vence, índice, dueño)
+        self.origins = {}  # índice reservado -> índice de salida de su dueño, mientras va en camino
+
+        self.bucket_size = bucket_size
+        self.buckets = {}  # (cubeta x, cubeta y) -> índices libres en ella
+        for i, parking in enumerate(self.parkings):
+            self.buckets.setdefault(self.bucket(parking.pos), set()).add(i)
+        xs = [parking.pos[0] for parking in self.parkings] or [0]
+        ys = [parking.pos[1] for parking in self.parkings] or [0]
+        self.bucket_bounds = (min(xs) // bucket_size, max(xs) // bucket_size,
+                              min(ys) // bucket_size, max(ys) // bucket_size)
+
+    def __len__(self):
+        return len(self.free)
+
+    def bucket(self, pos):
+        return pos[0] // self.bucket_size, pos[1] // self.bucket_size
+
+    def is_free(self, parking):
+        return self.slot[self.index[parking.unique_id]] >= 0
+
+    def free_at(self, pos):
+        """ Estacionamiento libre en la celda pos, o None. """
+        i = self.positions.get(pos)
+        return None if i is None or self.slot[i] < 0 else self.parkings[i]
+
+    def holder(self, parking):
+        """ Dueño de la reserva de parking, o None si no está reservado. """
+        entry = self.holders.get(self.index[parking.unique_id])
+        return None if entry is None else entry[0]
+
+    def _take(self, i, holder, expires, origin=None):
+        # Sacar i de los libres: el último libre ocupa su lugar
+        free, slot = self.free, self.slot
+        last = free.pop()
+        if last != i:
+            free[slot[i]] = last
+            slot[last] = slot[i]
+        slot[i] = -1
+        self.buckets[self.bucket(self.parkings[i].pos)].discard(i)
+        self.holders[i] = (holder, expires)
+        if origin is not None:
+            self.origins[i] = origin
+        if expires is not None:
+            heapq.heappush(self.expiry, (expires, i, holder))
+        return self.parkings[i]
+
+    def _put(self, i):
+        self.slot[i] = len(self.free)
+        self.free.append(i)
+        self.buckets[self.bucket(self.parkings[i].pos)].add(i)
+
+    def reserve(self, parking, holder=None, expires=None):
+        """ Reserva parking, que debe estar libre. """
+        i = self.index[parking.unique_id]
+        if self.slot[i] < 0:
+            raise ValueError(f"El estacionamiento en {parking.pos} no está libre")
+        return self._take(i, holder, expires)
+
+    def reserve_random(self, holder=None, exclude=None, expires=None):
+        """ Reserva un estacionamiento libre al azar, distinto de exclude; None si no hay. """
+        free = self.free
+        count = len(free)
+        excluded = -1 if exclude is None else self.slot[self.index[exclude.unique_id]]
+        if excluded >= 0:
+            # Elegir entre los demás: si sale el excluido, se toma el último en su lugar
+            if count < 2:
+                return None
+            k = self.rng.randrange(count - 1)
+            if k == excluded:
+                k = count - 1
+        else:
+            if not count:
+                return None
+            k = self.rng.randrange(count)
+        return self._take(free[k], holder, expires)
+
+    def nearest_free(self, pos, exclude=None):
+        """ Estacionamiento libre más cercano en línea recta a pos, distinto de exclude; None si no hay. """
+        excluded = -1 if exclude is None else self.index[exclude.unique_id]
+        if len(self.free) - (excluded >= 0 and self.slot[excluded] >= 0) <= 0:
+            return None
+        size = self.bucket_size
+        bx, by = self.bucket(pos)
+        min_x, max_x, min_y, max_y = self.bucket_bounds
+        reach = max(bx - min_x, max_x - bx, by - min_y, max_y - by)
+        best, best_key = None, None
+        for ring in range(reach + 1):
+            # Las cubetas del anillo ring están a más de (ring - 1) * size celdas de pos
+            if best is not None and best_key[0] <= (ring - 1) * size:
+                break
+            for cx in range(bx - ring, bx + ring + 1):
+                step = 1 if abs(cx - bx) == ring else 2 * ring
+                for cy in range(by - ring, by + ring + 1, max(step, 1)):
+                    for i in self.buckets.get((cx, cy), ()):
+                        if i == excluded:
+                            continue
+                        x, y = self.parkings[i].pos
+                        key = (hypot(x - pos[0], y - pos[1]), i)
+                        if best_key is None or key < best_key:
+                            best, best_key = i, key
+        return None if best is None else self.parkings[best]
+
+    def reserve_nearest(self, pos, holder=None, exclude=None, expires=None):
+        """ Reserva el estacionamiento libre más cercano en línea recta a pos; None si no hay. """
+        parking = self.nearest_free(pos, exclude)
+        if parking is None:
+            return None
+        return self._take(self.index[parking.unique_id], holder, expires)
+
+    def incoming(self, i):
+        """ Índices de salida de los coches que vienen hacia el estacionamiento i, en cadena.
+
+        El que viene hacia i, el que viene hacia la salida de ése, etc.
+        """
+        chain = set()
+        origin = self.origins.get(i)
+        while origin is not None and origin != i and origin not in chain:
+            chain.add(origin)
+            origin = self.origins.get(origin)
+        return chain
+
+    def reserve_reachable(self, route_table, start_parking, origin, holder=None, expires=None):
+        """ Reserva el estacionamiento libre más cercano a origin por las calles; None si no alcanza ninguno.
+
+        Es una sola búsqueda de route_table.nearest() y su ruta queda
+        memorizada. La elección codiciosa emparejaría vecinos que se cruzan
+        de frente en la misma calle y se bloquean, así que se evita la
+        salida de los coches que vienen hacia start_parking (ver incoming);
+        si la búsqueda no alcanza otro, toma el primero de ésos que vio.
+        """
+        graph = route_table.graph
+        height = graph.height
+        positions, slot = self.positions, self.slot
+        own = self.index[start_parking.unique_id]
+        incoming = self.incoming(own)
+
+        def free_index(node):
+            i = positions.get(divmod(node, height))
+            return None if i is None or i == own or slot[i] < 0 else i
+
+        def is_goal(node):
+            i = free_index(node)
+            return i is not None and i not in incoming
+
+        def is_fallback(node):
+            return free_index(node) is not None
+
+        goal = route_table.nearest(graph.node(origin), is_goal, is_fallback if incoming else None)
+        if goal is None:
+            return None
+        return self._take(positions[graph.position(goal)], holder, expires, own)
+
+    def release(self, parking):
+        """ Devuelve parking a los libres si estaba reservado. """
+        i = self.index[parking.unique_id]
+        self.origins.pop(i, None)
+        if self.holders.pop(i, None) is not None:
+            self._put(i)
+
+    def claim(self, parking):
+        """ El dueño llegó: la reserva ya no vence y el estacionamiento queda ocupado. """
+        i = self.index[parking.unique_id]
+        self.origins.pop(i, None)
+        if i in self.holders:
+            self.holders[i] = (self.holders[i][0], None)
+        elif self.slot[i] >= 0:
+            self._take(i, None, None)
+        parking.occupied = True
+
+    def expire(self, now):
+        """ Libera las reservas que vencen en now o antes; devuelve sus (estacionamiento, dueño). """
+        expired = []
+        expiry, holders = self.expiry, self.holders
+        while expiry and expiry[0][0] <= now:
+            expires, i, holder = heapq.heappop(expiry)
+            # Las entradas de reservas ya liberadas, reclamadas o renovadas se ignoran
+            if holders.get(i) == (holder, expires):
+                del holders[i]
+                self.origins.pop(i, None)
+                self._put(i)
+                expired.append((self.parkings[i], holder))
+        return expired
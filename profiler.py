@@ -0,0 +1,193 @@
+import csv
+import logging
+from time import perf_counter
+
+from mesa.time import RandomActivation
+
+log = logging.getLogger("city.profiler")
+
+# Fases de City.step, en orden. 'spawn' cubre los vehículos de emergencia nuevos
+# y la reasignación de coches cuya reserva venció
+PHASES = ('shuffle', 'agents', 'spawn', 'telemetry')
+
+
+class StepProfiler:
+    """ Mide en qué se va el tiempo de City.step.
+
+    Con un perfilador, City.step recorre el scheduler con run_schedule en
+    lugar de schedule.step(): hace lo mismo (mismo orden de activación) pero
+    toma el tiempo de la mezcla y de los agentes. Las demás fases se marcan
+    con mark(). El costo por tipo de agente se mide agente por agente sólo
+    uno de cada sample_every pasos; los demás pasos cuestan unas pocas
+    llamadas a perf_counter, así que se puede dejar encendido en corridas
+    largas.
+
+    Al terminar, finish() junta los contadores de rutas y de telemetría y
+    deja el resumen en el registro 'city.profiler'. Opcionalmente escribe
+    una fila por paso en csv_path y los totales en formato de texto de
+    Prometheus en prometheus_path.
+    """
+
+    def __init__(self, csv_path=None, prometheus_path=None, sample_every=10):
+        self.csv_path = csv_path
+        self.prometheus_path = prometheus_path
+        self.sample_every = sample_every
+        self.steps = 0
+        self.phase_seconds = dict.fromkeys(PHASES, 0.0)
+        self.agent_seconds = {}  # tipo de agente -> segundos en step(), en los pasos muestreados
+        self.agent_calls = {}  # tipo de agente -> llamadas a step(), en los pasos muestreados
+        self.agent_steps = 0  # llamadas a step() de agentes en todos los pasos
+        self.max_step_seconds = 0.0
+        self.routing = {}
+        self.telemetry = {}
+
+        self._step_phases = dict.fromkeys(PHASES, 0.0)
+        self._step_calls = 0
+        self._step_start = 0.0
+        self._last = 0.0
+        self._csv_file = None
+        self._csv_writer = None
+        if csv_path:
+            self._csv_file = open(csv_path, 'w', newline='')
+            self._csv_writer = csv.writer(self._csv_file)
+            self._csv_writer.writerow(('step', 'seconds') + PHASES + ('agent_steps',))
+
+    def begin_step(self):
+        self._step_start = self._last = perf_counter()
+
+    def mark(self, phase):
+        """ Atribuye a phase el tiempo transcurrido desde la marca anterior. """
+        now = perf_counter()
+        self._step_phases[phase] += now - self._last
+        self._last = now
+
+    def run_schedule(self, schedule):
+        # Igual que schedule.step(), pero midiendo cada agente
+        agent_keys = schedule.get_agent_keys()
+        if isinstance(schedule, RandomActivation):
+            schedule.model.random.shuffle(agent_keys)
+        self.mark('shuffle')
+
+        agents = schedule._agents
+        calls = 0
+        if self.steps % self.sample_every:
+            for key in agent_keys:
+                agent = agents.get(key)
+                if agent is not None:  # None si se retiró durante este paso
+                    agent.step()
+                    calls += 1
+        else:
+            agent_seconds, agent_calls = self.agent_seconds, self.agent_calls
+            for key in agent_keys:
+                agent = agents.get(key)
+                if agent is None:
+                    continue
+                start = perf_counter()
+                agent.step()
+                elapsed = perf_counter() - start
+                kind = type(agent).__name__
+                agent_seconds[kind] = agent_seconds.get(kind, 0.0) + elapsed
+                agent_calls[kind] = agent_calls.get(kind, 0) + 1
+                calls += 1
+        self.agent_steps += calls
+        schedule.steps += 1
+        schedule.time += 1
+        self._step_calls = calls
+        self.mark('agents')
+
+    def end_step(self):
+        seconds = perf_counter() - self._step_start
+        self.steps += 1
+        if seconds > self.max_step_seconds:
+            self.max_step_seconds = seconds
+        phases = self._step_phases
+        for phase in PHASES:
+            self.phase_seconds[phase] += phases[phase]
+        if self._csv_writer is not None:
+            self._csv_writer.writerow([self.steps, round(seconds, 7)]
+                                      + [round(phases[phase], 7) for phase in PHASES]
+                                      + [self._step_calls])
+        self._step_phases = dict.fromkeys(PHASES, 0.0)
+
+    def finish(self, routing_stats=None, telemetry=None):
+        """ Cierra el perfil de la corrida: contadores, resumen y archivos. """
+        if routing_stats is not None:
+            self.routing = routing_stats.as_dict()
+        if telemetry is not None and telemetry.mode != 'off':
+            posts = telemetry.posts_sent + telemetry.post_errors
+            self.telemetry = {
+                "posts": posts,
+                "errors": telemetry.post_errors,
+                "coalesced": telemetry.frames_coalesced,
+                "mean_latency": telemetry.post_seconds / posts if posts else 0.0,
+                "max_latency": telemetry.max_post_seconds,
+            }
+        if self._csv_file is not None:
+            self._csv_file.close()
+            self._csv_file = self._csv_writer = None
+        if self.prometheus_path:
+            with open(self.prometheus_path, 'w') as output:
+                output.write(self.prometheus_text())
+        log.info("%s", self.format_summary())
+
+    def summary(self):
+        steps = self.steps or 1
+        return {
+            "steps": self.steps,
+            "total_seconds": sum(self.phase_seconds.values()),
+            "max_step_seconds": self.max_step_seconds,
+            "phase_seconds_per_step": {phase: seconds / steps for phase, seconds in self.phase_seconds.items()},
+            "agent_steps": self.agent_steps,
+            "agent_seconds": dict(self.agent_seconds),
+            "agent_calls": dict(self.agent_calls),
+            "routing": dict(self.routing),
+            "telemetry": dict(self.telemetry),
+        }
+
+    def format_summary(self):
+        steps = self.steps or 1
+        total = sum(self.phase_seconds.values())
+        lines = [f"Perfil de {self.steps} pasos: {total:.3f} s, {total / steps * 1e3:.3f} ms por paso "
+                 f"(máximo {self.max_step_seconds * 1e3:.3f} ms)"]
+        for phase, seconds in self.phase_seconds.items():
+            share = seconds / total * 100 if total else 0.0
+            lines.append(f"  {phase:<10} {seconds / steps * 1e3:9.3f} ms/paso  {share:5.1f}%")
+        lines.append(f"  {self.agent_steps} pasos de agentes; costo por tipo muestreado cada {self.sample_every} pasos:")
+        for kind, seconds in sorted(self.agent_seconds.items(), key=lambda item: -item[1]):
+            calls = self.agent_calls[kind]
+            lines.append(f"  {kind:<24} {calls:8d} llamadas  {seconds / calls * 1e6:9.2f} µs/llamada")
+        if self.routing:
+            lines.append("  rutas: " + ", ".join(f"{key}={value}" for key, value in self.routing.items()))
+        if self.telemetry:
+            lines.append(f"  telemetría: {self.telemetry['posts']} POST, {self.telemetry['errors']} errores, "
+                         f"{self.telemetry['mean_latency'] * 1e3:.2f} ms promedio, "
+                         f"{self.telemetry['max_latency'] * 1e3:.2f} ms máximo")
+        return "\n".join(lines)
+
+    def prometheus_text(self):
+        """ Totales de la corrida en el formato de texto de Prometheus. """
+        lines = [
+            "# TYPE city_steps_total counter",
+            f"city_steps_total {self.steps}",
+            "# TYPE city_step_phase_seconds_total counter",
+        ]
+        lines += [f'city_step_phase_seconds_total{{phase="{phase}"}} {seconds:.9f}'
+                  for phase, seconds in self.phase_seconds.items()]
+        lines += ["# TYPE city_agent_steps_total counter", f"city_agent_steps_total {self.agent_steps}"]
+        lines.append("# TYPE city_agent_sampled_step_seconds_total counter")
+        lines += [f'city_agent_sampled_step_seconds_total{{agent="{kind}"}} {seconds:.9f}'
+                  for kind, seconds in self.agent_seconds.items()]
+        lines.append("# TYPE city_agent_sampled_steps_total counter")
+        lines += [f'city_agent_sampled_steps_total{{agent="{kind}"}} {calls}' for kind, calls in self.agent_calls.items()]
+        lines.append("# TYPE city_routing_total counter")
+        lines += [f'city_routing_total{{counter="{name}"}} {value}' for name, value in self.routing.items()]
+        if self.telemetry:
+            lines += [
+                "# TYPE city_telemetry_posts_total counter",
+                f"city_telemetry_posts_total {self.telemetry['posts']}",
+                "# TYPE city_telemetry_errors_total counter",
+                f"city_telemetry_errors_total {self.telemetry['errors']}",
+                "# TYPE city_telemetry_max_latency_seconds gauge",
+                f"city_telemetry_max_latency_seconds {self.telemetry['max_latency']:.9f}",
+            ]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,465 @@
+from array import array
+from collections import OrderedDict, deque
+import heapq
+import operator
+
+import numpy as np
+
+INFINITY = float('inf')
+
+# Desde este número de nodos los árboles de siguiente salto se calculan con
+# numpy, un nivel de la búsqueda a la vez; en grafos chicos hay pocos nodos
+# por nivel y el recorrido en Python es más rápido
+VECTORIZED_TREE_NODES = 40_000
+# Memoria para los árboles de siguiente salto de una RouteTable (4 bytes por
+# nodo cada uno); pasado el límite se descarta el usado hace más tiempo
+TREE_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class RoadGraph:
+    """ Grafo de calles compilado con identificadores enteros por celda.
+
+    Cada celda (x, y) corresponde al nodo x * height + y. Las conexiones se
+    guardan en formato CSR: los vecinos del nodo n son
+    indices[indptr[n]:indptr[n + 1]]. También se guarda el grafo inverso
+    para las búsquedas hacia atrás desde un destino.
+    """
+
+    def __init__(self, width, height, indptr, indices, reverse=None):
+        self.width = width
+        self.height = height
+        self.num_nodes = width * height
+        self.indptr = indptr
+        self.indices = indices
+        self.rev_indptr, self.rev_indices = reverse if reverse is not None else self._transpose()
+
+    @classmethod
+    def from_connections(cls, connections, width, height):
+        counts = [0] * (width * height)
+        for (x, y), neighbors in connections.items():
+            counts[x * height + y] = len(neighbors)
+        indptr = array('i', [0]) * (width * height + 1)
+        for node, count in enumerate(counts):
+            indptr[node + 1] = indptr[node] + count
+        indices = array('i', [0]) * indptr[-1]
+        for (x, y), neighbors in connections.items():
+            offset = indptr[x * height + y]
+            for i, (nx, ny) in enumerate(neighbors):
+                indices[offset + i] = nx * height + ny
+        return cls(width, height, indptr, indices)
+
+    @classmethod
+    def from_edges(cls, width, height, sources, targets):
+        """ Compila arreglos de numpy con los nodos de origen y destino de cada arista.
+
+        El CSR y su inverso se arman con numpy, sin recorrer celdas en
+        Python; para mapas grandes generados. Los vecinos de cada nodo
+        quedan en el orden en que aparecen sus aristas.
+        """
+        num_nodes = width * height
+        sources = np.asarray(sources, dtype=np.intc)
+        targets = np.asarray(targets, dtype=np.intc)
+
+        def csr(keys, values):
+            order = np.argsort(keys, kind='stable')
+            indptr = np.zeros(num_nodes + 1, dtype=np.intc)
+            np.cumsum(np.bincount(keys, minlength=num_nodes), out=indptr[1:])
+            return array('i', indptr.tobytes()), array('i', values[order].tobytes())
+
+        indptr, indices = csr(sources, targets)
+        return cls(width, height, indptr, indices, reverse=csr(targets, sources))
+
+    def _transpose(self):
+        counts = [0] * self.num_nodes
+        for neighbor in self.indices:
+            counts[neighbor] += 1
+        rev_indptr = array('i', [0]) * (self.num_nodes + 1)
+        for node, count in enumerate(counts):
+            rev_indptr[node + 1] = rev_indptr[node] + count
+        rev_indices = array('i', [0]) * len(self.indices)
+        fill = array('i', rev_indptr[:-1])
+        indptr, indices = self.indptr, self.indices
+        for node in range(self.num_nodes):
+            for i in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[i]
+                rev_indices[fill[neighbor]] = node
+                fill[neighbor] += 1
+        return rev_indptr, rev_indices
+
+    def node(self, pos):
+        return pos[0] * self.height + pos[1]
+
+    def position(self, node):
+        return divmod(node, self.height)
+
+    def neighbors(self, node):
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def predecessors(self, node):
+        return self.rev_indices[self.rev_indptr[node]:self.rev_indptr[node + 1]]
+
+    def has_edge(self, node, neighbor):
+        return neighbor in self.neighbors(node)
+
+
+class RoutingStats:
+    """ Contadores de búsqueda, compartidos por la tabla de rutas y los replanificadores. """
+
+    def __init__(self):
+        self.route_queries = 0  # consultas a RouteTable.route
+        self.route_misses = 0  # rutas que no estaban memorizadas
+        self.trees_built = 0  # búsquedas hacia atrás desde un destino nuevo
+        self.tree_expansions = 0  # nodos visitados en esas búsquedas
+        self.trees_evicted = 0  # árboles descartados por TREE_CACHE_BYTES
+        self.replans = 0  # llamadas a DStarLite.path
+        self.replan_expansions = 0  # nodos expandidos por D* Lite
+        self.nearest_searches = 0  # búsquedas hacia adelante del destino más cercano
+        self.nearest_expansions = 0  # nodos visitados en esas búsquedas
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+# Grafos ya compilados en este proceso, por mapa de conexiones y tamaño
+_compiled_graphs = {}
+
+
+def compile_connections(connections, width, height):
+    """ Compila un mapa de conexiones una sola vez por proceso. """
+    key = (id(connections), width, height)
+    entry = _compiled_graphs.get(key)
+    if entry is None or entry[0] is not connections:
+        entry = (connections, RoadGraph.from_connections(connections, width, height))
+        _compiled_graphs[key] = entry
+    return entry[1]
+
+
+class Route:
+    """ Recorrido de una ruta: nodos de solo lectura y un cursor.
+
+    Los nodos no se copian: las rutas que da RouteTable comparten el
+    arreglo memorizado para su par (origen, destino), y una rebanada es
+    otra Route sobre el mismo arreglo. La ruta se ve como la secuencia de
+    celdas que faltan: len(), route[0] y la iteración empiezan en el
+    cursor, y advance() avanza una celda sin mover nada en memoria.
+    """
+
+    __slots__ = ('nodes', 'height', 'cursor', 'stop')
+
+    def __init__(self, nodes, height, cursor=0, stop=None):
+        self.nodes = nodes
+        self.height = height
+        self.cursor = cursor
+        self.stop = len(nodes) if stop is None else stop
+
+    def __len__(self):
+        return self.stop - self.cursor
+
+    def __bool__(self):
+        return self.cursor < self.stop
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.stop - self.cursor)
+            if step != 1:
+                raise ValueError("Una ruta sólo se rebana con paso 1")
+            return Route(self.nodes, self.height, self.cursor + start, self.cursor + max(start, stop))
+        index = operator.index(index)  # acepta enteros de numpy y bool; rechaza el resto con TypeError
+        position = (self.cursor if index >= 0 else self.stop) + index
+        if self.cursor <= position < self.stop:
+            return divmod(self.nodes[position], self.height)
+        raise IndexError("Índice fuera de la ruta")
+
+    def __iter__(self):
+        height = self.height
+        for i in range(self.cursor, self.stop):
+            yield divmod(self.nodes[i], height)
+
+    def advance(self):
+        """ Pasa a la siguiente celda. """
+        self.cursor += 1
+
+    def node_ids(self):
+        """ Nodos que faltan, sin copiarlos si el arreglo es de la tabla de rutas. """
+        return self.nodes[self.cursor:self.stop]
+
+
+class RouteTable:
+    """ Tabla de rutas compartida sobre el grafo compilado de calles.
+
+    Para cada destino se guarda un árbol de 'siguiente salto' calculado con
+    una búsqueda hacia atrás desde el destino, de modo que cualquier origen
+    puede recorrer la ruta más corta sin volver a buscar. Las rutas ya
+    recorridas se memorizan por par (origen, destino) como arreglos de
+    nodos de solo lectura, y route() devuelve una Route sobre ellos.
+
+    Se guardan a lo más max_trees árboles (por defecto, los que caben en
+    TREE_CACHE_BYTES, y nunca menos que los endpoints precalculados); el
+    usado hace más tiempo se descarta y se recalcula si vuelve a hacer falta.
+    """
+
+    def __init__(self, graph, endpoints=(), stats=None, max_trees=None):
+        self.graph = graph
+        self.stats = stats if stats is not None else RoutingStats()
+        if max_trees is None:
+            max_trees = max(len(endpoints), TREE_CACHE_BYTES // (4 * max(graph.num_nodes, 1)), 1)
+        self.max_trees = max_trees
+        self.next_hop = OrderedDict()  # nodo destino -> array con el siguiente nodo hacia el destino, en orden de uso
+        self.routes = {}  # (nodo origen, nodo destino) -> memoryview de solo lectura de los nodos
+        self._reverse = None  # grafo inverso como arreglos de numpy, para los árboles vectorizados
+        for goal in endpoints:
+            self.tree(graph.node(goal))
+
+    def tree(self, goal):
+        hops = self.next_hop.get(goal)
+        if hops is not None:
+            self.next_hop.move_to_end(goal)
+            return hops
+        if self.graph.num_nodes >= VECTORIZED_TREE_NODES:
+            hops, expansions = self._vectorized_tree(goal)
+        else:
+            hops, expansions = self._tree(goal)
+        self.next_hop[goal] = hops
+        if len(self.next_hop) > self.max_trees:
+            self.next_hop.popitem(last=False)
+            self.stats.trees_evicted += 1
+        self.stats.trees_built += 1
+        self.stats.tree_expansions += expansions
+        return hops
+
+    def _tree(self, goal):
+        # Búsqueda hacia atrás en anchura desde goal
+        graph = self.graph
+        rev_indptr, rev_indices = graph.rev_indptr, graph.rev_indices
+        hops = array('i', [-1]) * graph.num_nodes
+        hops[goal] = goal
+        frontier = deque([goal])
+        expansions = 1
+        while frontier:
+            current = frontier.popleft()
+            for i in range(rev_indptr[current], rev_indptr[current + 1]):
+                previous = rev_indices[i]
+                if hops[previous] == -1:
+                    hops[previous] = current
+                    frontier.append(previous)
+                    expansions += 1
+        return hops, expansions
+
+    def _vectorized_tree(self, goal):
+        # La misma búsqueda, un nivel a la vez sobre el CSR inverso. Dentro de un
+        # nivel los nodos quedan en el orden en que los descubriría la cola de
+        # _tree, y de un nodo repetido gana su primera aparición, así que el árbol
+        # es idéntico
+        if self._reverse is None:
+            graph = self.graph
+            self._reverse = (np.frombuffer(graph.rev_indptr, dtype=np.intc),
+                             np.frombuffer(graph.rev_indices, dtype=np.intc))
+        rev_indptr, rev_indices = self._reverse
+        hops = np.full(self.graph.num_nodes, -1, dtype=np.intc)
+        hops[goal] = goal
+        frontier = np.array([goal], dtype=np.intc)
+        expansions = 1
+        while len(frontier):
+            first = rev_indptr[frontier]
+            counts = rev_indptr[frontier + 1] - first
+            parents = np.repeat(frontier, counts)
+            edges = np.arange(len(parents), dtype=np.intc) + np.repeat(first - (np.cumsum(counts) - counts), counts)
+            previous = rev_indices[edges]
+            new = hops[previous] == -1
+            previous, parents = previous[new], parents[new]
+            # Asignar al revés: con índices repetidos queda la última escritura, la primera aparición
+            hops[previous[::-1]] = parents[::-1]
+            frontier = previous[hops[previous] == parents]
+            expansions += len(frontier)
+        return array('i', hops.tobytes()), expansions
+
+    def route_nodes(self, start, goal):
+        """ Nodos de la ruta más corta de start a goal, sin incluir el inicial. """
+        hops = self.tree(goal)
+        path = []
+        if start != goal and hops[start] != -1:
+            current = start
+            while current != goal:
+                current = hops[current]
+                path.append(current)
+        return path
+
+    def nearest(self, start, is_goal, is_fallback=None):
+        """ Nodo más cercano a start que cumple is_goal, o None si no se alcanza ninguno.
+
+        Es una sola búsqueda hacia adelante con todos los candidatos como
+        destino (Dijkstra con costo 1 por celda, o sea, en anchura) que se
+        detiene en el primero que alcanza; start no cuenta como candidato.
+        Si ninguno cumple is_goal, devuelve el primer nodo visitado que
+        cumple is_fallback. La ruta encontrada se memoriza como las de
+        route(), así que pedirla después no construye el árbol del destino.
+        """
+        graph = self.graph
+        indptr, indices = graph.indptr, graph.indices
+        parents = {start: start}
+        frontier = deque([start])
+        goal = fallback = None
+        while frontier and goal is None:
+            current = frontier.popleft()
+            for i in range(indptr[current], indptr[current + 1]):
+                neighbor = indices[i]
+                if neighbor not in parents:
+                    parents[neighbor] = current
+                    if is_goal(neighbor):
+                        goal = neighbor
+                        break
+                    if fallback is None and is_fallback is not None and is_fallback(neighbor):
+                        fallback = neighbor
+                    frontier.append(neighbor)
+        if goal is None:
+            goal = fallback
+        self.stats.nearest_searches += 1
+        self.stats.nearest_expansions += len(parents)
+        if goal is not None and (start, goal) not in self.routes:
+            path = []
+            node = goal
+            while node != start:
+                path.append(node)
+                node = parents[node]
+            path.reverse()
+            self.routes[(start, goal)] = memoryview(array('i', path)).toreadonly()
+        return goal
+
+    def route(self, start, goal):
+        """ Route más corta de start a goal, sin incluir la celda inicial. """
+        graph = self.graph
+        key = (graph.node(start), graph.node(goal))
+        self.stats.route_queries += 1
+        nodes = self.routes.get(key)
+        if nodes is None:
+            self.stats.route_misses += 1
+            nodes = memoryview(array('i', self.route_nodes(*key))).toreadonly()
+            self.routes[key] = nodes
+        return Route(nodes, graph.height)
+
+
+class DStarLite:
+    """ Replanificador incremental D* Lite sobre el grafo compilado.
+
+    La búsqueda se hace hacia atrás desde el destino, así que cuando el
+    coche avanza o cambia el costo de entrar a una celda (por congestión o
+    un semáforo en rojo) sólo se actualizan los nodos afectados en lugar de
+    repetir la búsqueda completa.
+    """
+
+    def __init__(self, graph, start, goal, stats=None):
+        self.graph = graph
+        self.stats = stats if stats is not None else RoutingStats()
+        self.start = start
+        self.last = start
+        self.goal = goal
+        self.km = 0
+        self.g = {}
+        self.rhs = {goal: 0}
+        self.extra_costs = {}  # costo adicional por entrar a un nodo
+        self.queue = []
+        self.queued = {}  # nodo -> llave vigente en la cola
+        self.push(goal)
+
+    def heuristic(self, a, b):
+        ax, ay = divmod(a, self.graph.height)
+        bx, by = divmod(b, self.graph.height)
+        return abs(ax - bx) + abs(ay - by)
+
+    def calculate_key(self, node):
+        best = min(self.g.get(node, INFINITY), self.rhs.get(node, INFINITY))
+        return (best + self.heuristic(self.start, node) + self.km, best)
+
+    def push(self, node):
+        key = self.calculate_key(node)
+        self.queued[node] = key
+        heapq.heappush(self.queue, (key, node))
+
+    def update_vertex(self, node):
+        graph = self.graph
+        if node != self.goal:
+            indptr, indices = graph.indptr, graph.indices
+            best = INFINITY
+            for i in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[i]
+                cost = 1 + self.extra_costs.get(neighbor, 0) + self.g.get(neighbor, INFINITY)
+                if cost < best:
+                    best = cost
+            self.rhs[node] = best
+        if self.g.get(node, INFINITY) != self.rhs.get(node, INFINITY):
+            self.push(node)
+        else:
+            self.queued.pop(node, None)
+
+    def compute_shortest_path(self):
+        graph = self.graph
+        rev_indptr, rev_indices = graph.rev_indptr, graph.rev_indices
+        queue, queued, g, rhs = self.queue, self.queued, self.g, self.rhs
+        expansions = 0
+        while queue:
+            key, node = queue[0]
+            if queued.get(node) != key:
+                # Entrada obsoleta: el nodo ya se sacó o se volvió a encolar
+                heapq.heappop(queue)
+                continue
+            start_key = self.calculate_key(self.start)
+            if key >= start_key and rhs.get(self.start, INFINITY) == g.get(self.start, INFINITY):
+                break
+            new_key = self.calculate_key(node)
+            if key < new_key:
+                heapq.heapreplace(queue, (new_key, node))
+                queued[node] = new_key
+                continue
+            heapq.heappop(queue)
+            del queued[node]
+            expansions += 1
+            if g.get(node, INFINITY) > rhs.get(node, INFINITY):
+                g[node] = rhs[node]
+            else:
+                g[node] = INFINITY
+                self.update_vertex(node)
+            for i in range(rev_indptr[node], rev_indptr[node + 1]):
+                self.update_vertex(rev_indices[i])
+        self.stats.replan_expansions += expansions
+
+    def move_to(self, node):
+        """ Actualiza la posición de inicio después de que el coche avanzó. """
+        if node != self.start:
+            self.km += self.heuristic(self.last, node)
+            self.last = node
+            self.start = node
+
+    def set_cost(self, node, extra):
+        """ Cambia el costo adicional por entrar a un nodo. """
+        if self.extra_costs.get(node, 0) == extra:
+            return
+        if extra:
+            self.extra_costs[node] = extra
+        else:
+            self.extra_costs.pop(node, None)
+        graph = self.graph
+        for i in range(graph.rev_indptr[node], graph.rev_indptr[node + 1]):
+            self.update_vertex(graph.rev_indices[i])
+
+    def path(self):
+        """ Nodos de la ruta desde el inicio actual, sin incluir el inicial. """
+        self.stats.replans += 1
+        self.compute_shortest_path()
+        graph = self.graph
+        indptr, indices, g = graph.indptr, graph.indices, self.g
+        path = []
+        current = self.start
+        if g.get(current, INFINITY) == INFINITY:
+            return path
+        while current != self.goal and len(path) < graph.num_nodes:
+            best, best_cost = None, INFINITY
+            for i in range(indptr[current], indptr[current + 1]):
+                neighbor = indices[i]
+                cost = 1 + self.extra_costs.get(neighbor, 0) + g.get(neighbor, INFINITY)
+                if cost < best_cost:
+                    best, best_cost = neighbor, cost
+            if best is None:
+                return []
+            path.append(best)
+            current = best
+        return path
@@ -0,0 +1,98 @@
+import json
+import logging
+import sys
+
+# Registro de la simulación por subsistema. Cada módulo pide su logger con
+# logging.getLogger("city.<subsistema>") y pasa los datos como argumentos
+# (log.debug("Car %s waiting at %s", car_id, cell)), así el mensaje sólo se
+# formatea si el nivel del subsistema lo deja pasar.
+ROOT = "city"
+SUBSYSTEMS = ('model', 'cars', 'lights', 'emergency', 'telemetry', 'profiler', 'bench')
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+
+CONSOLE_FORMAT = "%(levelname)s %(name)s: %(message)s"
+
+
+class JsonlEventHandler(logging.Handler):
+    """ Guarda cada registro como una línea JSON para reproducir una corrida.
+
+    Los registros se acumulan en memoria y se escriben de buffer_size en
+    buffer_size, de modo que el archivo no se toca en cada paso. Cada línea
+    lleva el logger, el nivel, la plantilla del mensaje y sus argumentos por
+    separado para poder filtrarlos sin volver a interpretar el texto.
+    """
+
+    def __init__(self, path, buffer_size=1000):
+        super().__init__()
+        self.stream = open(path, 'a', encoding='utf-8')
+        self.buffer_size = buffer_size
+        self.buffer = []
+
+    def emit(self, record):
+        # Se serializa al emitir: los argumentos pueden cambiar después (p. ej. listas de ruta)
+        self.buffer.append(json.dumps({
+            "time": record.created,
+            "logger": record.name,
+            "level": record.levelname,
+            "event": record.msg,
+            "args": record.args,
+        }, default=str))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.buffer:
+                self.stream.write("\n".join(self.buffer) + "\n")
+                self.buffer = []
+            self.stream.flush()
+
+    def close(self):
+        self.flush()
+        self.stream.close()
+        super().close()
+
+
+def parse_levels(specs):
+    """ ['cars=DEBUG', 'lights=INFO'] -> {'cars': 'DEBUG', 'lights': 'INFO'} """
+    levels = {}
+    for spec in specs:
+        subsystem, _, level = spec.partition('=')
+        if subsystem not in SUBSYSTEMS or level.upper() not in LEVELS:
+            raise ValueError(f"Nivel de registro inválido: {spec}")
+        levels[subsystem] = level.upper()
+    return levels
+
+
+def configure(level='INFO', levels=None, console=True, events=None, buffer_size=1000):
+    """ Configura los loggers de la simulación.
+
+    level es el nivel por defecto y levels lo cambia por subsistema, p. ej.
+    {'cars': 'DEBUG'}. Con events se agrega un JsonlEventHandler en esa
+    ruta con lo mismo que pasa los niveles. Se puede llamar varias veces;
+    cada llamada reemplaza la configuración anterior.
+    """
+    root = logging.getLogger(ROOT)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.setLevel(level.upper())
+    root.propagate = False
+    for subsystem in SUBSYSTEMS:
+        logging.getLogger(f"{ROOT}.{subsystem}").setLevel((levels or {}).get(subsystem, logging.NOTSET))
+
+    if console:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        root.addHandler(handler)
+    else:
+        root.addHandler(logging.NullHandler())
+    if events:
+        root.addHandler(JsonlEventHandler(events, buffer_size))
+    return root
+
+
+def shutdown():
+    """ Escribe lo pendiente del registro de eventos. """
+    for handler in logging.getLogger(ROOT).handlers:
+        handler.flush()
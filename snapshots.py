@@ -0,0 +1,89 @@
+import hashlib
+import json
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+# Snapshots del relay en memoria compartida, para servir los GET desde varios
+# procesos. El proceso escritor (el que recibe los POST de la simulación)
+# publica el estado de cada sesión en un segmento propio; los procesos
+# lectores lo copian sin tomar candados entre procesos.
+#
+# Cada segmento empieza con un encabezado: un contador de escrituras, impar
+# mientras se escribe (como un seqlock), la longitud del contenido y si la
+# sesión se cerró. El contenido es el JSON del Snapshot más el token de ETag
+# de la sesión, para que todos los lectores den los mismos ETag.
+
+HEADER = struct.Struct('<QIB')  # escrituras, longitud, cerrada
+SEGMENT_BYTES = 4 * 1024 * 1024  # sólo ocupan memoria las páginas que se escriben
+
+
+def segment_name(prefix, session_id):
+    # Los identificadores de sesión pueden tener caracteres que no van en un nombre de segmento
+    return prefix + hashlib.md5(session_id.encode()).hexdigest()[:16]
+
+
+class SharedSnapshots:
+    """ Lado escritor: un segmento por sesión con su último Snapshot. """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.segments = {}  # sesión -> SharedMemory
+
+    def publish(self, session_id, token, snapshot):
+        """ Escribe snapshot; ValueError si no cabe en SEGMENT_BYTES. """
+        payload = json.dumps({"token": token, "version": snapshot.version, "seq": snapshot.seq,
+                              "cars": snapshot.cars, "lights": snapshot.lights}).encode()
+        if HEADER.size + len(payload) > SEGMENT_BYTES:
+            raise ValueError(f"El estado de la sesión {session_id} no cabe en la memoria compartida")
+        segment = self.segments.get(session_id)
+        if segment is None:
+            segment = shared_memory.SharedMemory(segment_name(self.prefix, session_id), create=True, size=SEGMENT_BYTES)
+            self.segments[session_id] = segment
+        buffer = segment.buf
+        writes = HEADER.unpack_from(buffer)[0]
+        HEADER.pack_into(buffer, 0, writes + 1, 0, 0)
+        buffer[HEADER.size:HEADER.size + len(payload)] = payload
+        HEADER.pack_into(buffer, 0, writes + 2, len(payload), 0)
+
+    def remove(self, session_id):
+        """ Marca la sesión como cerrada para los lectores y libera su segmento. """
+        segment = self.segments.pop(session_id, None)
+        if segment is not None:
+            writes = HEADER.unpack_from(segment.buf)[0]
+            HEADER.pack_into(segment.buf, 0, writes + 2, 0, 1)
+            segment.close()
+            segment.unlink()
+
+    def close(self):
+        for session_id in list(self.segments):
+            self.remove(session_id)
+
+
+class SnapshotReader:
+    """ Lado lector: el último contenido publicado de una sesión, decodificado una vez por escritura. """
+
+    def __init__(self, prefix, session_id):
+        self.segment = shared_memory.SharedMemory(segment_name(prefix, session_id))
+        # El segmento es del escritor: que este proceso no lo borre al terminar
+        resource_tracker.unregister(self.segment._name, 'shared_memory')
+        self.writes = None
+        self.content = None
+
+    def read(self):
+        """ {"token", "version", "seq", "cars", "lights"}, o None si la sesión se cerró. """
+        buffer = self.segment.buf
+        while True:
+            writes, length, closed = HEADER.unpack_from(buffer)
+            if closed:
+                return None
+            if writes == self.writes:
+                return self.content
+            if writes % 2:
+                continue  # el escritor va a la mitad
+            payload = bytes(buffer[HEADER.size:HEADER.size + length])
+            if HEADER.unpack_from(buffer)[0] == writes:
+                self.writes, self.content = writes, json.loads(payload)
+                return self.content
+
+    def close(self):
+        self.segment.close()
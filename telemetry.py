@@ -0,0 +1,249 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import wire
+
+SERVER_URL = "http://127.0.0.1:5000"
+
+log = logging.getLogger("city.telemetry")
+
+TELEMETRY_MODES = ('off', 'sync', 'batched')
+BACKPRESSURE_POLICIES = ('drop', 'block')
+WIRE_FORMATS = ('json', 'binary')
+
+# El hilo de envío de 'batched' termina tras estos segundos sin nada que
+# enviar y vuelve a arrancar con la siguiente publicación, así que un
+# publicador que nadie cierra no deja un hilo vivo para siempre
+SENDER_IDLE_SECONDS = 5.0
+
+# Endpoints que aceptan el formato binario de wire.py; el resto siempre va en JSON
+BINARY_ENCODERS = {
+    "/update_frame": wire.encode_frame,
+    "/update_car_positions": wire.encode_positions,
+}
+
+
+def merge_updates(pending, payload):
+    """ Combina dos actualizaciones de un mismo endpoint; la más reciente gana. """
+    pending.update(payload)
+    return pending
+
+
+def merge_frames(pending, frame):
+    """ Combina dos cuadros delta consecutivos en uno que cubre ambos pasos. """
+    pending["seq"] = frame["seq"]
+    pending["keyframe"] = pending["keyframe"] or frame["keyframe"]
+    pending["cars"].update(frame["cars"])
+    for key, light in frame["lights"].items():
+        pending["lights"].setdefault(key, {}).update(light)
+    return pending
+
+
+class TelemetryPublisher:
+    """ Publica la telemetría de la simulación en el servidor Flask.
+
+    - 'off': descarta todo, para corridas sin servidor.
+    - 'sync': envía cada actualización en cuanto se publica, reutilizando
+      una sesión con conexiones persistentes.
+    - 'batched': un hilo en segundo plano envía las actualizaciones cada
+      batch_ticks pasos. Las actualizaciones de un mismo endpoint que se
+      acumulan mientras tanto se combinan, de modo que sólo viaja el
+      estado más reciente.
+
+    Con wire_format='binary' los cuadros y las posiciones de coches viajan
+    en el formato compacto de wire.py en lugar de JSON.
+
+    Con session_id las actualizaciones van a /sessions/<session_id>/... del
+    relay, para que varias simulaciones compartan un mismo servidor.
+
+    Si el servidor no alcanza a la simulación, backpressure decide qué
+    hacer: 'drop' sigue combinando (se pierden los cuadros intermedios) y
+    'block' detiene la simulación cuando hay max_pending pasos sin enviar,
+    hasta que el hilo de envío se ponga al día; el hilo envía en cuanto se
+    juntan min(batch_ticks, max_pending) pasos. max_pending sólo aplica a
+    'block': con 'drop' lo pendiente ya está acotado a un payload por
+    endpoint, sin importar cuántos pasos se acumulen.
+
+    En 'batched' el hilo de envío arranca con la primera publicación y
+    termina solo tras SENDER_IDLE_SECONDS sin trabajo; si muere por un
+    error que no es de red, publish() y tick() lanzan RuntimeError en vez
+    de esperar para siempre. close() lo detiene y libera la sesión HTTP.
+    """
+
+    def __init__(self, mode='batched', base_url=SERVER_URL, batch_ticks=5, max_pending=50,
+                 backpressure='drop', timeout=2.0, pool_size=4, wire_format='json', session_id=None):
+        if mode not in TELEMETRY_MODES:
+            raise ValueError(f"Modo de telemetría desconocido: {mode}")
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Política de backpressure desconocida: {backpressure}")
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"Formato de envío desconocido: {wire_format}")
+        if batch_ticks < 1 or max_pending < 1:
+            raise ValueError("batch_ticks y max_pending deben ser al menos 1")
+        self.mode = mode
+        self.session_id = session_id
+        self.base_url = base_url if session_id is None else f"{base_url}/sessions/{session_id}"
+        self.batch_ticks = batch_ticks
+        self.max_pending = max_pending
+        self.backpressure = backpressure
+        # Pasos pendientes que despiertan al hilo de envío; con 'block' nunca más
+        # de los que detienen la simulación, o ambos se esperarían mutuamente
+        self.send_ticks = batch_ticks if backpressure == 'drop' else min(batch_ticks, max_pending)
+        self.timeout = timeout
+        self.wire_format = wire_format
+
+        # Estadísticas de envío
+        self.posts_sent = 0
+        self.post_errors = 0
+        self.frames_coalesced = 0
+        self.last_error = None
+        self.post_seconds = 0.0  # tiempo total de los POST, incluidos los fallidos
+        self.max_post_seconds = 0.0
+
+        # El servidor pide un cuadro completo cuando pierde la secuencia de deltas
+        self.resync_requested = False
+
+        self.session = None
+        if mode != 'off':
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+
+        self._condition = threading.Condition()
+        self._pending = {}  # endpoint -> (payload, función para combinar)
+        self._pending_ticks = 0
+        self._sending = False
+        self._flush_requested = False
+        self._closed = False
+        self._thread = None
+        self.sender_error = None  # excepción con la que murió el hilo de envío
+
+    def publish(self, endpoint, payload, merge=merge_updates):
+        """ Publica un payload; el publicador se queda con el objeto. """
+        if self.mode == 'off':
+            return
+        if self.mode == 'sync':
+            self._post(endpoint, payload)
+            return
+        with self._condition:
+            self._ensure_sender()
+            if endpoint in self._pending:
+                pending, _ = self._pending[endpoint]
+                self._pending[endpoint] = (merge(pending, payload), merge)
+            else:
+                self._pending[endpoint] = (payload, merge)
+
+    def tick(self):
+        """ Marca el final de un paso de la simulación. """
+        if self.mode != 'batched':
+            return
+        with self._condition:
+            self._ensure_sender()
+            self._pending_ticks += 1
+            if self._pending_ticks >= self.send_ticks:
+                self._condition.notify_all()
+            if self.backpressure == 'block':
+                while self._pending_ticks >= self.max_pending and not self._closed:
+                    self._condition.wait()
+                    self._check_sender()
+
+    def flush(self):
+        """ Envía lo pendiente y espera a que el hilo de envío termine. """
+        if self.mode != 'batched':
+            return
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify_all()
+            while (self._pending or self._sending) and self._thread is not None and self.sender_error is None:
+                self._condition.wait()
+            self._flush_requested = False
+
+    def close(self):
+        self.flush()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        if self.session is not None:
+            self.session.close()
+
+    def _check_sender(self):
+        # Se llama con el candado tomado
+        if self.sender_error is not None:
+            raise RuntimeError("El hilo de envío de telemetría terminó con un error") from self.sender_error
+
+    def _ensure_sender(self):
+        # Se llama con el candado tomado: arranca el hilo de envío si no está corriendo
+        self._check_sender()
+        if self._thread is None and not self._closed:
+            self._thread = threading.Thread(target=self._run, name="telemetry-publisher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            self._send_loop()
+        except Exception as error:
+            log.exception("El hilo de envío de telemetría terminó con un error")
+            with self._condition:
+                self.sender_error = error
+                self._sending = False
+                self._condition.notify_all()
+
+    def _send_loop(self):
+        while True:
+            with self._condition:
+                while not self._closed and not (
+                        self._pending_ticks >= self.send_ticks or (self._pending and self._flush_requested)):
+                    if not self._condition.wait(SENDER_IDLE_SECONDS):
+                        if not self._pending and not self._pending_ticks:
+                            # Sin trabajo: el hilo termina y la siguiente publicación lo vuelve a arrancar
+                            self._thread = None
+                            return
+                        break  # nadie completó el lote a tiempo: se envía lo que haya
+                if self._closed and not self._pending:
+                    self._thread = None
+                    return
+                batch = self._pending
+                if batch and self._pending_ticks > 1:
+                    self.frames_coalesced += self._pending_ticks - 1
+                self._pending = {}
+                self._pending_ticks = 0
+                self._sending = True
+                self._condition.notify_all()
+            try:
+                for endpoint, (payload, _) in batch.items():
+                    self._post(endpoint, payload)
+            finally:
+                with self._condition:
+                    self._sending = False
+                    self._condition.notify_all()
+
+    def _post(self, endpoint, payload):
+        start = time.perf_counter()
+        try:
+            encoder = BINARY_ENCODERS.get(endpoint) if self.wire_format == 'binary' else None
+            if encoder is not None:
+                response = self.session.post(self.base_url + endpoint, data=encoder(payload),
+                                             headers={"Content-Type": wire.CONTENT_TYPE}, timeout=self.timeout)
+            else:
+                response = self.session.post(self.base_url + endpoint, json=payload, timeout=self.timeout)
+            self.posts_sent += 1
+            if response.status_code == 409:
+                log.debug("El servidor pidió un cuadro completo (seq %s)", payload.get("seq"))
+                self.resync_requested = True
+        except requests.RequestException as error:
+            self.post_errors += 1
+            self.last_error = error
+            log.debug("Error enviando %s: %s", endpoint, error)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.post_seconds += elapsed
+            if elapsed > self.max_post_seconds:
+                self.max_post_seconds = elapsed
@@ -0,0 +1,23 @@
+import pytest
+
+import main
+import tarea
+
+# Pasos de sobra para que todos los coches lleguen en el mapa fijo de 24x24
+MAX_STEPS = 400
+
+
+@pytest.mark.parametrize('model', [tarea, main], ids=['tarea', 'main'])
+@pytest.mark.parametrize('engine', ['agents', 'vectorized'])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_nearest_mode_all_cars_arrive(model, engine, seed):
+    # La elección codiciosa no debe emparejar coches que se cruzan de frente
+    city = model.City(24, 24, telemetry='off', destination_mode='nearest', engine=engine, seed=seed)
+    for _ in range(MAX_STEPS):
+        if not city.running:
+            break
+        city.step()
+    summary = city.summary()
+    assert summary['arrived'] == summary['cars'] == 17
+    # Al llegar, las reservas ya no guardan la salida de su dueño
+    assert not city.parking_allocator.origins
@@ -0,0 +1,69 @@
+import struct
+
+# Formato binario compacto para posiciones y semáforos entre City, el
+# servidor Flask y Unity. Todo es little-endian:
+#   encabezado: magia 'EV', versión, banderas, seq, base_seq, #coches, #semáforos
+#   registros:  id (int32), x (int16), y (int16), estado (uint8)
+# Los registros de coches van primero. Un semáforo sin posición conocida
+# (en un cuadro delta) lleva x = y = -1.
+CONTENT_TYPE = "application/x-evidencia-frame"
+MAGIC = b"EV"
+VERSION = 1
+KEYFRAME = 0x01
+
+FRAME_HEADER = struct.Struct('<2sBBiiII')
+RECORD = struct.Struct('<ihhB')
+
+STATE_CODES = {None: 0, 'green': 1, 'yellow': 2, 'red': 3}
+STATE_NAMES = {code: name for name, code in STATE_CODES.items()}
+
+
+def agent_number(key):
+    """ 'car_205' -> 205, 'traffic_light_3' -> 3 """
+    return int(key.rsplit('_', 1)[1])
+
+
+def encode_frame(frame):
+    cars = frame.get("cars", {})
+    lights = frame.get("lights", {})
+    seq = frame.get("seq") or 0
+    buffer = bytearray(FRAME_HEADER.size + RECORD.size * (len(cars) + len(lights)))
+    FRAME_HEADER.pack_into(buffer, 0, MAGIC, VERSION, KEYFRAME if frame.get("keyframe") else 0,
+                           seq, frame.get("base_seq", seq), len(cars), len(lights))
+    offset = FRAME_HEADER.size
+    for key, (x, y) in cars.items():
+        RECORD.pack_into(buffer, offset, agent_number(key), x, y, 0)
+        offset += RECORD.size
+    for key, light in lights.items():
+        x, y = light.get("position") or (-1, -1)
+        RECORD.pack_into(buffer, offset, agent_number(key), x, y, STATE_CODES[light.get("state")])
+        offset += RECORD.size
+    return bytes(buffer)
+
+
+def decode_frame(data):
+    if len(data) < FRAME_HEADER.size:
+        raise ValueError("Cuadro binario incompleto")
+    magic, version, flags, seq, base_seq, num_cars, num_lights = FRAME_HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Cuadro binario con formato desconocido")
+    if len(data) != FRAME_HEADER.size + RECORD.size * (num_cars + num_lights):
+        raise ValueError("Cuadro binario con longitud incorrecta")
+
+    cars = {}
+    lights = {}
+    records = RECORD.iter_unpack(memoryview(data)[FRAME_HEADER.size:])
+    for i, (number, x, y, state) in enumerate(records):
+        if i < num_cars:
+            cars[f"car_{number}"] = [x, y]
+        else:
+            light = {"state": STATE_NAMES[state]}
+            if x >= 0:
+                light["position"] = [x, y]
+            lights[f"traffic_light_{number}"] = light
+    return {"seq": seq, "base_seq": base_seq, "keyframe": bool(flags & KEYFRAME), "cars": cars, "lights": lights}
+
+
+def encode_positions(positions, seq=0):
+    """ Posiciones de coches {'car_205': [x, y]} como cuadro completo sin semáforos. """
+    return encode_frame({"seq": seq, "keyframe": True, "cars": positions, "lights": {}})